@@ -0,0 +1 @@
+# Benchmark hiệu năng - chạy từ thư mục backend: python -m benchmarks.<tên>
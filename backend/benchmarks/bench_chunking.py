@@ -0,0 +1,44 @@
+"""
+So sánh chunker cũ (theo ký tự) và chunker theo token: số lời gọi LLM,
+tổng token gửi đi (nội dung + template lặp lại mỗi lời gọi), chunk lớn nhất.
+
+    python -m benchmarks.bench_chunking [file.pdf|file.txt|thư mục ...]
+"""
+import sys
+import time
+from config.settings import settings
+from services.pdf_utils import chunk_text, chunk_text_by_chars
+from services.token_utils import count_tokens, chunk_token_budget, context_window, PROMPT_TEMPLATE_TOKENS
+from benchmarks.corpus import load_corpus
+
+
+def measure(chunks):
+    tokens = [count_tokens(c) for c in chunks]
+    return {
+        "calls": len(chunks),
+        "total_tokens": sum(tokens) + PROMPT_TEMPLATE_TOKENS * len(chunks),
+        "max_chunk": max(tokens) if tokens else 0,
+    }
+
+
+def main(paths):
+    budget = chunk_token_budget()
+    limit = context_window() - PROMPT_TEMPLATE_TOKENS - settings.ai_max_tokens
+    print(f"Model: {settings.openai_model} | context: {context_window()} | chunk budget: {budget} tokens")
+    print(f"{'document':<22}{'chunker':<10}{'calls':>7}{'tokens':>10}{'max chunk':>11}{'over':>6}{'ms':>9}")
+
+    for name, text in load_corpus(paths):
+        for label, fn in [
+            ("chars", lambda t: chunk_text_by_chars(t, settings.max_chunk_chars, settings.chunk_overlap)),
+            ("tokens", lambda t: chunk_text(t)),
+        ]:
+            start = time.perf_counter()
+            chunks = fn(text)
+            elapsed = (time.perf_counter() - start) * 1000
+            m = measure(chunks)
+            over = "yes" if m["max_chunk"] > limit else "no"
+            print(f"{name[:21]:<22}{label:<10}{m['calls']:>7}{m['total_tokens']:>10}{m['max_chunk']:>11}{over:>6}{elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+"""
+So sánh kiểm tra bám nguồn của check_hallucination / validate_question_relevance:
+quét chuỗi cả tài liệu cho mỗi từ khóa (cách cũ) với tra SourceIndex dựng một lần.
+
+    python -m benchmarks.bench_grounding
+"""
+import random
+import time
+from services.lexical import SourceIndex
+from benchmarks.corpus import synthetic_pages
+
+STOPWORDS = {'của', 'và', 'cho', 'với', 'trong', 'trên', 'dưới', 'được', 'là', 'có',
+             'the', 'and', 'for', 'with', 'from', 'this', 'that', 'are', 'was'}
+
+
+def synthetic_keywords(text: str, questions: int, per_question: int = 25, seed: int = 7):
+    """Từ khóa giống validator tách ra: phần lớn có trong tài liệu, một phần là từ lạ"""
+    rng = random.Random(seed)
+    vocabulary = sorted({w.strip('.,?!:;"()[]{}').lower() for w in text.split() if len(w) >= 4} - STOPWORDS)
+    result = []
+    for q in range(questions):
+        words = [rng.choice(vocabulary) for _ in range(per_question - 2)]
+        words += [f"hallucinated{q}", f"khongco{q}"]
+        result.append(words)
+    return result
+
+
+def legacy_matches(text: str, keyword_sets):
+    source_lower = text.lower()
+    return [sum(1 for kw in kws if kw in source_lower) for kws in keyword_sets]
+
+
+def indexed_matches(index: SourceIndex, keyword_sets):
+    return [sum(1 for kw in kws if index.contains(kw)) for kws in keyword_sets]
+
+
+def main():
+    # Mỗi lần tạo câu hỏi chạy hai bộ kiểm tra (check_hallucination + validate_question_relevance)
+    print(f"{'trang':>6}{'câu':>6}{'legacy ms':>12}{'dựng ms':>10}{'tra ms':>9}{'x':>7}{'khớp giống':>12}")
+    for pages, questions in ((30, 20), (100, 50), (300, 100), (300, 300)):
+        text = "\n\n".join(synthetic_pages(pages))
+        keyword_sets = synthetic_keywords(text, questions)
+
+        started = time.perf_counter()
+        legacy = [legacy_matches(text, keyword_sets) for _ in range(2)][0]
+        legacy_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        index = SourceIndex(text)
+        build_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        indexed = [indexed_matches(index, keyword_sets) for _ in range(2)][0]
+        lookup_ms = (time.perf_counter() - started) * 1000
+
+        same = sum(1 for a, b in zip(legacy, indexed) if a == b) / len(legacy)
+        print(f"{pages:>6}{questions:>6}{legacy_ms:>12.1f}{build_ms:>10.1f}{lookup_ms:>9.2f}"
+              f"{legacy_ms / (build_ms + lookup_ms):>7.1f}{same:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+So sánh các engine trích xuất PDF: số trang/giây, RSS đỉnh và số ký tự lấy được.
+Mỗi lần đo chạy trong một process riêng để RSS đỉnh không bị cộng dồn.
+
+    python -m benchmarks.bench_pdf_engines [file.pdf|thư mục ...]
+
+Không truyền đường dẫn → dùng bộ PDF mẫu sinh trong benchmarks/fixtures/.
+"""
+import multiprocessing
+import os
+import sys
+import time
+from services.pdf_worker import PDF_ENGINES, extract_page_range
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux: KB, macOS: byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _measure(engine: str, path: str, queue) -> None:
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    pages = extract_page_range(path, 0, None, engine)
+    elapsed = time.perf_counter() - started
+    queue.put({
+        "seconds": elapsed,
+        "pages": pages[-1][0] if pages else 0,
+        "chars": sum(len(text) for _, text in pages),
+        "rss_mb": _peak_rss_mb(),
+        "rss_delta_mb": _peak_rss_mb() - baseline,
+    })
+
+
+def measure(engine: str, path: str) -> dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(engine, path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def collect_pdfs(paths):
+    if not paths:
+        from benchmarks.corpus import write_fixture_pdfs
+        return write_fixture_pdfs(FIXTURE_DIR)
+    pdfs = []
+    for path in paths:
+        if os.path.isdir(path):
+            pdfs.extend(os.path.join(path, n) for n in sorted(os.listdir(path)) if n.lower().endswith(".pdf"))
+        else:
+            pdfs.append(path)
+    return pdfs
+
+
+def main(paths):
+    print(f"Engines: {', '.join(PDF_ENGINES)}")
+    print(f"{'document':<28}{'engine':<9}{'pages':>7}{'pages/s':>10}{'peak RSS MB':>13}{'Δ RSS MB':>10}{'chars':>10}")
+    for path in collect_pdfs(paths):
+        for engine in PDF_ENGINES:
+            r = measure(engine, path)
+            rate = r["pages"] / r["seconds"] if r["seconds"] else 0.0
+            print(f"{os.path.basename(path)[:26]:<28}{engine:<9}{r['pages']:>7}{rate:>10.0f}{r['rss_mb']:>13.1f}{r['rss_delta_mb']:>10.1f}{r['chars']:>10}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
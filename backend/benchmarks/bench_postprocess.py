@@ -0,0 +1,238 @@
+"""
+Benchmark + kiểm tra hồi quy cho các bước hậu xử lý: parse response LLM, chia
+chunk, dựng chỉ mục đoạn, kiểm tra câu hỏi (theo bằng chứng BM25 và theo từ
+khóa), loại câu trùng. Tài liệu tổng hợp 1-1000 trang (tiếng Việt, tiếng Anh),
+PDF mẫu trong benchmarks/fixtures/ nếu có, response LLM ghi sẵn trong
+benchmarks/recorded/. Mỗi bước đo độ trễ p50/p95, thông lượng và bộ nhớ cấp
+phát đỉnh (tracemalloc), so với baseline đã lưu và thoát mã 1 nếu chậm hơn /
+tốn bộ nhớ hơn quá `--tolerance`, hoặc số kết quả đầu ra thay đổi. Trước khi
+đo, mỗi response ghi sẵn phải parse ra đúng số câu hỏi `expected` của nó.
+
+    python -m benchmarks.bench_postprocess               # so với baseline
+    python -m benchmarks.bench_postprocess --update      # ghi lại baseline
+    python -m benchmarks.bench_postprocess --quick       # bỏ tài liệu 1000 trang
+
+Baseline phụ thuộc máy: ghi lại trên máy chạy CI trước khi dùng làm cổng.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+from services.ai_utils import parse_ai_response
+from services.evidence import PassageIndex
+from services.pdf_utils import chunk_text, join_pages
+from services.question_dedup import QuestionDeduplicator
+from services.question_validator import QuestionValidator
+from benchmarks.corpus import synthetic_pages
+
+HERE = os.path.dirname(__file__)
+RECORDED_PATH = os.path.join(HERE, "recorded", "llm_responses.jsonl")
+BASELINE_PATH = os.path.join(HERE, "baselines", "postprocess.json")
+FIXTURE_DIR = os.path.join(HERE, "fixtures")
+
+SIZES = (1, 10, 100, 1000)
+# Số câu hỏi kiểm tra cho mỗi tài liệu: ~ số câu một request lớn sinh ra
+QUESTIONS_PER_PAGE = 1
+MAX_QUESTIONS = 500
+
+
+def load_recorded() -> List[Dict[str, Any]]:
+    with open(RECORDED_PATH, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_recorded(recorded: List[Dict[str, Any]]) -> List[str]:
+    """
+    Kiểm tra đúng/sai (không phụ thuộc baseline): mỗi response ghi sẵn phải parse ra
+    đúng `expected` câu hỏi dạng dict có "question" (vd. response chỉ một object JSON)
+    """
+    failures = []
+    for row in recorded:
+        questions = parse_ai_response(row["content"])
+        if len(questions) != row["expected"] or not all(isinstance(q, dict) and q.get("question") for q in questions):
+            failures.append(
+                f"parse_ai_response/{row['language']}-{row['format']}: {len(questions)} câu "
+                f"({', '.join(type(q).__name__ for q in questions[:3])}...), cần {row['expected']} câu hỏi"
+            )
+    return failures
+
+
+def documents(quick: bool) -> List[Tuple[str, str, List[Tuple[int, int, int]]]]:
+    """[(tên, text, page_offsets)]: tài liệu tổng hợp + PDF mẫu (nếu đã sinh)"""
+    result = []
+    for language in ("vi", "en"):
+        for pages in SIZES:
+            if quick and pages > 100:
+                continue
+            result.append((f"{language}-{pages}p", *_join(synthetic_pages(pages, language))))
+
+    if os.path.isdir(FIXTURE_DIR):
+        from services.pdf_utils import extract_pages_from_bytes
+        for name in sorted(os.listdir(FIXTURE_DIR)):
+            if name.lower().endswith(".pdf"):
+                with open(os.path.join(FIXTURE_DIR, name), "rb") as f:
+                    result.append((f"pdf:{name[:-4]}", *_join(extract_pages_from_bytes(f.read()))))
+    return result
+
+
+def _join(pages: List[str]) -> Tuple[str, List[Tuple[int, int, int]]]:
+    """Ghép như join_pages, kèm vị trí từng trang"""
+    text = join_pages(pages)
+    offsets, position = [], 0
+    for page_no, page in enumerate(pages, start=1):
+        start = text.find(page, position)
+        if start < 0:
+            continue
+        offsets.append((page_no, start, start + len(page)))
+        position = start + len(page)
+    return text, offsets
+
+
+def sample_questions(recorded: List[Dict[str, Any]], language: str, count: int) -> List[Dict[str, Any]]:
+    """`count` câu hỏi (bản sao) lấy vòng từ các response ghi sẵn cùng ngôn ngữ"""
+    pool = []
+    for row in recorded:
+        if row["language"] == language:
+            pool.extend(parse_ai_response(row["content"]))
+    return [dict(pool[i % len(pool)], chunk_id=None) for i in range(count)]
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Chạy `fn` `repeat` lần: độ trễ min/p50/p95 (ms); thêm một lần dưới tracemalloc để lấy bộ nhớ đỉnh"""
+    latencies = []
+    output = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "min_ms": latencies[0],
+        "p50_ms": latencies[len(latencies) // 2],
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "peak_kb": peak / 1024,
+        "output": output,
+    }
+
+
+def run(quick: bool, repeat: int) -> Dict[str, Dict[str, Any]]:
+    recorded = load_recorded()
+    results: Dict[str, Dict[str, Any]] = {}
+
+    def record(key: str, units: int, unit: str, result: Dict[str, Any]) -> None:
+        result["throughput"] = units / (result["p50_ms"] / 1000) if result["p50_ms"] else float("inf")
+        result["unit"] = unit
+        results[key] = result
+        print(f"{key:<36}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['throughput']:>14.0f} {unit:<10}{result['peak_kb']:>10.0f}{result['output']:>8}")
+
+    print(f"{'bước / tài liệu':<36}{'p50 ms':>10}{'p95 ms':>10}{'thông lượng':>14} {'':<10}{'peak KB':>10}{'kết quả':>8}")
+
+    contents = [row["content"] for row in recorded]
+    record("parse_ai_response", len(contents), "resp/s", measure(
+        lambda: sum(len(parse_ai_response(c)) for c in contents), repeat * 10
+    ))
+
+    for name, text, offsets in documents(quick):
+        language = "vi" if name.startswith(("vi-", "pdf:single-column-2")) else "en"
+        pages = len(offsets)
+        mb = len(text.encode("utf-8")) / (1024 * 1024)
+        runs = max(1, repeat // 2) if pages > 100 else repeat
+        questions = sample_questions(recorded, language, min(MAX_QUESTIONS, max(10, pages * QUESTIONS_PER_PAGE)))
+
+        record(f"chunk_text/{name}", mb, "MB/s", measure(lambda: len(chunk_text(text)), runs))
+        built = measure(lambda: PassageIndex.build(text, offsets), runs)
+        index = built["output"]
+        built["output"] = len(index)
+        record(f"passage_index/{name}", pages, "trang/s", built)
+        record(f"validate_evidence/{name}", len(questions), "câu/s", measure(
+            lambda: QuestionValidator(text, passages=index).filter([dict(q) for q in questions]).__len__(), runs
+        ))
+        record(f"validate_keywords/{name}", len(questions), "câu/s", measure(
+            lambda: QuestionValidator(text).filter([dict(q) for q in questions]).__len__(), runs
+        ))
+        record(f"dedup/{name}", len(questions), "câu/s", measure(
+            lambda: len(QuestionDeduplicator().filter(questions)), runs
+        ))
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """
+    Các hồi quy so với baseline: độ trễ / bộ nhớ đỉnh vượt quá (1 + tolerance) lần, hoặc
+    kết quả khác. Độ trễ so theo lần nhanh nhất: p50 dao động tới 2 lần khi máy bận
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        # Bước quá nhanh (vài ms) đo nhiễu lớn → so với ngưỡng 5 ms
+        if result["min_ms"] > max(base["min_ms"], 5.0) * (1 + tolerance):
+            regressions.append(f"{key}: min {result['min_ms']:.2f} ms > baseline {base['min_ms']:.2f} ms")
+        if result["peak_kb"] > max(base["peak_kb"], 64.0) * (1 + tolerance):
+            regressions.append(f"{key}: peak {result['peak_kb']:.0f} KB > baseline {base['peak_kb']:.0f} KB")
+        if result["output"] != base["output"]:
+            regressions.append(f"{key}: kết quả {result['output']} khác baseline {base['output']}")
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark + kiểm tra hồi quy các bước hậu xử lý")
+    parser.add_argument("--update", action="store_true", help="ghi kết quả lần chạy này làm baseline")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="mức chậm hơn / tốn bộ nhớ hơn cho phép (1.0 = gấp đôi)")
+    parser.add_argument("--repeat", type=int, default=7, help="số lần đo mỗi bước")
+    parser.add_argument("--quick", action="store_true", help="bỏ các tài liệu > 100 trang")
+    args = parser.parse_args(argv)
+
+    failures = check_recorded(load_recorded())
+    if failures:
+        print(f"❌ {len(failures)} response ghi sẵn parse sai:")
+        for line in failures:
+            print(f"   {line}")
+        return 1
+
+    results = run(args.quick, args.repeat)
+    stored = {
+        key: {"min_ms": round(r["min_ms"], 3), "p50_ms": round(r["p50_ms"], 3), "p95_ms": round(r["p95_ms"], 3),
+              "peak_kb": round(r["peak_kb"], 1), "output": r["output"]}
+        for key, r in results.items()
+    }
+
+    if args.update:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(stored)
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"\nĐã ghi baseline: {BASELINE_PATH}")
+        return 0
+
+    if not os.path.exists(BASELINE_PATH):
+        print("\nChưa có baseline - chạy với --update để tạo")
+        return 0
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        regressions = compare(stored, json.load(f), args.tolerance)
+    if regressions:
+        print(f"\n❌ {len(regressions)} hồi quy (tolerance {args.tolerance:.0%}):")
+        for line in regressions:
+            print(f"   {line}")
+        return 1
+    print(f"\n✅ Không có hồi quy (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+"""
+Tìm kiếm trong ngân hàng câu hỏi: quét chuỗi mọi câu hỏi / đáp án (QuestionStore.search
+cũ) so với chỉ mục ngược BM25 trong database (crud.question_crud.search_questions).
+Ngân hàng câu hỏi tổng hợp từ benchmarks.corpus, lưu qua create_run như khi tạo câu
+hỏi thật (đo cả chi phí đánh chỉ mục), trên SQLite tạm.
+
+    python -m benchmarks.bench_question_search
+    python -m benchmarks.bench_question_search --questions 300000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from config.database import Base
+from models import user_model, file_model, job_model, question_bank_model
+from models.user_model import User
+from crud import question_crud
+from benchmarks.corpus import _VI_SENTENCES, _EN_SENTENCES
+
+QUERIES = ["đạo hàm", "dao ham ham so", "quang hop", "logar", "Truyện Kiều", "photosynthesis", "acceler", "cach mang thang tam"]
+
+
+def synthetic_questions(count: int, seed: int = 11):
+    """Câu hỏi giả: một câu trong corpus + từ ngẫu nhiên để các câu không giống hệt nhau"""
+    rng = random.Random(seed)
+    sentences = _VI_SENTENCES + _EN_SENTENCES
+    vocabulary = sorted({w.strip(".,") for s in sentences for w in s.split()})
+    for i in range(count):
+        sentence = rng.choice(sentences)
+        extra = " ".join(rng.choice(vocabulary) for _ in range(4))
+        answer = rng.choice(sentence.rstrip(".").split())
+        yield {
+            "question": f"Câu {i}: {sentence[:-1]} - {extra}?",
+            "type": "mcq",
+            "choices": [f"A. {answer}", f"B. {rng.choice(vocabulary)}", f"C. {rng.choice(vocabulary)}", f"D. {rng.choice(vocabulary)}"],
+            "answer": f"A. {answer}",
+            "tags": [rng.choice(vocabulary)]
+        }
+
+
+def legacy_search(questions, keyword):
+    keyword_lower = keyword.lower()
+    return [
+        q for q in questions
+        if keyword_lower in q.get("question", "").lower()
+        or keyword_lower in q.get("answer", "").lower()
+    ]
+
+
+def timed(fn, repeat=5):
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1], result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tìm kiếm ngân hàng câu hỏi")
+    parser.add_argument("--questions", type=int, default=200000)
+    parser.add_argument("--run-size", type=int, default=500, help="số câu mỗi lần create_run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        db.add(User(full_name="Bench", username="bench", hashed_password="-"))
+        db.commit()
+        user_id = db.query(User).first().id
+
+        questions = list(synthetic_questions(args.questions))
+        started = time.perf_counter()
+        for start in range(0, len(questions), args.run_size):
+            question_crud.create_run(db, user_id, [dict(q) for q in questions[start:start + args.run_size]])
+        elapsed = time.perf_counter() - started
+        print(f"📥 Lưu + đánh chỉ mục {len(questions)} câu: {elapsed:.1f}s ({len(questions) / elapsed:.0f} câu/s)\n")
+
+        print(f"{'truy vấn':<24}{'quét ms':>10}{'kq':>8}{'chỉ mục p50':>13}{'max ms':>9}{'kq':>5}")
+        for keyword in QUERIES:
+            legacy_ms, _, legacy = timed(lambda: legacy_search(questions, keyword), repeat=3)
+            p50, worst, results = timed(lambda: question_crud.search_questions(db, user_id, keyword, limit=20))
+            print(f"{keyword:<24}{legacy_ms:>10.1f}{len(legacy):>8}{p50:>13.1f}{worst:>9.1f}{len(results):>5}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+So sánh planner cũ (tỉ lệ từ khớp, chunk 0 gửi LLM kiểm tra độ liên quan) với
+lọc lexical BM25: số lời gọi LLM cho một request và tỉ lệ lời gọi rơi vào đúng
+phần tài liệu chứa chủ đề của prompt.
+
+    python -m benchmarks.bench_relevance
+"""
+import re
+import time
+from services.pdf_utils import join_pages, chunk_text
+from services.question_planner import (
+    parse_requested_total,
+    chunk_relevance,
+    select_top_chunks,
+    needs_llm_relevance_check,
+    allocate_question_budget,
+)
+from benchmarks.corpus import synthetic_book
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+CASES = [
+    ("Tạo 10 câu trắc nghiệm về logarit", "logarit"),
+    ("Tạo 10 câu hỏi về quang hợp", "Quang hợp"),
+    ("5 câu về Truyện Kiều của Nguyễn Du", "Truyện Kiều"),
+    ("Tạo 20 câu hỏi về luy thua va logarit", "logarit"),
+]
+
+
+def legacy_relevance(chunks, prompt):
+    """Cách chấm điểm trước đây: tỉ lệ từ của prompt xuất hiện trong chunk"""
+    stop = {'tạo', 'câu', 'hỏi', 'trắc', 'nghiệm', 'về', 'của', 'và'}
+    terms = {w.lower() for w in _WORD_RE.findall(prompt) if not w.isdigit() and len(w) >= 2} - stop
+    if not terms:
+        return [1.0] * len(chunks)
+    return [len(terms & {w.lower() for w in _WORD_RE.findall(c)}) / len(terms) for c in chunks]
+
+
+def plan(chunks, prompt, lexical):
+    total = parse_requested_total(prompt)
+    if lexical:
+        relevance = chunk_relevance(chunks, prompt)
+        check_calls = 1 if needs_llm_relevance_check(relevance) else 0
+        quotas = allocate_question_budget(chunks, total, select_top_chunks(relevance, total))
+    else:
+        check_calls = 1
+        quotas = allocate_question_budget(chunks, total, legacy_relevance(chunks, prompt))
+    return quotas, check_calls
+
+
+def main():
+    pages = synthetic_book(chapters=30, pages_per_chapter=10)
+    chunks = chunk_text(join_pages(pages), max_tokens=1500)
+    print(f"Tài liệu: {len(pages)} trang, {len(chunks)} chunks")
+    print(f"{'prompt':<42}{'planner':<9}{'calls':>7}{'on-topic':>10}{'ms':>8}")
+
+    for prompt, marker in CASES:
+        on_topic = {i for i, c in enumerate(chunks) if marker.lower() in c.lower()}
+        for name, lexical in (("legacy", False), ("bm25", True)):
+            started = time.perf_counter()
+            quotas, check_calls = plan(chunks, prompt, lexical)
+            elapsed = (time.perf_counter() - started) * 1000
+            used = [i for i, q in enumerate(quotas) if q > 0]
+            hit = sum(1 for i in used if i in on_topic) / len(used) if used else 0.0
+            print(f"{prompt[:40]:<42}{name:<9}{len(used) + check_calls:>7}{hit:>9.0%}{elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
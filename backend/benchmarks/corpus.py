@@ -0,0 +1,136 @@
+import os
+import random
+from typing import List, Tuple
+
+_VI_SENTENCES = [
+    "Hàm số logarit là hàm ngược của hàm số mũ với cơ số dương khác một.",
+    "Đạo hàm của hàm số tại một điểm cho biết tốc độ biến thiên của hàm số tại điểm đó.",
+    "Trong tam giác vuông, bình phương cạnh huyền bằng tổng bình phương hai cạnh góc vuông.",
+    "Cách mạng tháng Tám năm 1945 đã lập nên nước Việt Nam Dân chủ Cộng hòa.",
+    "Quang hợp là quá trình cây xanh sử dụng năng lượng ánh sáng để tổng hợp chất hữu cơ.",
+    "Nguyên tử gồm hạt nhân mang điện tích dương và lớp vỏ electron mang điện tích âm.",
+    "Tác phẩm Truyện Kiều của Nguyễn Du gồm 3254 câu thơ lục bát.",
+    "Vận tốc ánh sáng trong chân không xấp xỉ 300000 km/s.",
+]
+
+_EN_SENTENCES = [
+    "The logarithm of a number is the exponent to which a base must be raised to produce that number.",
+    "Photosynthesis converts light energy into chemical energy stored in glucose molecules.",
+    "Newton's second law states that force equals mass multiplied by acceleration.",
+    "The French Revolution began in 1789 and reshaped European political institutions.",
+    "A derivative measures how a function changes as its input changes.",
+    "Water boils at 100 degrees Celsius at standard atmospheric pressure.",
+]
+
+
+def synthetic_pages(pages: int, language: str = "vi", seed: int = 42) -> List[str]:
+    """Sinh `pages` trang văn bản giả (~2500 ký tự/trang) bằng tiếng Việt hoặc tiếng Anh"""
+    rng = random.Random(seed)
+    sentences = _VI_SENTENCES if language == "vi" else _EN_SENTENCES
+    result = []
+    for page_no in range(1, pages + 1):
+        paragraphs = []
+        for _ in range(rng.randint(4, 7)):
+            picked = [rng.choice(sentences) for _ in range(rng.randint(3, 6))]
+            paragraphs.append(" ".join(picked))
+        result.append(f"Trang {page_no}\n" + "\n\n".join(paragraphs))
+    return result
+
+
+def synthetic_book(chapters: int, pages_per_chapter: int, language: str = "vi", seed: int = 42) -> List[str]:
+    """
+    Sách giả theo chương: mỗi chương chỉ nói về một chủ đề (một câu mẫu lặp lại
+    cùng vài câu chung), để đo khả năng chọn đúng phần tài liệu theo prompt.
+    """
+    rng = random.Random(seed)
+    sentences = _VI_SENTENCES if language == "vi" else _EN_SENTENCES
+    result = []
+    for chapter in range(chapters):
+        topic = sentences[chapter % len(sentences)]
+        for page in range(pages_per_chapter):
+            paragraphs = [
+                " ".join(topic if rng.random() < 0.6 else f"Ví dụ {rng.randint(1, 99)} minh họa nội dung chương {chapter + 1}."
+                         for _ in range(rng.randint(3, 6)))
+                for _ in range(rng.randint(4, 7))
+            ]
+            result.append(f"Chương {chapter + 1} - Trang {page + 1}\n" + "\n\n".join(paragraphs))
+    return result
+
+
+def synthetic_text(pages: int, language: str = "vi", seed: int = 42) -> str:
+    return "\n\n".join(synthetic_pages(pages, language, seed))
+
+
+def write_fixture_pdfs(directory: str) -> List[str]:
+    """
+    Tạo bộ PDF mẫu cho benchmark trích xuất (cần PyMuPDF): tài liệu một cột nhiều
+    trang và tài liệu hai cột. Font mặc định của PDF không có glyph tiếng Việt nên
+    văn bản được bỏ dấu. Trả về danh sách đường dẫn (file đã có thì giữ nguyên).
+    """
+    from services.lexical import strip_diacritics
+    from services.pdf_worker import pymupdf
+
+    if pymupdf is None:
+        raise RuntimeError("Cần cài PyMuPDF để sinh PDF mẫu")
+
+    os.makedirs(directory, exist_ok=True)
+    specs = [
+        ("single-column-200p.pdf", synthetic_pages(200, "vi"), 1),
+        ("single-column-en-100p.pdf", synthetic_pages(100, "en", seed=7), 1),
+        ("two-column-60p.pdf", synthetic_pages(60, "en", seed=11), 2),
+    ]
+    paths = []
+    for name, pages, columns in specs:
+        path = os.path.join(directory, name)
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        doc = pymupdf.open()
+        for page_text in pages:
+            page = doc.new_page()
+            text = strip_diacritics(page_text)
+            width = (page.rect.width - 72 - 18 * (columns - 1)) / columns
+            half = len(text) // columns
+            for col in range(columns):
+                part = text[col * half:(col + 1) * half] if columns > 1 else text
+                x0 = 36 + col * (width + 18)
+                page.insert_textbox(pymupdf.Rect(x0, 36, x0 + width, page.rect.height - 36), part, fontsize=9)
+        doc.save(path)
+        doc.close()
+    return paths
+
+
+def load_corpus(paths: List[str]) -> List[Tuple[str, str]]:
+    """
+    Đọc corpus từ các file .txt/.pdf (hoặc thư mục chứa chúng).
+    Trả về [(tên, văn bản)]. Không có đường dẫn → corpus tổng hợp.
+    """
+    if not paths:
+        return [
+            ("synthetic-vi-50p", synthetic_text(50, "vi")),
+            ("synthetic-en-50p", synthetic_text(50, "en")),
+            ("synthetic-vi-300p", synthetic_text(300, "vi")),
+        ]
+
+    from services.pdf_utils import extract_pages_from_bytes, join_pages
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.lower().endswith((".txt", ".pdf"))
+            )
+        else:
+            files.append(path)
+
+    corpus = []
+    for path in files:
+        if path.lower().endswith(".pdf"):
+            with open(path, "rb") as f:
+                text = join_pages(extract_pages_from_bytes(f.read()))
+        else:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        corpus.append((os.path.basename(path), text))
+    return corpus
@@ -0,0 +1,38 @@
+"""
+Tạo ngân hàng câu hỏi hàng loạt qua OpenAI Batch API (chạy từ thư mục backend):
+
+    python bulk_generate.py <thư mục PDF> --prompt "Tạo 20 câu trắc nghiệm" --out bank/
+    python bulk_generate.py <thư mục PDF> --prompt "..." --out bank/ --local   # không cần mạng
+"""
+import argparse
+import logging
+import os
+from config.settings import settings
+from services.batch_pipeline import run_bulk, OpenAIBatchBackend, LocalBatchBackend
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Tạo câu hỏi hàng loạt từ thư mục PDF qua Batch API")
+    parser.add_argument("pdf_dir", help="Thư mục chứa file PDF")
+    parser.add_argument("--prompt", required=True, help="Yêu cầu tạo câu hỏi (giống prompt trên web)")
+    parser.add_argument("--out", default="question_bank", help="Thư mục ghi kết quả")
+    parser.add_argument("--local", action="store_true", help="Dùng batch endpoint giả lập trên đĩa")
+    parser.add_argument("--poll-interval", type=float, default=None, help="Số giây giữa các lần kiểm tra batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    os.makedirs(args.out, exist_ok=True)
+
+    if args.local:
+        backend = LocalBatchBackend(os.path.join(args.out, "_batch", "local"))
+    else:
+        backend = OpenAIBatchBackend(settings.openai_api_key)
+
+    summary = run_bulk(args.pdf_dir, args.prompt, args.out, backend, poll_interval=args.poll_interval)
+    print(f"Hoàn tất: {len(summary)} tài liệu, {sum(summary.values())} câu hỏi")
+    for filename, count in summary.items():
+        print(f"  {filename}: {count}")
+
+
+if __name__ == "__main__":
+    main()
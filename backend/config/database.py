@@ -21,5 +21,5 @@ def get_db():
         db.close()
 
 def init_db():
-    from models import user_model, file_model
+    from models import user_model, file_model, job_model, question_bank_model
     Base.metadata.create_all(bind=engine)
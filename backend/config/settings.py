@@ -15,10 +15,47 @@ class Settings:
         
         self.max_chunk_chars = int(os.getenv("MAX_CHUNK_CHARS", "6000"))
         self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "300"))
+        self.chunk_target_tokens = int(os.getenv("CHUNK_TARGET_TOKENS", "6000"))
+        self.chunk_overlap_tokens = int(os.getenv("CHUNK_OVERLAP_TOKENS", "100"))
+
+        self.upload_dir = os.getenv("UPLOAD_DIR", "uploads")
+        self.max_upload_mb = int(os.getenv("MAX_UPLOAD_MB", "200"))
+        self.upload_block_kb = int(os.getenv("UPLOAD_BLOCK_KB", "1024"))
+
+        self.pdf_engine = os.getenv("PDF_ENGINE", "auto").lower()
+        self.pdf_extract_workers = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+        self.pdf_extract_timeout = float(os.getenv("PDF_EXTRACT_TIMEOUT", "120"))
+        self.pdf_max_pages_per_task = int(os.getenv("PDF_MAX_PAGES_PER_TASK", "50"))
         
         self.ai_temperature = float(os.getenv("AI_TEMPERATURE", "0.2"))
         self.ai_max_tokens = int(os.getenv("AI_MAX_TOKENS", "2500"))
 
+        self.llm_max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.llm_request_fanout = int(os.getenv("LLM_REQUEST_FANOUT", "4"))
+        self.llm_streaming = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+        self.openai_rpm_limit = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+        self.openai_tpm_limit = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+        self.llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "5"))
+        self.llm_backoff_base = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+        self.llm_backoff_max = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+        self.questions_per_chunk = int(os.getenv("QUESTIONS_PER_CHUNK", "5"))
+        self.lexical_min_score = float(os.getenv("LEXICAL_MIN_SCORE", "0.2"))
+        self.llm_relevance_check = os.getenv("LLM_RELEVANCE_CHECK", "auto").lower()
+        self.planner_top_up_rounds = int(os.getenv("PLANNER_TOP_UP_ROUNDS", "1"))
+        self.question_dedup_threshold = float(os.getenv("QUESTION_DEDUP_THRESHOLD", "0.7"))
+        self.evidence_passage_words = int(os.getenv("EVIDENCE_PASSAGE_WORDS", "120"))
+        self.evidence_top_k = int(os.getenv("EVIDENCE_TOP_K", "3"))
+        self.evidence_min_grounding = float(os.getenv("EVIDENCE_MIN_GROUNDING", "0.3"))
+        self.question_page_size = int(os.getenv("QUESTION_PAGE_SIZE", "100"))
+        self.question_page_max = int(os.getenv("QUESTION_PAGE_MAX", "1000"))
+
+        self.llm_cache_enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.llm_cache_path = os.getenv("LLM_CACHE_PATH", "cache/llm_cache.sqlite3")
+        self.llm_cache_max_mb = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+
+        self.job_workers = int(os.getenv("JOB_WORKERS", "2"))
+        self.batch_poll_interval = float(os.getenv("BATCH_POLL_INTERVAL", "60"))
+
         self.secret_key = os.getenv("SECRET_KEY")
         self.algorithm = "HS256"
         self.access_token_expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
@@ -1,9 +1,18 @@
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from models.file_model import UploadedFile
+from models.file_model import UploadedFile, FileBlob, ExtractedText, PassageIndexRecord
+from models.job_model import GenerationJob
 from datetime import datetime
 
-def create_file_record(db: Session, filename: str, original_filename: str, file_path: str, user_id: int, file_size: int = None):
-    db_file = UploadedFile(filename=filename, original_filename=original_filename, file_path=file_path, user_id=user_id, file_size=file_size)
+def create_file_record(db: Session, filename: str, original_filename: str, file_path: str, user_id: int, file_size: int = None, content_hash: str = None, ensure_blob_file=None):
+    """`ensure_blob_file`: gọi sau khi đã giữ tham chiếu (và khóa) blob để chắc file thật có trên đĩa"""
+    db_file = UploadedFile(filename=filename, original_filename=original_filename, file_path=file_path, user_id=user_id, file_size=file_size, content_hash=content_hash)
+    if content_hash:
+        acquire_blob(db, content_hash, file_path, file_size)
+        db.flush()
+        if ensure_blob_file:
+            ensure_blob_file()
     db.add(db_file)
     db.commit()
     db.refresh(db_file)
@@ -15,10 +24,107 @@ def get_files_by_user(db: Session, user_id: int):
 def get_file_by_id(db: Session, file_id: int):
     return db.query(UploadedFile).filter(UploadedFile.id == file_id).first()
 
-def delete_file_record(db: Session, file_id: int):
+def get_user_file_by_name_or_hash(db: Session, user_id: int, filename: str, content_hash: str = None):
+    match = UploadedFile.original_filename == filename
+    if content_hash:
+        match = or_(match, UploadedFile.content_hash == content_hash)
+    return db.query(UploadedFile).filter(UploadedFile.user_id == user_id, match).first()
+
+def get_user_file_by_hash(db: Session, user_id: int, content_hash: str):
+    return db.query(UploadedFile).filter(UploadedFile.user_id == user_id, UploadedFile.content_hash == content_hash).first()
+
+def delete_file_record(db: Session, file_id: int, remove_blob_file=None):
+    """
+    Xóa bản ghi cùng các job tạo câu hỏi của file (caller dừng job đang chạy trước);
+    trả về content_hash của blob nếu đây là tham chiếu cuối cùng. `remove_blob_file(path)`
+    xóa file thật của blob đó sau khi đã commit (commit lỗi thì file vẫn còn, database
+    không trỏ tới file đã mất)
+    """
     db_file = get_file_by_id(db, file_id)
-    if db_file:
-        db.delete(db_file)
+    if not db_file:
+        return None
+    # Xóa tường minh: bảng tạo trước khi có ON DELETE CASCADE / SQLite không kiểm tra khóa ngoại
+    for job in db.query(GenerationJob).filter(GenerationJob.file_id == file_id).all():
+        db.delete(job)
+    db.flush()
+    db.delete(db_file)
+    db.flush()
+    orphan = release_blob(db, db_file.content_hash) if db_file.content_hash else None
+    orphan = (orphan.content_hash, orphan.file_path) if orphan else None
+    db.commit()
+    if orphan and remove_blob_file:
+        _remove_unreferenced_blob_file(db, *orphan, remove_blob_file)
+    return orphan[0] if orphan else None
+
+def _remove_unreferenced_blob_file(db: Session, content_hash: str, file_path: str, remove_blob_file):
+    """
+    Xóa file của blob đã xóa (đã commit) trong lúc khóa theo hash: upload cùng nội dung
+    vừa tạo lại blob thì giữ file; upload tới sau chờ khóa rồi ghi lại file. Lỗi giữa
+    chừng chỉ để lại file không ai tham chiếu
+    """
+    try:
+        if db.query(FileBlob).filter(FileBlob.content_hash == content_hash).with_for_update().first() is None:
+            remove_blob_file(file_path)
+    finally:
         db.commit()
-        return True
-    return False
+
+def get_blob(db: Session, content_hash: str):
+    return db.query(FileBlob).filter(FileBlob.content_hash == content_hash).first()
+
+def acquire_blob(db: Session, content_hash: str, file_path: str, file_size: int):
+    """Tăng số tham chiếu của blob (tạo mới nếu chưa có) - commit cùng bản ghi file"""
+    blob = db.query(FileBlob).filter(FileBlob.content_hash == content_hash).with_for_update().first()
+    if blob is None:
+        try:
+            with db.begin_nested():
+                blob = FileBlob(content_hash=content_hash, file_path=file_path, file_size=file_size, ref_count=0)
+                db.add(blob)
+        except IntegrityError:
+            # Upload cùng nội dung chạy đồng thời đã tạo blob trước: khóa và dùng blob đó
+            blob = db.query(FileBlob).filter(FileBlob.content_hash == content_hash).with_for_update().first()
+    blob.ref_count += 1
+    return blob
+
+def release_blob(db: Session, content_hash: str):
+    """Giảm số tham chiếu; về 0 thì xóa blob và text đã trích xuất, trả về blob đó"""
+    blob = db.query(FileBlob).filter(FileBlob.content_hash == content_hash).with_for_update().first()
+    if blob is None:
+        return None
+    blob.ref_count -= 1
+    if blob.ref_count > 0:
+        return None
+    db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).delete()
+    db.query(PassageIndexRecord).filter(PassageIndexRecord.content_hash == content_hash).delete()
+    db.delete(blob)
+    return blob
+
+def get_extracted_text(db: Session, content_hash: str):
+    return db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).first()
+
+def save_extracted_text(db: Session, content_hash: str, version: str, text: str, page_offsets: str, page_count: int):
+    db_text = get_extracted_text(db, content_hash)
+    if db_text is None:
+        db_text = ExtractedText(content_hash=content_hash)
+        db.add(db_text)
+    db_text.version = version
+    db_text.text = text
+    db_text.page_offsets = page_offsets
+    db_text.page_count = page_count
+    db_text.created_at = datetime.utcnow()
+    db.commit()
+    return db_text
+
+def get_passage_index(db: Session, content_hash: str):
+    return db.query(PassageIndexRecord).filter(PassageIndexRecord.content_hash == content_hash).first()
+
+def save_passage_index(db: Session, content_hash: str, version: str, passages: str, term_freqs: str):
+    record = get_passage_index(db, content_hash)
+    if record is None:
+        record = PassageIndexRecord(content_hash=content_hash)
+        db.add(record)
+    record.version = version
+    record.passages = passages
+    record.term_freqs = term_freqs
+    record.created_at = datetime.utcnow()
+    db.commit()
+    return record
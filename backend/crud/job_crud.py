@@ -0,0 +1,71 @@
+import json
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List
+from sqlalchemy.orm import Session
+from models.job_model import GenerationJob, GenerationJobChunk, JOB_QUEUED, JOB_CANCELLING, JOB_UNFINISHED_STATUSES
+
+def create_job(db: Session, user_id: int, file_id: int, prompt: str, use_cache: bool = True, page_spec: str = None, section: str = None):
+    db_job = GenerationJob(id=str(uuid.uuid4()), user_id=user_id, file_id=file_id, prompt=prompt, use_cache=use_cache, page_spec=page_spec, section=section, status=JOB_QUEUED)
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def get_job(db: Session, job_id: str):
+    return db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+
+def get_jobs_by_user(db: Session, user_id: int, limit: int = 50):
+    return db.query(GenerationJob).filter(GenerationJob.user_id == user_id).order_by(GenerationJob.created_at.desc()).limit(limit).all()
+
+def get_unfinished_jobs_by_file(db: Session, file_id: int):
+    return db.query(GenerationJob).filter(GenerationJob.file_id == file_id, GenerationJob.status.in_(JOB_UNFINISHED_STATUSES)).all()
+
+def get_unfinished_jobs(db: Session):
+    return db.query(GenerationJob).filter(GenerationJob.status.in_(JOB_UNFINISHED_STATUSES)).order_by(GenerationJob.created_at).all()
+
+def update_job(db: Session, job: GenerationJob, **fields):
+    for key, value in fields.items():
+        setattr(job, key, value)
+    db.commit()
+    return job
+
+def set_job_status(db: Session, job: GenerationJob, expected, status: str, commit: bool = True, **fields) -> bool:
+    """
+    Đổi trạng thái bằng UPDATE có điều kiện: chỉ khi trạng thái hiện tại trong database
+    thuộc `expected` (endpoint hủy job và worker - có thể ở process khác - ghi cùng lúc).
+    Trả về False nếu job đã sang trạng thái khác. commit=False: caller commit / rollback
+    """
+    updated = db.query(GenerationJob).filter(
+        GenerationJob.id == job.id, GenerationJob.status.in_(expected)
+    ).update(dict(fields, status=status), synchronize_session=False)
+    if commit:
+        db.commit()
+    db.expire(job)
+    return updated == 1
+
+def is_cancel_requested(db: Session, job: GenerationJob) -> bool:
+    return db.query(GenerationJob.status).filter(GenerationJob.id == job.id).scalar() == JOB_CANCELLING
+
+def add_job_chunk(db: Session, job: GenerationJob, chunk_index: int, questions: List[Dict[str, Any]], **progress):
+    db.add(GenerationJobChunk(job_id=job.id, chunk_index=chunk_index, questions=json.dumps(questions, ensure_ascii=False)))
+    job.total_questions = (job.total_questions or 0) + len(questions)
+    for key, value in progress.items():
+        setattr(job, key, value)
+    db.commit()
+
+def get_completed_chunks(db: Session, job: GenerationJob) -> Dict[int, List[Dict[str, Any]]]:
+    return {c.chunk_index: json.loads(c.questions) for c in job.chunks}
+
+def get_job_questions(db: Session, job: GenerationJob) -> List[Dict[str, Any]]:
+    questions = []
+    for c in job.chunks:
+        questions.extend(json.loads(c.questions))
+    return questions
+
+def finish_job(db: Session, job: GenerationJob, status: str, error: str = None):
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    db.commit()
+    return job
@@ -0,0 +1,308 @@
+import heapq
+import json
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models.question_bank_model import (
+    GenerationRun, StoredQuestion, QuestionTerm, QuestionSearchTerm, QuestionSearchStats
+)
+from services.lexical import tokenize, words
+
+SEARCH_TERM_CHARS = 64
+# Cùng tham số với services.lexical.BM25Index
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Từ cuối của truy vấn được mở rộng thành tối đa chừng này term (df cao nhất) cùng tiền tố
+SEARCH_PREFIX_TERMS = 16
+# Tổng số posting tối đa đọc khi chọn ứng viên: term hiếm nhất trước, term còn lại chỉ dùng
+# để chấm lại ứng viên (như BM25Index.top)
+SEARCH_MAX_POSTINGS = 2000
+_BATCH = 500
+
+def _apply(row: StoredQuestion, question: Dict[str, Any]):
+    """Ghi dict câu hỏi vào các cột của bản ghi"""
+    data = {k: v for k, v in question.items() if k not in ("id", "run_id", "file_id")}
+    row.type = str(data.get("type") or "mcq")
+    row.question = str(data.get("question", ""))
+    row.answer = str(data.get("answer", ""))
+    row.page_start = data.get("page_start")
+    row.page_end = data.get("page_end")
+    row.grounding = data.get("grounding")
+    row.data = json.dumps(data, ensure_ascii=False)
+    return row
+
+def question_to_dict(row: StoredQuestion) -> Dict[str, Any]:
+    question = json.loads(row.data)
+    question.update(id=row.id, run_id=row.run_id, file_id=row.file_id)
+    return question
+
+def _search_text(question: Dict[str, Any]) -> str:
+    parts = [question.get("question"), question.get("answer"), question.get("explanation")]
+    parts += list(question.get("choices") or []) + list(question.get("tags") or [])
+    return " ".join(str(p) for p in parts if p)
+
+def search_terms(question: Dict[str, Any]) -> Counter:
+    """Term tìm kiếm (âm tiết + bigram, đã bỏ dấu) của câu hỏi, lựa chọn, đáp án, giải thích, tags"""
+    return Counter(t[:SEARCH_TERM_CHARS] for t in tokenize(_search_text(question)))
+
+def _update_df(db: Session, user_id: int, delta: Counter):
+    """Cộng `delta` vào df của từng term (executemany, không qua ORM: mỗi lần lưu có hàng nghìn term)"""
+    table = QuestionSearchTerm.__table__
+    terms = [t for t, d in delta.items() if d]
+    for start in range(0, len(terms), _BATCH):
+        batch = terms[start:start + _BATCH]
+        existing = dict(db.execute(
+            select(table.c.term, table.c.df).where(table.c.user_id == user_id, table.c.term.in_(batch))
+        ).all())
+        inserts, updates, deletes = [], [], []
+        for term in batch:
+            if term not in existing:
+                if delta[term] > 0:
+                    inserts.append({"user_id": user_id, "term": term, "df": delta[term]})
+            elif existing[term] + delta[term] > 0:
+                updates.append({"b_term": term, "b_delta": delta[term]})
+            else:
+                deletes.append(term)
+        if inserts:
+            db.execute(table.insert(), inserts)
+        if updates:
+            db.execute(
+                table.update()
+                .where(table.c.user_id == user_id, table.c.term == bindparam("b_term"))
+                .values(df=table.c.df + bindparam("b_delta")),
+                updates
+            )
+        if deletes:
+            db.execute(table.delete().where(table.c.user_id == user_id, table.c.term.in_(deletes)))
+
+def _index_rows(db: Session, stats: QuestionSearchStats, rows: List[StoredQuestion]):
+    """Thêm các câu (đã flush, có id) vào chỉ mục tìm kiếm"""
+    postings, df = [], Counter()
+    for row in rows:
+        terms = search_terms(json.loads(row.data))
+        length = sum(terms.values())
+        df.update(terms.keys())
+        postings.extend(
+            {"question_id": row.id, "term": term, "user_id": stats.user_id, "tf": tf, "doc_length": length}
+            for term, tf in terms.items()
+        )
+        stats.doc_count += 1
+        stats.total_length += length
+    for start in range(0, len(postings), 5000):
+        db.execute(QuestionTerm.__table__.insert(), postings[start:start + 5000])
+    _update_df(db, stats.user_id, df)
+
+def _unindex_row(db: Session, stats: QuestionSearchStats, row: StoredQuestion):
+    postings = db.query(QuestionTerm.term, QuestionTerm.doc_length).filter(QuestionTerm.question_id == row.id).all()
+    if not postings:
+        return
+    _update_df(db, stats.user_id, Counter({term: -1 for term, _ in postings}))
+    db.query(QuestionTerm).filter(QuestionTerm.question_id == row.id).delete(synchronize_session=False)
+    stats.doc_count -= 1
+    stats.total_length -= postings[0].doc_length
+
+def _lock_search_stats(db: Session, user_id: int) -> QuestionSearchStats:
+    """
+    Khóa thống kê tìm kiếm của user (mọi thay đổi chỉ mục của một user chạy tuần tự).
+    Chưa có thì tạo và đánh chỉ mục các câu đã lưu trước khi có chỉ mục tìm kiếm.
+    Chỉ gọi từ thao tác ghi.
+    """
+    query = db.query(QuestionSearchStats).filter(QuestionSearchStats.user_id == user_id)
+    stats = query.with_for_update().first()
+    if stats is not None:
+        return stats
+    try:
+        with db.begin_nested():
+            stats = QuestionSearchStats(user_id=user_id, doc_count=0, total_length=0)
+            db.add(stats)
+    except IntegrityError:
+        # Lần ghi đầu tiên khác của user chạy đồng thời đã tạo (và đánh chỉ mục) trước
+        return query.with_for_update().first()
+    last_id = 0
+    while True:
+        rows = _user_questions(db, user_id).filter(StoredQuestion.id > last_id).order_by(StoredQuestion.id).limit(_BATCH).all()
+        if not rows:
+            break
+        _index_rows(db, stats, rows)
+        last_id = rows[-1].id
+    return stats
+
+def create_run(db: Session, user_id: int, questions: List[Dict[str, Any]], file_id: int = None, prompt: str = None, job_id: str = None, commit: bool = True):
+    """Lưu câu hỏi của một lần tạo vào ngân hàng của user (gắn id, run_id vào từng dict). commit=False: commit cùng thao tác khác của caller"""
+    stats = _lock_search_stats(db, user_id)
+    run = GenerationRun(user_id=user_id, file_id=file_id, job_id=job_id, prompt=prompt, question_count=len(questions))
+    db.add(run)
+    db.flush()
+    rows = [_apply(StoredQuestion(user_id=user_id, file_id=file_id, run_id=run.id), q) for q in questions]
+    db.add_all(rows)
+    db.flush()
+    _index_rows(db, stats, rows)
+    for q, row in zip(questions, rows):
+        q.update(id=row.id, run_id=run.id, file_id=file_id)
+    if commit:
+        db.commit()
+    return run
+
+def _user_questions(db: Session, user_id: int, file_id: int = None, run_id: int = None):
+    query = db.query(StoredQuestion).filter(StoredQuestion.user_id == user_id)
+    if file_id is not None:
+        query = query.filter(StoredQuestion.file_id == file_id)
+    if run_id is not None:
+        query = query.filter(StoredQuestion.run_id == run_id)
+    return query
+
+def get_questions(db: Session, user_id: int, file_id: int = None, run_id: int = None, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    query = _user_questions(db, user_id, file_id, run_id).order_by(StoredQuestion.id).offset(offset)
+    if limit is not None:
+        query = query.limit(limit)
+    return [question_to_dict(row) for row in query.all()]
+
+def count_questions(db: Session, user_id: int, file_id: int = None, run_id: int = None) -> int:
+    return _user_questions(db, user_id, file_id, run_id).with_entities(func.count(StoredQuestion.id)).scalar()
+
+def count_all_questions(db: Session) -> int:
+    return db.query(func.count(StoredQuestion.id)).scalar()
+
+def get_user_question(db: Session, user_id: int, question_id: int):
+    """Câu hỏi theo id (StoredQuestion.id), chỉ khi thuộc ngân hàng của user"""
+    return _user_questions(db, user_id).filter(StoredQuestion.id == question_id).first()
+
+def update_question(db: Session, user_id: int, question_id: int, question: Dict[str, Any]) -> bool:
+    return _update_row(db, user_id, get_user_question(db, user_id, question_id), question)
+
+def delete_question(db: Session, user_id: int, question_id: int) -> bool:
+    return _delete_row(db, user_id, get_user_question(db, user_id, question_id))
+
+def get_question_at(db: Session, user_id: int, index: int):
+    """
+    (Deprecated - dùng get_user_question) Câu thứ `index` (từ 0) trong ngân hàng của
+    user theo thứ tự tạo: OFFSET tốn O(index) và vị trí đổi khi có câu bị xóa / thêm
+    """
+    if index < 0:
+        return None
+    return _user_questions(db, user_id).order_by(StoredQuestion.id).offset(index).first()
+
+def update_question_at(db: Session, user_id: int, index: int, question: Dict[str, Any]) -> bool:
+    """(Deprecated - dùng update_question)"""
+    return _update_row(db, user_id, get_question_at(db, user_id, index), question)
+
+def delete_question_at(db: Session, user_id: int, index: int) -> bool:
+    """(Deprecated - dùng delete_question)"""
+    return _delete_row(db, user_id, get_question_at(db, user_id, index))
+
+def _update_row(db: Session, user_id: int, row: StoredQuestion, question: Dict[str, Any]) -> bool:
+    if row is None:
+        return False
+    stats = _lock_search_stats(db, user_id)
+    _unindex_row(db, stats, row)
+    _apply(row, question)
+    _index_rows(db, stats, [row])
+    db.commit()
+    return True
+
+def _delete_row(db: Session, user_id: int, row: StoredQuestion) -> bool:
+    if row is None:
+        return False
+    _unindex_row(db, _lock_search_stats(db, user_id), row)
+    db.query(GenerationRun).filter(GenerationRun.id == row.run_id).update(
+        {GenerationRun.question_count: GenerationRun.question_count - 1}, synchronize_session=False
+    )
+    db.delete(row)
+    db.commit()
+    return True
+
+def _prefix_terms(db: Session, user_id: int, prefix: str) -> Dict[str, int]:
+    """Các term (không phải bigram) bắt đầu bằng `prefix`, df cao nhất trước: {term: df}"""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    rows = db.query(QuestionSearchTerm.term, QuestionSearchTerm.df).filter(
+        QuestionSearchTerm.user_id == user_id,
+        QuestionSearchTerm.term >= prefix,
+        QuestionSearchTerm.term < upper,
+        ~QuestionSearchTerm.term.contains("_", autoescape=True)
+    ).order_by(QuestionSearchTerm.df.desc()).limit(SEARCH_PREFIX_TERMS).all()
+    return {term: df for term, df in rows}
+
+def search_questions(db: Session, user_id: int, keyword: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Tìm trong ngân hàng câu hỏi của user qua chỉ mục ngược, xếp hạng BM25. Không
+    phân biệt dấu ("dao ham" khớp "đạo hàm"); từ cuối khớp theo tiền tố (đang gõ
+    dở) trừ khi truy vấn kết thúc bằng khoảng trắng; hai từ liền nhau khớp cụm
+    được cộng điểm (bigram). Mỗi kết quả có thêm "score".
+    """
+    # Chưa có thống kê = chưa có chỉ mục (tạo ở lần ghi đầu tiên): chỉ đọc, không khóa
+    stats = db.query(QuestionSearchStats).filter(QuestionSearchStats.user_id == user_id).first()
+    if stats is None:
+        return []
+    query_words = [w[:SEARCH_TERM_CHARS] for w in words(keyword)]
+    if not query_words or not stats.doc_count or limit <= 0:
+        return []
+
+    prefix = None if keyword[-1:].isspace() else query_words[-1]
+    exact = set(query_words if prefix is None else query_words[:-1])
+    exact.update(f"{a}_{b}"[:SEARCH_TERM_CHARS] for a, b in zip(query_words, query_words[1:]))
+    doc_freqs: Dict[str, int] = {}
+    if exact:
+        doc_freqs.update(db.query(QuestionSearchTerm.term, QuestionSearchTerm.df).filter(
+            QuestionSearchTerm.user_id == user_id, QuestionSearchTerm.term.in_(exact)
+        ).all())
+    if prefix is not None:
+        doc_freqs.update(_prefix_terms(db, user_id, prefix))
+    if not doc_freqs:
+        return []
+
+    n, avg_length = stats.doc_count, stats.total_length / stats.doc_count
+    idf = {t: math.log(1 + (n - df + 0.5) / (df + 0.5)) for t, df in doc_freqs.items()}
+
+    def impact(term: str, tf: int, doc_length: int) -> float:
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_length / avg_length)
+        return idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+
+    # Ứng viên từ các term hiếm (danh sách ngắn) trong giới hạn SEARCH_MAX_POSTINGS, rồi
+    # chấm lại ứng viên với các term phổ biến. Term hiếm nhất vẫn quá dài: đọc các câu
+    # ngắn nhất trước
+    rare, budget = [], SEARCH_MAX_POSTINGS
+    for term in sorted(doc_freqs, key=doc_freqs.get):
+        if rare and doc_freqs[term] > budget:
+            break
+        rare.append(term)
+        budget -= doc_freqs[term]
+    scores: Dict[int, float] = {}
+    for term in rare:
+        postings = db.query(QuestionTerm.question_id, QuestionTerm.tf, QuestionTerm.doc_length).filter(
+            QuestionTerm.user_id == user_id, QuestionTerm.term == term
+        ).order_by(QuestionTerm.doc_length).limit(SEARCH_MAX_POSTINGS)
+        for question_id, tf, doc_length in postings:
+            scores[question_id] = scores.get(question_id, 0.0) + impact(term, tf, doc_length)
+    candidates = dict(heapq.nlargest(max(4 * limit, 50), scores.items(), key=lambda item: item[1]))
+
+    common = [t for t in doc_freqs if t not in rare]
+    if common and candidates:
+        ids = list(candidates)
+        for start in range(0, len(ids), _BATCH):
+            for question_id, term, tf, doc_length in db.query(
+                QuestionTerm.question_id, QuestionTerm.term, QuestionTerm.tf, QuestionTerm.doc_length
+            ).filter(QuestionTerm.question_id.in_(ids[start:start + _BATCH]), QuestionTerm.term.in_(common)):
+                candidates[question_id] += impact(term, tf, doc_length)
+
+    top = heapq.nlargest(limit, candidates.items(), key=lambda item: item[1])
+    rows = {row.id: row for row in db.query(StoredQuestion).filter(StoredQuestion.id.in_([i for i, _ in top]))}
+    results = []
+    for question_id, score in top:
+        if question_id in rows:
+            question = question_to_dict(rows[question_id])
+            question["score"] = round(score, 3)
+            results.append(question)
+    return results
+
+def clear_questions(db: Session, user_id: int) -> int:
+    """Xóa toàn bộ ngân hàng câu hỏi của user; trả về số câu đã xóa"""
+    db.query(QuestionTerm).filter(QuestionTerm.user_id == user_id).delete(synchronize_session=False)
+    db.query(QuestionSearchTerm).filter(QuestionSearchTerm.user_id == user_id).delete(synchronize_session=False)
+    db.query(QuestionSearchStats).filter(QuestionSearchStats.user_id == user_id).delete(synchronize_session=False)
+    count = db.query(StoredQuestion).filter(StoredQuestion.user_id == user_id).delete(synchronize_session=False)
+    db.query(GenerationRun).filter(GenerationRun.user_id == user_id).delete(synchronize_session=False)
+    db.commit()
+    return count
@@ -1,26 +1,39 @@
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List
 from sqlalchemy.orm import Session
-import asyncio
+import json
+import logging
 import os
-import uuid
 from datetime import timedelta, datetime
 from config.settings import settings
-from config.database import get_db, init_db
-from services.pdf_utils import extract_text_from_pdf, chunk_text
-from services.ai_utils import generate_questions_from_text, validate_question_relevance, check_hallucination
-from services.data_store import question_store
+from config.database import get_db, init_db, SessionLocal
+from services.pdf_utils import warm_extract_pool, shutdown_extract_pool, UploadLimitMiddleware
+from services.document_text import DocumentStream, load_outline, resolve_page_selection
+from services.pdf_utils import parse_page_spec
+from services.blob_store import blob_path, receive_upload, commit_blob, remove_blob_file
+from services.question_validator import QuestionValidator
+from services.question_dedup import QuestionDeduplicator
+from services.generation_pipeline import generate_for_stream, iter_generation_stream
+from services.llm_cache import llm_cache
+from services.rate_limiter import rate_limiter
 from services.auth import create_access_token, get_current_user
 from models.question_model import QuestionUpdateRequest
 from models.user_model import User
 from schemas.user import UserCreate, UserLogin, Token, User as UserSchema
 from crud.user_crud import create_user, authenticate_user, get_user_by_username
 from crud.file_crud import create_file_record, get_files_by_user
+from crud import job_crud, question_crud
+from models.job_model import JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING, JOB_FINISHED_STATUSES, JOB_CANCELLED
+from services.job_runner import job_manager
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="PDF Question Generator API", version="2.0.0")
 
+# Thêm trước CORS để response 413 vẫn có header CORS
+app.add_middleware(UploadLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -33,15 +46,32 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    await job_manager.start()
+    await warm_extract_pool()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_manager.stop()
+    shutdown_extract_pool()
 
 
 @app.get("/")
-async def root():
+async def root(db: Session = Depends(get_db)):
     """Health check endpoint"""
     return {
         "status": "running",
         "version": "2.0.0",
-        "questions_count": question_store.count()
+        "questions_count": question_crud.count_all_questions(db)
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Số liệu hiệu năng: cache LLM, hàng đợi rate limit OpenAI, job chạy nền"""
+    return {
+        "llm_cache": llm_cache.stats(),
+        "rate_limiter": rate_limiter.metrics(),
+        "jobs_queued": job_manager.queue_size()
     }
 
 @app.post("/register", response_model=UserSchema)
@@ -126,23 +156,93 @@ async def get_my_files(
 @app.get("/check-duplicate-file")
 async def check_duplicate_file(
     filename: str,
+    content_hash: str = None,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Kiểm tra xem file có trùng tên không"""
-    from sqlalchemy import and_
-    from models.file_model import UploadedFile
-    
-    existing = db.query(UploadedFile).filter(
-        and_(
-            UploadedFile.original_filename == filename,
-            UploadedFile.user_id == current_user.id
-        )
-    ).first()
+    """
+    Kiểm tra file trùng tên hoặc trùng nội dung (SHA-256) với file của user.
+    blob_exists: user đã có file cùng nội dung → dùng /files/from-hash thay vì
+    upload lại. Chỉ xét file của chính user: hash do client gửi không chứng minh
+    có file, nên không được tiết lộ / cấp nội dung của user khác (upload trùng
+    nội dung với user khác vẫn dùng chung blob, sau khi server đã nhận đủ bytes).
+    """
+    from crud.file_crud import get_user_file_by_name_or_hash, get_user_file_by_hash
+    
+    content_hash = content_hash.lower() if content_hash else None
+    existing = get_user_file_by_name_or_hash(db, current_user.id, filename, content_hash)
     
     return {
         "duplicate": existing is not None,
-        "file_id": existing.id if existing else None
+        "file_id": existing.id if existing else None,
+        "blob_exists": bool(content_hash) and get_user_file_by_hash(db, current_user.id, content_hash) is not None
+    }
+
+
+@app.post("/files/from-hash")
+async def create_file_from_hash(
+    data: dict,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Tạo file cho user từ nội dung user đã upload trước đó (không cần upload, không
+    trích xuất lại) - chỉ với file của chính user, xem /check-duplicate-file
+    """
+    from crud.file_crud import get_blob, get_user_file_by_hash
+    
+    content_hash = (data.get('content_hash') or "").lower()
+    filename = data.get('filename')
+    
+    if not content_hash or not filename:
+        raise HTTPException(status_code=400, detail="Thiếu content_hash hoặc filename")
+    
+    blob = get_blob(db, content_hash) if get_user_file_by_hash(db, current_user.id, content_hash) else None
+    if not blob or not os.path.exists(blob.file_path):
+        raise HTTPException(status_code=404, detail="Không tìm thấy nội dung file trên hệ thống")
+    
+    def ensure_blob_file():
+        # Blob có thể vừa bị xóa (hết tham chiếu) giữa lúc kiểm tra và lúc giữ tham chiếu
+        if not os.path.exists(blob.file_path):
+            raise HTTPException(status_code=404, detail="Không tìm thấy nội dung file trên hệ thống")
+    
+    file_record = create_file_record(
+        db=db,
+        filename=os.path.basename(blob.file_path),
+        original_filename=filename,
+        file_path=blob.file_path,
+        user_id=current_user.id,
+        file_size=blob.file_size,
+        content_hash=content_hash,
+        ensure_blob_file=ensure_blob_file
+    )
+    
+    return {"success": True, "file_id": file_record.id}
+
+
+@app.get("/files/{file_id}/outline")
+async def get_file_outline(
+    file_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Mục lục (bookmark) của PDF - dùng tiêu đề làm `section` khi tạo câu hỏi"""
+    from crud.file_crud import get_file_by_id
+    file_record = get_file_by_id(db, file_id)
+    
+    if not file_record:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file")
+    
+    if file_record.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền truy cập file này")
+    
+    if not os.path.exists(file_record.file_path):
+        raise HTTPException(status_code=404, detail="File không tồn tại trên hệ thống")
+    
+    outline = await load_outline(file_record.file_path)
+    return {
+        "success": True,
+        "outline": [{"level": level, "title": title, "page": page} for level, title, page in outline]
     }
 
 
@@ -166,13 +266,15 @@ async def delete_file(
     if file_record.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Bạn không có quyền xóa file này")
     
-    if os.path.exists(file_record.file_path):
-        try:
-            os.remove(file_record.file_path)
-        except Exception as e:
-            pass
+    # Job đang chạy trên file này phải dừng trước khi bản ghi và blob bị xóa
+    for job in job_crud.get_unfinished_jobs_by_file(db, file_id):
+        await job_manager.cancel_and_wait(job.id)
     
-    delete_file_record(db, file_id)
+    # File cũ (trước blob store) thuộc riêng bản ghi; blob chỉ xóa khi hết tham chiếu
+    legacy_path = None if file_record.content_hash else file_record.file_path
+    delete_file_record(db, file_id, remove_blob_file=remove_blob_file)
+    if legacy_path:
+        remove_blob_file(legacy_path)
     
     return {
         "success": True,
@@ -180,10 +282,35 @@ async def delete_file(
     }
 
 
+async def _save_upload(file: UploadFile, current_user: User, db: Session):
+    """Lưu file upload vào blob store (mỗi nội dung một bản) và tạo bản ghi trong database"""
+    tmp_path, file_size, content_hash = await receive_upload(file)
+    file_path = blob_path(content_hash)
+    
+    try:
+        # File tạm chỉ vào store sau khi đã giữ tham chiếu blob: không bị một lần xóa
+        # tham chiếu cuối cùng chạy đồng thời xóa mất
+        return create_file_record(
+            db=db,
+            filename=os.path.basename(file_path),
+            original_filename=file.filename,
+            file_path=file_path,
+            user_id=current_user.id,
+            file_size=file_size,
+            content_hash=content_hash,
+            ensure_blob_file=lambda: commit_blob(tmp_path, content_hash)
+        )
+    finally:
+        remove_blob_file(tmp_path)
+
+
 @app.post("/upload-pdf")
 async def upload_pdf(
     file: UploadFile = File(..., description="File PDF cần xử lý"),
     prompt: str = Form(..., description="Yêu cầu tạo câu hỏi"),
+    no_cache: bool = Form(False, description="Bỏ qua cache LLM, gọi lại OpenAI"),
+    pages: str = Form(None, description="Chỉ dùng các trang này, ví dụ: 40-55, 60"),
+    section: str = Form(None, description="Chỉ dùng các mục trong mục lục PDF, ví dụ: Chương 3 (nhiều mục cách nhau bởi ;)"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -191,57 +318,20 @@ async def upload_pdf(
         raise HTTPException(status_code=400, detail="Chỉ chấp nhận file PDF")
     
     try:
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = os.path.join("uploads", unique_filename)
+        file_record = await _save_upload(file, current_user, db)
         
-        file_content = await file.read()
-        os.makedirs("uploads", exist_ok=True)
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-        
-        file_record = create_file_record(
-            db=db,
-            filename=unique_filename,
-            original_filename=file.filename,
-            file_path=file_path,
-            user_id=current_user.id,
-            file_size=len(file_content)
+        # Trích xuất một lần cho mỗi nội dung, các lần tạo câu hỏi sau dùng lại text đã lưu.
+        # Chunk đầu được gửi cho LLM trong lúc các trang sau vẫn đang trích xuất
+        selection = await resolve_page_selection(file_record.file_path, pages, section)
+        document = DocumentStream(db, file_record.file_path, file_record.content_hash, selection)
+        all_questions, chunk_texts = await generate_for_stream(
+            document.chunks(min_chars=50), prompt, use_cache=not no_cache
         )
-        
-        # Reset file pointer để đọc lại
-        await file.seek(0)
-        
-        text = await extract_text_from_pdf(file)
-        
-        if len(text.strip()) < 50:
-            raise HTTPException(
-                status_code=400,
-                detail="Văn bản quá ngắn hoặc không đủ nội dung để tạo câu hỏi"
-            )
-        
-        chunks = chunk_text(text, max_chars=settings.max_chunk_chars, overlap=settings.chunk_overlap)
-        
-        all_questions = []
-        
-        tasks = [generate_questions_from_text(chunk, prompt, idx) for idx, chunk in enumerate(chunks)]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        for idx, result in enumerate(results):
-            if isinstance(result, Exception):
-                if isinstance(result, HTTPException):
-                    if result.status_code in [401, 429]:
-                        raise result
-                    continue
-                continue
-            
-            if isinstance(result, list):
-                all_questions.extend(result)
+        text = document.text
         
         if len(all_questions) == 0:
             error_detail = (
-                "Không tạo được câu hỏi nào từ {0} chunks.".format(len(chunks)) +
+                "Không tạo được câu hỏi nào từ {0} chunks.".format(len(chunk_texts)) +
                 " Nguyên nhân có thể: " +
                 "1. Văn bản PDF quá ngắn hoặc không chứa nội dung phù hợp, " +
                 "2. OpenAI API không hoặc bị lỗi tạm thời, " +
@@ -250,7 +340,13 @@ async def upload_pdf(
             )
             raise HTTPException(status_code=400, detail=error_detail)
         
-        all_questions = check_hallucination(all_questions, text)
+        # Một lượt cho mỗi câu: auto-fix, schema, hallucination (số liệu theo chunk sinh
+        # ra câu đó) và bám nguồn theo đoạn bằng chứng BM25 trong cả tài liệu
+        validator = QuestionValidator(text, chunk_texts, passages=await document.passage_index())
+        all_questions = validator.filter(all_questions)
+        # Chunk gối đầu nhau hay sinh cùng một câu với lời hơi khác
+        dedup = QuestionDeduplicator()
+        all_questions = dedup.filter(all_questions)
         
         if len(all_questions) == 0:
             raise HTTPException(
@@ -258,14 +354,18 @@ async def upload_pdf(
                 detail="AI không thể tạo câu hỏi chính xác từ tài liệu này. Hãy thử: 1) PDF rõ ràng hơn, 2) Prompt cụ thể hơn, 3) Dùng model tốt hơn (gpt-4)"
             )
         
-        validate_question_relevance(all_questions, text, threshold=0.7)
-        question_store.set_all(all_questions)
+        relevant = validator.is_relevant(threshold=0.7)
+        run = question_crud.create_run(db, current_user.id, all_questions, file_id=file_record.id, prompt=prompt)
         
         return JSONResponse({
             "success": True,
             "questions": all_questions,
             "total": len(all_questions),
-            "message": f"Đã tạo {len(all_questions)} câu hỏi từ {len(chunks)} phần văn bản"
+            "run_id": run.id,
+            "relevance": round(validator.relevance_score, 2),
+            "relevant": relevant,
+            "duplicates_dropped": dedup.dropped,
+            "message": f"Đã tạo {len(all_questions)} câu hỏi từ {len(chunk_texts)} phần văn bản"
         })
         
     except HTTPException:
@@ -274,18 +374,37 @@ async def upload_pdf(
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý: {str(e)}")
 
 @app.get("/questions")
-async def get_questions():
-    questions = question_store.get_all()
+async def get_questions(
+    file_id: int = None,
+    run_id: int = None,
+    offset: int = 0,
+    limit: int = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Ngân hàng câu hỏi của user theo thứ tự tạo, lọc theo file / lần tạo, phân trang"""
+    limit = min(limit or settings.question_page_size, settings.question_page_max)
+    offset = max(offset, 0)
+    questions = question_crud.get_questions(db, current_user.id, file_id, run_id, offset, limit)
     return JSONResponse({
         "questions": questions,
-        "total": len(questions)
+        "total": question_crud.count_questions(db, current_user.id, file_id, run_id),
+        "offset": offset,
+        "limit": limit
     })
 
 
 @app.get("/questions/search")
-async def search_questions(keyword: str):
-
-    results = question_store.search(keyword)
+async def search_questions(
+    keyword: str,
+    limit: int = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Tìm câu hỏi của user theo từ khóa (không phân biệt dấu, khớp tiền tố từ cuối), xếp hạng BM25"""
+    limit = min(limit or settings.question_page_size, settings.question_page_max)
+    results = question_crud.search_questions(db, current_user.id, keyword, limit=limit)
+    logger.info(f"Tìm thấy {len(results)} câu hỏi với keyword '{keyword}'")
     return JSONResponse({
         "results": results,
         "count": len(results),
@@ -294,23 +413,38 @@ async def search_questions(keyword: str):
 
 
 @app.post("/update-question")
-async def update_question(data: QuestionUpdateRequest):
-
-    success = question_store.update(data.index, data.question.dict())
+async def update_question(
+    data: QuestionUpdateRequest,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Cập nhật câu hỏi theo `id`; `index` (vị trí trong ngân hàng) chỉ còn để tương thích"""
+    if data.id is not None:
+        success = question_crud.update_question(db, current_user.id, data.id, data.question.dict())
+        target = f"Câu hỏi {data.id}"
+    elif data.index is not None:
+        success = question_crud.update_question_at(db, current_user.id, data.index, data.question.dict())
+        target = f"Index {data.index}"
+    else:
+        raise HTTPException(status_code=400, detail="Thiếu id của câu hỏi cần update")
     
     if not success:
         raise HTTPException(
             status_code=400,
-            detail=f"Index {data.index} không hợp lệ"
+            detail=f"{target} không hợp lệ"
         )
     
     return JSONResponse({"success": True})
 
 
-@app.delete("/question/{index}")
-async def delete_question(index: int):
-
-    success = question_store.delete(index)
+@app.delete("/question/{index}", deprecated=True)
+async def delete_question_by_index(
+    index: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Deprecated - dùng DELETE /questions/{question_id}"""
+    success = question_crud.delete_question_at(db, current_user.id, index)
     
     if not success:
         raise HTTPException(
@@ -322,15 +456,36 @@ async def delete_question(index: int):
 
 
 @app.delete("/questions/clear")
-async def clear_all_questions():
-    count = question_store.count()
-    question_store.clear()
+async def clear_all_questions(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    count = question_crud.clear_questions(db, current_user.id)
     
     return JSONResponse({
         "success": True,
         "message": f"Đã xóa {count} câu hỏi"
     })
 
+
+# Khai báo sau /questions/clear để "clear" không bị hiểu là question_id
+@app.delete("/questions/{question_id}")
+async def delete_question(
+    question_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    success = question_crud.delete_question(db, current_user.id, question_id)
+    
+    if not success:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Không tìm thấy câu hỏi {question_id}"
+        )
+    
+    return JSONResponse({"success": True})
+
+
 @app.get("/my-files")
 async def get_my_files(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Lấy danh sách file của user hiện tại"""
@@ -361,6 +516,9 @@ async def generate_from_file(
     """Tạo câu hỏi từ file đã tải lên trước đó"""
     file_id = data.get('file_id')
     prompt = data.get('prompt')
+    no_cache = bool(data.get('no_cache', False))
+    pages = data.get('pages')
+    section = data.get('section')
     
     if not file_id or not prompt:
         raise HTTPException(status_code=400, detail="Thiếu file_id hoặc prompt")
@@ -379,62 +537,35 @@ async def generate_from_file(
         if not os.path.exists(file_record.file_path):
             raise HTTPException(status_code=404, detail="File không tồn tại trên hệ thống")
         
-        with open(file_record.file_path, 'rb') as f:
-            from io import BytesIO
-            pdf_bytes = BytesIO(f.read())
-            
-            class FakeUploadFile:
-                def __init__(self, file_bytes, filename):
-                    self.file = file_bytes
-                    self.filename = filename
-                
-                async def read(self):
-                    return self.file.read()
-                
-                async def seek(self, position):
-                    return self.file.seek(position)
-            
-            fake_file = FakeUploadFile(pdf_bytes, file_record.original_filename)
-            text = await extract_text_from_pdf(fake_file)
-        
-        if len(text.strip()) < 50:
-            raise HTTPException(
-                status_code=400,
-                detail="Văn bản quá ngắn hoặc không đủ nội dung để tạo câu hỏi"
-            )
-        
-        # Chia thành chunks
-        chunks = chunk_text(
-            text, max_chars=settings.max_chunk_chars, overlap=settings.chunk_overlap
+        selection = await resolve_page_selection(file_record.file_path, pages, section)
+        document = DocumentStream(db, file_record.file_path, file_record.content_hash, selection)
+        all_questions, chunk_texts = await generate_for_stream(
+            document.chunks(min_chars=50), prompt, use_cache=not no_cache
         )
-        
-        all_questions = []
-        
-        tasks = [generate_questions_from_text(chunk, prompt, idx) for idx, chunk in enumerate(chunks)]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        for idx, result in enumerate(results):
-            if isinstance(result, Exception):
-                continue
-            
-            if isinstance(result, list):
-                all_questions.extend(result)
+        text = document.text
         
         if len(all_questions) == 0:
             raise HTTPException(status_code=400, detail="Không tạo được câu hỏi nào. Vui lòng thử lại hoặc nhập prompt khác.")
         
-        all_questions = check_hallucination(all_questions, text)
+        # Một lượt cho mỗi câu: auto-fix, schema, hallucination (số liệu theo chunk sinh
+        # ra câu đó) và bám nguồn theo đoạn bằng chứng BM25 trong cả tài liệu
+        validator = QuestionValidator(text, chunk_texts, passages=await document.passage_index())
+        all_questions = validator.filter(all_questions)
+        # Chunk gối đầu nhau hay sinh cùng một câu với lời hơi khác
+        dedup = QuestionDeduplicator()
+        all_questions = dedup.filter(all_questions)
         
         if len(all_questions) == 0:
             raise HTTPException(status_code=400, detail="Tất cả câu hỏi đều bị nghi ngờ hallucination (không dựa vào tài liệu)")
         
-        question_store.set_all(all_questions)
+        run = question_crud.create_run(db, current_user.id, all_questions, file_id=file_record.id, prompt=prompt)
         
         return JSONResponse({
             "success": True,
             "questions": all_questions,
             "total": len(all_questions),
+            "run_id": run.id,
+            "duplicates_dropped": dedup.dropped,
             "message": f"Đã tạo {len(all_questions)} câu hỏi từ file {file_record.original_filename}"
         })
         
@@ -443,11 +574,283 @@ async def generate_from_file(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý: {str(e)}")
 
+def _ndjson(event: dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+async def _stream_questions(
+    file_record, prompt: str, use_cache: bool, source_name: str,
+    pages: str = None, section: str = None
+):
+    """
+    Pipeline tạo câu hỏi dạng stream (NDJSON): mỗi dòng là một event
+    progress / questions / done / error.
+    """
+    # Session riêng: session của Depends(get_db) có thể đã đóng khi response bắt đầu stream
+    db = SessionLocal()
+    try:
+        selection = await resolve_page_selection(file_record.file_path, pages, section)
+        document = DocumentStream(db, file_record.file_path, file_record.content_hash, selection)
+        
+        # Câu hỏi của các chunk đầu về trong lúc các trang sau vẫn đang trích xuất
+        all_questions = []
+        # Chỉ mục đoạn có sẵn nếu file đã được trích xuất trước đó; chưa có thì
+        # các câu được kiểm tra theo từ khóa trong chunk
+        validator = QuestionValidator(passages=document.cached_passage_index())
+        dedup = QuestionDeduplicator()
+        async for event in iter_generation_stream(document.chunks(min_chars=50), prompt, use_cache=use_cache):
+            if event.get("stage") == "chunked":
+                yield _ndjson({"event": "progress", "stage": "extracted", "pages": document.page_count, "chars": len(document.text)})
+                yield _ndjson({"event": "progress", "stage": "chunked", "chunks": event["chunks"]})
+                continue
+            
+            # Kiểm tra câu của chunk vừa xong, đối chiếu với chính chunk đó (gồm cả phần gối đầu)
+            valid = validator.filter(event["questions"], event["text"])
+            unique = dedup.filter(valid)
+            all_questions.extend(unique)
+            yield _ndjson({
+                "event": "questions",
+                "chunk": event["chunk"],
+                "questions": unique,
+                "dropped": len(event["questions"]) - len(valid),
+                "duplicates": len(valid) - len(unique),
+                "chunks_done": event["chunks_done"],
+                "chunks_total": event["chunks_total"]
+            })
+        
+        if len(all_questions) == 0:
+            raise HTTPException(
+                status_code=400,
+                detail="Không tạo được câu hỏi chính xác nào từ tài liệu này. Vui lòng thử lại hoặc nhập prompt khác."
+            )
+        
+        relevant = validator.is_relevant(threshold=0.7)
+        run = question_crud.create_run(db, file_record.user_id, all_questions, file_id=file_record.id, prompt=prompt)
+        
+        yield _ndjson({
+            "event": "done",
+            "success": True,
+            "total": len(all_questions),
+            "run_id": run.id,
+            "relevance": round(validator.relevance_score, 2),
+            "relevant": relevant,
+            "duplicates_dropped": dedup.dropped,
+            "message": f"Đã tạo {len(all_questions)} câu hỏi từ {source_name}"
+        })
+    
+    except HTTPException as e:
+        yield _ndjson({"event": "error", "status": e.status_code, "detail": e.detail})
+    except Exception as e:
+        logger.error(f"Lỗi stream tạo câu hỏi: {str(e)}")
+        yield _ndjson({"event": "error", "status": 500, "detail": f"Lỗi xử lý: {str(e)}"})
+    finally:
+        db.close()
+
+
+@app.post("/upload-pdf/stream")
+async def upload_pdf_stream(
+    file: UploadFile = File(..., description="File PDF cần xử lý"),
+    prompt: str = Form(..., description="Yêu cầu tạo câu hỏi"),
+    no_cache: bool = Form(False, description="Bỏ qua cache LLM, gọi lại OpenAI"),
+    pages: str = Form(None, description="Chỉ dùng các trang này, ví dụ: 40-55, 60"),
+    section: str = Form(None, description="Chỉ dùng các mục trong mục lục PDF, ví dụ: Chương 3 (nhiều mục cách nhau bởi ;)"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Giống /upload-pdf nhưng trả câu hỏi dần theo từng chunk (NDJSON)"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file PDF")
+    
+    file_record = await _save_upload(file, current_user, db)
+    
+    return StreamingResponse(
+        _stream_questions(file_record, prompt, not no_cache, f"file {file_record.original_filename}", pages, section),
+        media_type="application/x-ndjson"
+    )
+
+
+@app.post("/generate-from-file/stream")
+async def generate_from_file_stream(
+    data: dict,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Giống /generate-from-file nhưng trả câu hỏi dần theo từng chunk (NDJSON)"""
+    file_id = data.get('file_id')
+    prompt = data.get('prompt')
+    no_cache = bool(data.get('no_cache', False))
+    pages = data.get('pages')
+    section = data.get('section')
+    
+    if not file_id or not prompt:
+        raise HTTPException(status_code=400, detail="Thiếu file_id hoặc prompt")
+    
+    from crud.file_crud import get_file_by_id
+    file_record = get_file_by_id(db, file_id)
+    
+    if not file_record:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file")
+    
+    if file_record.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền truy cập file này")
+    
+    if not os.path.exists(file_record.file_path):
+        raise HTTPException(status_code=404, detail="File không tồn tại trên hệ thống")
+    
+    return StreamingResponse(
+        _stream_questions(file_record, prompt, not no_cache, f"file {file_record.original_filename}", pages, section),
+        media_type="application/x-ndjson"
+    )
+
+def _job_to_dict(job) -> dict:
+    return {
+        "job_id": job.id,
+        "file_id": job.file_id,
+        "prompt": job.prompt,
+        "status": job.status,
+        "pages": job.pages,
+        "page_spec": job.page_spec,
+        "section": job.section,
+        "chunks_done": job.chunks_done,
+        "chunks_total": job.chunks_total,
+        "total_questions": job.total_questions,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+def _get_owned_job(db: Session, job_id: str, current_user: User):
+    job = job_crud.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    if job.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền truy cập job này")
+    return job
+
+
+@app.post("/jobs/upload-pdf")
+async def create_upload_job(
+    file: UploadFile = File(..., description="File PDF cần xử lý"),
+    prompt: str = Form(..., description="Yêu cầu tạo câu hỏi"),
+    no_cache: bool = Form(False, description="Bỏ qua cache LLM, gọi lại OpenAI"),
+    pages: str = Form(None, description="Chỉ dùng các trang này, ví dụ: 40-55, 60"),
+    section: str = Form(None, description="Chỉ dùng các mục trong mục lục PDF, ví dụ: Chương 3 (nhiều mục cách nhau bởi ;)"),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Tải PDF lên và tạo câu hỏi ở chế độ chạy nền, trả về job_id ngay"""
+    if not file.filename.endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file PDF")
+    
+    # Báo lỗi cú pháp khoảng trang ngay, không đợi tới lúc job chạy
+    parse_page_spec(pages)
+    file_record = await _save_upload(file, current_user, db)
+    job = job_crud.create_job(db, current_user.id, file_record.id, prompt, use_cache=not no_cache, page_spec=pages, section=section)
+    job_manager.submit(job.id)
+    
+    return {"success": True, **_job_to_dict(job)}
+
+
+@app.post("/jobs")
+async def create_generation_job(
+    data: dict,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Tạo câu hỏi từ file đã tải lên ở chế độ chạy nền, trả về job_id ngay"""
+    file_id = data.get('file_id')
+    prompt = data.get('prompt')
+    no_cache = bool(data.get('no_cache', False))
+    pages = data.get('pages')
+    section = data.get('section')
+    
+    if not file_id or not prompt:
+        raise HTTPException(status_code=400, detail="Thiếu file_id hoặc prompt")
+    
+    from crud.file_crud import get_file_by_id
+    file_record = get_file_by_id(db, file_id)
+    
+    if not file_record:
+        raise HTTPException(status_code=404, detail="Không tìm thấy file")
+    
+    if file_record.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền truy cập file này")
+    
+    parse_page_spec(pages)
+    job = job_crud.create_job(db, current_user.id, file_record.id, prompt, use_cache=not no_cache, page_spec=pages, section=section)
+    job_manager.submit(job.id)
+    
+    return {"success": True, **_job_to_dict(job)}
+
+
+@app.get("/jobs")
+async def list_jobs(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    jobs = job_crud.get_jobs_by_user(db, current_user.id)
+    return {"success": True, "jobs": [_job_to_dict(job) for job in jobs]}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Trạng thái và tiến độ của job"""
+    job = _get_owned_job(db, job_id, current_user)
+    return {"success": True, **_job_to_dict(job)}
+
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Câu hỏi đã tạo của job (có thể là kết quả từng phần nếu job chưa xong)"""
+    job = _get_owned_job(db, job_id, current_user)
+    questions = job_crud.get_job_questions(db, job)
+    
+    return JSONResponse({
+        "success": True,
+        "status": job.status,
+        "partial": job.status not in JOB_FINISHED_STATUSES,
+        "questions": questions,
+        "total": len(questions)
+    })
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    job = _get_owned_job(db, job_id, current_user)
+    
+    # UPDATE có điều kiện: worker có thể vừa nhận job / job vừa kết thúc sau khi đọc trạng thái
+    if job_crud.set_job_status(db, job, [JOB_QUEUED], JOB_CANCELLED, finished_at=datetime.utcnow()):
+        return {"success": True, "message": "Đã hủy job"}
+    
+    if job_crud.set_job_status(db, job, [JOB_RUNNING], JOB_CANCELLING):
+        # Worker trong process này dừng ngay; worker ở nơi khác (hoặc job chờ chạy tiếp
+        # sau restart) dừng khi thấy trạng thái cancelling
+        job_manager.cancel(job.id)
+        return {"success": True, "message": "Đã gửi yêu cầu hủy job"}
+    
+    raise HTTPException(status_code=409, detail=f"Job không thể hủy ({job.status})")
+
 @app.delete("/vector-store/clear")
-async def clear_vector_store():
+async def clear_vector_store(
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     try:
-        count = question_store.count()
-        question_store.clear()
+        count = question_crud.clear_questions(db, current_user.id)
         
         return JSONResponse({
             "success": True,
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy.dialects.mysql import LONGTEXT
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from config.database import Base
@@ -13,6 +14,50 @@ class UploadedFile(Base):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
     file_size = Column(Integer, nullable=True)
+    content_hash = Column(String(64), ForeignKey('file_blobs.content_hash'), nullable=True, index=True)
     
     def __repr__(self):
         return f"<UploadedFile(id={self.id}, filename='{self.filename}', user_id={self.user_id})>"
+
+
+class FileBlob(Base):
+    """File PDF lưu một lần theo SHA-256 nội dung, dùng chung cho mọi UploadedFile cùng nội dung"""
+    __tablename__ = "file_blobs"
+
+    content_hash = Column(String(64), primary_key=True)
+    file_path = Column(String(512), nullable=False)
+    file_size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<FileBlob(content_hash='{self.content_hash[:12]}', ref_count={self.ref_count})>"
+
+
+class ExtractedText(Base):
+    """Text đã trích xuất + làm sạch của một PDF, khóa theo SHA-256 nội dung file"""
+    __tablename__ = "extracted_texts"
+
+    content_hash = Column(String(64), primary_key=True)
+    version = Column(String(64), nullable=False)  # engine + phiên bản làm sạch; khác → trích xuất lại
+    text = Column(Text().with_variant(LONGTEXT(), "mysql"), nullable=False)
+    page_offsets = Column(Text, nullable=False)  # JSON [[số trang, start, end], ...] trong text
+    page_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ExtractedText(content_hash='{self.content_hash[:12]}', version='{self.version}', pages={self.page_count})>"
+
+
+class PassageIndexRecord(Base):
+    """Chỉ mục BM25 theo đoạn của text đã trích xuất (xem services.evidence.PassageIndex)"""
+    __tablename__ = "passage_indexes"
+
+    content_hash = Column(String(64), primary_key=True)
+    version = Column(String(96), nullable=False)  # phiên bản text + cách cắt đoạn; khác → dựng lại
+    passages = Column(Text().with_variant(LONGTEXT(), "mysql"), nullable=False)  # JSON [[số trang, start, end], ...]
+    term_freqs = Column(Text().with_variant(LONGTEXT(), "mysql"), nullable=False)  # JSON [{term: tần suất}, ...]
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<PassageIndexRecord(content_hash='{self.content_hash[:12]}', version='{self.version}')>"
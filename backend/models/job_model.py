@@ -0,0 +1,58 @@
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, ForeignKey
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from config.database import Base
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+JOB_CANCELLING = "cancelling"  # đã yêu cầu hủy, worker đang chạy job sẽ dừng ở chunk kế tiếp
+
+JOB_FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+JOB_UNFINISHED_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING)
+
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    file_id = Column(Integer, ForeignKey('uploaded_files.id', ondelete='CASCADE'), nullable=False, index=True)
+    prompt = Column(Text, nullable=False)
+    use_cache = Column(Boolean, default=True)
+    status = Column(String(20), default=JOB_QUEUED, index=True)
+    pages = Column(Integer, nullable=True)
+    page_spec = Column(String(255), nullable=True)  # "40-55, 60" - chỉ dùng các trang này
+    section = Column(String(255), nullable=True)  # mục trong mục lục PDF, cách nhau bởi ';'
+    chunks_total = Column(Integer, default=0)
+    chunks_done = Column(Integer, default=0)
+    total_questions = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    chunks = relationship(
+        "GenerationJobChunk",
+        cascade="all, delete-orphan",
+        order_by="GenerationJobChunk.id"
+    )
+
+    def __repr__(self):
+        return f"<GenerationJob(id='{self.id}', status='{self.status}', user_id={self.user_id})>"
+
+
+class GenerationJobChunk(Base):
+    """Kết quả của một chunk đã xong - dùng để chạy tiếp job sau khi restart"""
+    __tablename__ = "generation_job_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(36), ForeignKey('generation_jobs.id', ondelete='CASCADE'), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False)
+    questions = Column(Text, nullable=False)  # JSON array
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<GenerationJobChunk(job_id='{self.job_id}', chunk_index={self.chunk_index})>"
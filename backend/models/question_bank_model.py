@@ -0,0 +1,96 @@
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.mysql import LONGTEXT
+from datetime import datetime
+from config.database import Base
+
+
+class GenerationRun(Base):
+    """Một lần tạo câu hỏi (request đồng bộ, stream hoặc job nền) của một user"""
+    __tablename__ = "generation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    file_id = Column(Integer, ForeignKey('uploaded_files.id', ondelete='SET NULL'), nullable=True)
+    job_id = Column(String(36), nullable=True, unique=True)  # job nền sinh ra lần chạy này (nếu có)
+    prompt = Column(Text, nullable=True)
+    question_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<GenerationRun(id={self.id}, user_id={self.user_id}, questions={self.question_count})>"
+
+
+class StoredQuestion(Base):
+    """
+    Câu hỏi trong ngân hàng câu hỏi của user. `data` giữ nguyên dict câu hỏi (JSON);
+    các cột còn lại tách ra để lọc / tìm kiếm. Thứ tự trong ngân hàng = thứ tự id.
+    """
+    __tablename__ = "questions"
+    __table_args__ = (
+        # Liệt kê / lấy câu thứ n của user theo thứ tự, lọc theo file
+        Index("ix_questions_user_id_id", "user_id", "id"),
+        Index("ix_questions_user_id_file_id", "user_id", "file_id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    file_id = Column(Integer, ForeignKey('uploaded_files.id', ondelete='SET NULL'), nullable=True)
+    run_id = Column(Integer, ForeignKey('generation_runs.id', ondelete='CASCADE'), nullable=False, index=True)
+    type = Column(String(20), nullable=False, default="mcq")
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False)
+    page_start = Column(Integer, nullable=True)
+    page_end = Column(Integer, nullable=True)
+    grounding = Column(Float, nullable=True)
+    data = Column(Text().with_variant(LONGTEXT(), "mysql"), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<StoredQuestion(id={self.id}, user_id={self.user_id}, run_id={self.run_id})>"
+
+
+class QuestionTerm(Base):
+    """
+    Chỉ mục ngược để tìm kiếm câu hỏi: term (token đã bỏ dấu, xem
+    services.lexical.tokenize) → câu hỏi chứa nó, kèm tần suất và độ dài câu
+    (số term) để chấm BM25 mà không phải đọc bảng questions.
+    """
+    __tablename__ = "question_terms"
+    __table_args__ = (
+        # Danh sách câu hỏi của một term, câu ngắn trước (cùng tf thì điểm BM25 cao hơn)
+        Index("ix_question_terms_user_id_term_doc_length", "user_id", "term", "doc_length"),
+    )
+
+    question_id = Column(Integer, ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True)
+    term = Column(String(64), primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    tf = Column(Integer, nullable=False)
+    doc_length = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<QuestionTerm(question_id={self.question_id}, term='{self.term}', tf={self.tf})>"
+
+
+class QuestionSearchTerm(Base):
+    """Số câu hỏi của user chứa term (df của BM25); khóa (user_id, term) cũng dùng để mở rộng tiền tố"""
+    __tablename__ = "question_search_terms"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    term = Column(String(64), primary_key=True)
+    df = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<QuestionSearchTerm(user_id={self.user_id}, term='{self.term}', df={self.df})>"
+
+
+class QuestionSearchStats(Base):
+    """Số câu đã đánh chỉ mục và tổng độ dài của ngân hàng câu hỏi một user (N, avgdl của BM25)"""
+    __tablename__ = "question_search_stats"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    doc_count = Column(Integer, nullable=False, default=0)
+    total_length = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<QuestionSearchStats(user_id={self.user_id}, doc_count={self.doc_count})>"
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Literal
+from typing import Any, Dict, List, Optional, Literal
 from enum import Enum
 
 
@@ -17,6 +17,11 @@ class Question(BaseModel):
     explanation: Optional[str] = Field(default=None, description="Giải thích đáp án")
     difficulty: Optional[Literal["easy", "medium", "hard"]] = Field(default=None, description="Độ khó")
     tags: Optional[List[str]] = Field(default=None, description="Tags cho câu hỏi")
+    chunk_id: Optional[int] = Field(default=None, description="Chunk sinh ra câu hỏi")
+    page_start: Optional[int] = Field(default=None, description="Trang đầu của đoạn nguồn")
+    page_end: Optional[int] = Field(default=None, description="Trang cuối của đoạn nguồn")
+    grounding: Optional[float] = Field(default=None, description="Mức bám nguồn 0..1 (BM25 của đoạn bằng chứng tốt nhất)")
+    evidence: Optional[List[Dict[str, Any]]] = Field(default=None, description="Các đoạn bằng chứng [{page, score, text}]")
     
     class Config:
         json_schema_extra = {
@@ -34,7 +39,8 @@ class Question(BaseModel):
 
 class QuestionUpdateRequest(BaseModel):
     """Request update câu hỏi TRẮC NGHIỆM"""
-    index: int = Field(..., ge=0, description="Index của câu hỏi cần update")
+    id: Optional[int] = Field(default=None, description="id của câu hỏi cần update (trường `id` trong danh sách câu hỏi)")
+    index: Optional[int] = Field(default=None, ge=0, description="(Deprecated - dùng id) Vị trí của câu hỏi trong ngân hàng")
     question: Question = Field(..., description="Dữ liệu câu hỏi mới")
 
 
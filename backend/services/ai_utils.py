@@ -1,20 +1,38 @@
-from openai import OpenAI, APIError, RateLimitError, AuthenticationError
+from openai import RateLimitError, AuthenticationError
 import json
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Mapping, Optional, Tuple
 from fastapi import HTTPException
 from config.settings import settings
+from services.llm_client import chat_completion, stream_chat_completion
+from services.json_stream import IncrementalQuestionParser, extract_complete_objects
+from services.question_planner import parse_requested_total
+from services.question_validator import QuestionValidator
+from services.llm_cache import llm_cache, make_cache_key
 
 logger = logging.getLogger(__name__)
 
-client = OpenAI(api_key=settings.openai_api_key)
+# Tăng mỗi khi sửa prompt/template để cache cũ tự hết hiệu lực
+PROMPT_TEMPLATE_VERSION = "2"
 
+RELEVANCE_MODEL = "gpt-3.5-turbo"
+RELEVANCE_TEMPERATURE = 0.3
 
-async def check_content_relevance(text: str, user_prompt: str) -> Dict[str, Any]:
+
+async def check_content_relevance(text: str, user_prompt: str, use_cache: bool = True) -> Dict[str, Any]:
     """
     Kiểm tra xem nội dung file có liên quan đến yêu cầu của người dùng không
     Trả về: {"relevant": True/False, "reason": "...", "confidence": 0.0-1.0}
     """
+    cache_key = make_cache_key(
+        "relevance", text[:500], user_prompt, RELEVANCE_MODEL, RELEVANCE_TEMPERATURE, PROMPT_TEMPLATE_VERSION
+    )
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"📦 Cache hit kiểm tra độ liên quan: {cached}")
+            return cached
+
     try:
         system_message = {
             "role": "system",
@@ -68,10 +86,10 @@ NỘI DUNG TÀI LIỆU (500 ký tự đầu):
 PHÂN TÍCH: Tài liệu này có đủ thông tin để tạo câu hỏi theo yêu cầu không?"""
         }
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",  # Dùng model rẻ cho task này
+        response = await chat_completion(
+            model=RELEVANCE_MODEL,  # Dùng model rẻ cho task này
             messages=[system_message, user_message],
-            temperature=0.3,
+            temperature=RELEVANCE_TEMPERATURE,
             max_tokens=300
         )
         
@@ -88,6 +106,7 @@ PHÂN TÍCH: Tài liệu này có đủ thông tin để tạo câu hỏi theo y
         
         result = json.loads(content.strip())
         logger.info(f"📊 Kiểm tra độ liên quan: {result}")
+        llm_cache.set(cache_key, result)
         return result
         
     except Exception as e:
@@ -102,124 +121,89 @@ PHÂN TÍCH: Tài liệu này có đủ thông tin để tạo câu hỏi theo y
         }
 
 
-async def generate_questions_from_text(text: str, user_prompt: str, chunk_index: int = 0) -> List[Dict[str, Any]]:
+async def ensure_content_relevance(text: str, user_prompt: str, use_cache: bool = True) -> None:
+    """Dừng sớm (HTTP 400) nếu nội dung tài liệu không phù hợp với yêu cầu"""
+    logger.info("🔍 Đang kiểm tra độ liên quan giữa yêu cầu và nội dung file...")
+    relevance_check = await check_content_relevance(text, user_prompt, use_cache=use_cache)
+
+    if not relevance_check.get("relevant", False) or relevance_check.get("confidence", 0) < 0.3:
+        logger.warning(f"❌ Nội dung không phù hợp: {relevance_check.get('reason', 'Không rõ lý do')}")
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Nội dung file không phù hợp với yêu cầu",
+                "reason": relevance_check.get("reason", "Tài liệu không chứa thông tin liên quan"),
+                "topics_found": relevance_check.get("topics_found", []),
+                "topics_missing": relevance_check.get("topics_missing", []),
+                "suggestion": "Vui lòng chọn file khác có nội dung phù hợp hoặc thay đổi yêu cầu tạo câu hỏi"
+            }
+        )
+
+    logger.info(f"✅ Nội dung phù hợp (confidence: {relevance_check.get('confidence', 0):.2f})")
+    if relevance_check.get("topics_missing"):
+        logger.warning(f"⚠️ Một số chủ đề còn thiếu: {relevance_check.get('topics_missing')}")
 
+
+async def generate_questions_from_text(
+    text: str,
+    user_prompt: str,
+    chunk_index: int = 0,
+    num_questions: Optional[int] = None,
+    use_cache: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Tạo câu hỏi trắc nghiệm từ một chunk.
+    `num_questions` là quota của chunk (do planner chia); None → lấy tổng số trong prompt.
+    `use_cache=False` bỏ qua cache đọc (vẫn ghi kết quả mới vào cache).
+    """
     try:
-        # 🔍 BƯỚC 1: KIỂM TRA ĐỘ LIÊN QUAN TRƯỚC KHI TẠO CÂU HỎI
-        if chunk_index == 0:  # Chỉ kiểm tra ở chunk đầu tiên
-            logger.info("🔍 Đang kiểm tra độ liên quan giữa yêu cầu và nội dung file...")
-            relevance_check = await check_content_relevance(text, user_prompt)
-            
-            if not relevance_check.get("relevant", False) or relevance_check.get("confidence", 0) < 0.3:
-                logger.warning(f"❌ Nội dung không phù hợp: {relevance_check.get('reason', 'Không rõ lý do')}")
-                raise HTTPException(
-                    status_code=400,
-                    detail={
-                        "error": "Nội dung file không phù hợp với yêu cầu",
-                        "reason": relevance_check.get("reason", "Tài liệu không chứa thông tin liên quan"),
-                        "topics_found": relevance_check.get("topics_found", []),
-                        "topics_missing": relevance_check.get("topics_missing", []),
-                        "suggestion": "Vui lòng chọn file khác có nội dung phù hợp hoặc thay đổi yêu cầu tạo câu hỏi"
-                    }
-                )
-            else:
-                logger.info(f"✅ Nội dung phù hợp (confidence: {relevance_check.get('confidence', 0):.2f})")
-                if relevance_check.get("topics_missing"):
-                    logger.warning(f"⚠️ Một số chủ đề còn thiếu: {relevance_check.get('topics_missing')}")
-
-        # 🎯 BƯỚC 2: TẠO CÂU HỎI TRẮC NGHIỆM
-        import re
-        numbers_in_prompt = re.findall(r'\d+', user_prompt)
-        total_questions = sum(int(n) for n in numbers_in_prompt) if numbers_in_prompt else 5
+        # 🎯 TẠO CÂU HỎI TRẮC NGHIỆM
+        total_questions = num_questions if num_questions is not None else parse_requested_total(user_prompt)
         
         # 🎯 MẶC ĐỊNH = TRẮC NGHIỆM (MCQ)
         required_type = "mcq"
         
         logger.info(f"🎯 Type: TRẮC NGHIỆM (mcq) | Số: {total_questions} | Yêu cầu: '{user_prompt}'")
         
-        user_message = {
-            "role": "user",
-            "content": f"""📄 TÀI LIỆU GỐC (TOÀN BỘ NỘI DUNG):
-{'='*80}
-{text}
-{'='*80}
-
-YÊU CẦU CỦA NGƯỜI DÙNG: {user_prompt}
-
-SỐ LƯỢNG CÂU HỎI CẦN TẠO: {total_questions} câu
-
-🚨🚨🚨 LOẠI CÂU HỎI: TRẮC NGHIỆM (MCQ) - 4 ĐÁP ÁN A,B,C,D 🚨🚨🚨
-
-✅ FORMAT BẮT BUỘC:
-{{"question": "...", "type": "mcq", "choices": ["A. ...", "B. ...", "C. ...", "D. ..."], "answer": "A. ..."}}
-
-❌ CHỈ TẠO TRẮC NGHIỆM!
-
-CÁCH LÀM:
-1. ĐỌC tài liệu
-2. TÌM thông tin liên quan
-3. TẠO {total_questions} câu TRẮC NGHIỆM với 4 đáp án A,B,C,D
-4. ĐẢM BẢO đúng format
-
-OUTPUT - CHỈ JSON ARRAY:
-[{{"question":"...", "type":"mcq", "choices":["A. ...","B. ...","C. ...","D. ..."], "answer":"A. ..."}}]"""
-        }
-        
-        system_message = {
-            "role": "system",
-            "content": "TẠO CÂU HỎI TRẮC NGHIỆM với 4 đáp án A,B,C,D. Output JSON array."
-        }
+        messages = build_question_messages(text, user_prompt, total_questions)
         
         logger.info(f"Yêu cầu tạo {total_questions} câu TRẮC NGHIỆM cho chunk {chunk_index}...")
         logger.info(f"Prompt: {user_prompt[:100]}...")
         
-        try:
-            response = client.chat.completions.create(
-                model=settings.openai_model,
-                messages=[system_message, user_message],
-                temperature=settings.ai_temperature,
-                max_tokens=settings.ai_max_tokens
-            )
-            content = response.choices[0].message.content.strip()
-        except Exception as api_error:
-            logger.error(f"Lỗi gọi Chat API: {str(api_error)}")
-            raise
+        cache_key = make_cache_key(
+            "questions", text, user_prompt, settings.openai_model, settings.ai_temperature,
+            PROMPT_TEMPLATE_VERSION, num_questions=total_questions
+        )
+        content = llm_cache.get(cache_key) if use_cache else None
+        from_cache = content is not None
+
+        if from_cache:
+            logger.info(f"📦 Cache hit cho chunk {chunk_index}")
+        elif settings.llm_streaming:
+            questions, complete = await _stream_questions(messages, total_questions, chunk_index)
+            # Cache dạng JSON array chuẩn → lần sau parse_ai_response đọc thẳng
+            if complete:
+                llm_cache.set(cache_key, json.dumps(questions, ensure_ascii=False))
+            logger.info(f"✅ Tạo được {len(questions)} câu hỏi (type={required_type}, stream) từ chunk {chunk_index}")
+            return questions
+        else:
+            try:
+                response = await chat_completion(
+                    model=settings.openai_model,
+                    messages=messages,
+                    temperature=settings.ai_temperature,
+                    max_tokens=settings.ai_max_tokens
+                )
+                content = response.choices[0].message.content.strip()
+            except Exception as api_error:
+                logger.error(f"Lỗi gọi Chat API: {str(api_error)}")
+                raise
 
         logger.info(f"Response từ AI (100 ký tự đầu): {content[:100]}")
         questions = parse_ai_response(content)
-        
-        # 🔧 AUTO-FIX: BẮT BUỘC TẤT CẢ LÀ TRẮC NGHIỆM
-        fixed_count = 0
-        for i, q in enumerate(questions):
-            actual_type = q.get("type", "")
-            
-            # Fix 1: BẮT BUỘC type = mcq
-            if actual_type != "mcq":
-                logger.warning(f"⚠️ CÂU {i+1}: type='{actual_type}' → SỬA thành 'mcq'")
-                q["type"] = "mcq"
-                fixed_count += 1
-            
-            # Fix 2: BẮT BUỘC có 4 choices A,B,C,D
-            choices = q.get("choices", [])
-            if not choices or len(choices) < 4:
-                logger.warning(f"⚠️ CÂU {i+1}: Thiếu choices → Thêm 4 đáp án A,B,C,D")
-                ans_text = str(q.get("answer", "Đáp án đúng"))
-                # Xóa prefix A. B. C. D. nếu có
-                for prefix in ["A. ", "B. ", "C. ", "D. "]:
-                    ans_text = ans_text.replace(prefix, "")
-                ans_text = ans_text.strip()
-                
-                q["choices"] = [
-                    f"A. {ans_text}",
-                    f"B. Đáp án khác 1",
-                    f"C. Đáp án khác 2",
-                    f"D. Đáp án khác 3"
-                ]
-                q["answer"] = f"A. {ans_text}"
-                fixed_count += 1
-        
-        if fixed_count > 0:
-            logger.warning(f"🔧 Đã tự động sửa {fixed_count} vấn đề về type/choices")
+        # Chỉ cache response parse được
+        if not from_cache:
+            llm_cache.set(cache_key, content)
         
         logger.info(f"✅ Tạo được {len(questions)} câu hỏi (type={required_type}) từ chunk {chunk_index}")
         return questions
@@ -246,6 +230,88 @@ OUTPUT - CHỈ JSON ARRAY:
         )
 
 
+async def _stream_questions(
+    messages: List[Dict[str, str]], total_questions: int, chunk_index: int
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Streaming completion + parser tăng dần: mỗi câu hỏi được parse ngay khi object
+    của nó đóng (auto-fix MCQ làm ở QuestionValidator). Đủ `total_questions` câu thì ngắt stream (không trả tiền
+    cho token thừa). Trả về (questions, complete) - complete=False nếu stream lỗi giữa
+    chừng và chỉ giữ được một phần (không nên cache).
+    """
+    parser = IncrementalQuestionParser()
+    questions: List[Dict[str, Any]] = []
+    stream = stream_chat_completion(
+        model=settings.openai_model,
+        messages=messages,
+        temperature=settings.ai_temperature,
+        max_tokens=settings.ai_max_tokens
+    )
+    try:
+        async for delta in stream:
+            for obj in parser.feed(delta):
+                if "question" not in obj:
+                    if "error" in obj:
+                        logger.warning(f"⚠️ AI không tạo được câu hỏi từ chunk {chunk_index}: {obj['error']}")
+                    continue
+                obj.setdefault("answer", "Chưa cập nhật")
+                questions.append(obj)
+            if len(questions) >= total_questions > 0:
+                logger.info(f"✂️ Chunk {chunk_index}: đủ {total_questions} câu, ngắt stream")
+                break
+    except Exception as e:
+        if not questions:
+            logger.error(f"Lỗi gọi Chat API (stream): {str(e)}")
+            raise
+        logger.warning(f"⚠️ Stream chunk {chunk_index} lỗi giữa chừng ({str(e)}), giữ {len(questions)} câu đã nhận")
+        return questions, False
+    finally:
+        await stream.aclose()
+
+    if parser.pending:
+        logger.warning(f"⚠️ Response chunk {chunk_index} bị cắt ngang (AI_MAX_TOKENS?), giữ {len(questions)} câu hoàn chỉnh")
+    return questions, True
+
+
+def build_question_messages(text: str, user_prompt: str, total_questions: int) -> List[Dict[str, str]]:
+    """Messages gửi LLM để tạo `total_questions` câu từ một chunk (dùng chung cho gọi trực tiếp và Batch API)"""
+    user_message = {
+        "role": "user",
+        "content": f"""📄 TÀI LIỆU GỐC (TOÀN BỘ NỘI DUNG):
+{'='*80}
+{text}
+{'='*80}
+
+YÊU CẦU CỦA NGƯỜI DÙNG: {user_prompt}
+
+SỐ LƯỢNG CÂU HỎI CẦN TẠO TỪ PHẦN TÀI LIỆU NÀY: {total_questions} câu
+(Tổng số câu trong yêu cầu đã được chia cho nhiều phần tài liệu - CHỈ tạo đúng {total_questions} câu)
+
+🚨🚨🚨 LOẠI CÂU HỎI: TRẮC NGHIỆM (MCQ) - 4 ĐÁP ÁN A,B,C,D 🚨🚨🚨
+
+✅ FORMAT BẮT BUỘC:
+{{"question": "...", "type": "mcq", "choices": ["A. ...", "B. ...", "C. ...", "D. ..."], "answer": "A. ..."}}
+
+❌ CHỈ TẠO TRẮC NGHIỆM!
+
+CÁCH LÀM:
+1. ĐỌC tài liệu
+2. TÌM thông tin liên quan
+3. TẠO {total_questions} câu TRẮC NGHIỆM với 4 đáp án A,B,C,D
+4. ĐẢM BẢO đúng format
+
+OUTPUT - CHỈ JSON ARRAY:
+[{{"question":"...", "type":"mcq", "choices":["A. ...","B. ...","C. ...","D. ..."], "answer":"A. ..."}}]"""
+    }
+    
+    system_message = {
+        "role": "system",
+        "content": "TẠO CÂU HỎI TRẮC NGHIỆM với 4 đáp án A,B,C,D. Output JSON array."
+    }
+    
+    return [system_message, user_message]
+
+
 def parse_ai_response(content: str) -> List[Dict[str, Any]]:
 
     if not content:
@@ -269,18 +335,34 @@ def parse_ai_response(content: str) -> List[Dict[str, Any]]:
                 return []
         except json.JSONDecodeError:
             pass
+    # Một object câu hỏi không bọc trong array: '[' đầu tiên là mảng choices của nó
+    if content.startswith('{'):
+        try:
+            single = json.loads(content)
+            if isinstance(single, dict) and "question" in single:
+                single.setdefault("answer", "Chưa cập nhật")
+                return [single]
+        except json.JSONDecodeError:
+            pass
     
     start_idx = content.find('[')
     end_idx = content.rfind(']')
     
-    if start_idx == -1 or end_idx == -1:
+    if start_idx == -1:
         logger.warning("Response không chứa JSON array, trả về list rỗng")
         return []  
     
-    json_str = content[start_idx:end_idx + 1]
+    json_str = content[start_idx:end_idx + 1] if end_idx > start_idx else ""
     
     try:
-        questions = json.loads(json_str)
+        try:
+            questions = json.loads(json_str)
+        except json.JSONDecodeError as e:
+            # Response bị cắt ngang (chạm AI_MAX_TOKENS) → giữ các object đã hoàn chỉnh
+            questions = extract_complete_objects(content[start_idx:])
+            if not questions:
+                raise
+            logger.warning(f"⚠️ JSON bị cắt ngang ({str(e)}), khôi phục {len(questions)} object hoàn chỉnh")
         if not isinstance(questions, list):
             raise ValueError("Response không phải là array")
         
@@ -300,13 +382,13 @@ def parse_ai_response(content: str) -> List[Dict[str, Any]]:
         if not validated:
 
             logger.warning(f" Validation failed nhưng response có {len(questions)} items, trả về chúng với cảnh báo")
+            questions = [q for q in questions if isinstance(q, dict)]
             if questions:
                 for q in questions:
-                    if isinstance(q, dict):
-                        if "question" not in q:
-                            q["question"] = str(q)  
-                        if "answer" not in q:
-                            q["answer"] = "Chưa cập nhật"
+                    if "question" not in q:
+                        q["question"] = str(q)  
+                    if "answer" not in q:
+                        q["answer"] = "Chưa cập nhật"
                 return questions
             
             raise HTTPException(
@@ -324,100 +406,24 @@ def parse_ai_response(content: str) -> List[Dict[str, Any]]:
         )
 
 
-def validate_question_relevance(questions: List[Dict], source_text: str, threshold: float = 0.3) -> bool:
+def validate_question_relevance(
+    questions: List[Dict], source_text: str, threshold: float = 0.3,
+    chunk_texts: Optional[Mapping[int, str]] = None
+) -> bool:
     """
-    Validate độ liên quan của câu hỏi với văn bản nguồn
-    Cải thiện: Kiểm tra chi tiết hơn bằng cách tìm keywords trong cả question và answer
+    Validate độ liên quan của câu hỏi với văn bản nguồn (xem QuestionValidator).
+    `chunk_texts` ({chunk_id: text}): đối chiếu mỗi câu với chunk nguồn của nó thay vì cả tài liệu
     """
-    if not questions:
-        return False
-    
-    source_lower = source_text.lower()
-    relevant_count = 0
-    
-    for q in questions:
-        question_text = q.get("question", "").lower()
-        answer_text = str(q.get("answer", "")).lower()
-        choices_text = " ".join([str(c).lower() for c in q.get("choices", [])])
-        
-        combined_text = f"{question_text} {answer_text} {choices_text}"
-        
-        stopwords = {'của', 'và', 'cho', 'với', 'trong', 'trên', 'dưới', 'được', 'là', 'có', 
-                     'the', 'and', 'for', 'with', 'from', 'this', 'that', 'are', 'was'}
-        words = [w.strip('.,?!:;"()[]{}') for w in combined_text.split()]
-        keywords = [w for w in words if len(w) >= 4 and w not in stopwords]
-        
-        matches = sum(1 for word in keywords if word in source_lower)
-        
-        if keywords:
-            match_ratio = matches / len(keywords)
-            if match_ratio >= 0.4 or matches >= 5:
-                relevant_count += 1
-                logger.debug(f"✅ Câu hỏi liên quan: {question_text[:50]}... ({matches}/{len(keywords)} keywords)")
-            else:
-                logger.warning(f"⚠️ Câu hỏi ít liên quan: {question_text[:50]}... ({matches}/{len(keywords)} keywords)")
-    
-    relevance_score = relevant_count / len(questions)
-    logger.info(f"📊 Độ liên quan: {relevance_score:.2f} ({relevant_count}/{len(questions)})")
-    
-    return relevance_score >= threshold
-
+    validator = QuestionValidator(source_text, chunk_texts, repair=False)
+    validator.validate(questions)
+    return validator.is_relevant(threshold)
 
-def check_hallucination(questions: List[Dict], source_text: str) -> List[Dict]:
 
-    import re
-    
-    source_lower = source_text.lower()
-    filtered_questions = []
-    hallucination_count = 0
-    
-    source_numbers = set(re.findall(r'\d+(?:\.\d+)?', source_text))
-    
-    for idx, q in enumerate(questions):
-        question_text = q.get("question", "")
-        answer_text = str(q.get("answer", ""))
-        choices = q.get("choices", [])
-        
-        is_hallucination = False
-        reason = ""
-        
-        question_numbers = set(re.findall(r'\d+(?:\.\d+)?', question_text + " " + answer_text))
-        if question_numbers and not question_numbers.issubset(source_numbers):
-            suspicious_numbers = question_numbers - source_numbers
-            if suspicious_numbers:
-                is_hallucination = True
-                reason = f"Số liệu không có trong tài liệu: {suspicious_numbers}"
-        
-        answer_keywords = [w.strip('.,?!:;"()[]{}').lower() 
-                          for w in answer_text.split() 
-                          if len(w) > 5]  
-        
-        if answer_keywords:
-            matches = sum(1 for kw in answer_keywords if kw in source_lower)
-            if len(answer_keywords) >= 3 and matches / len(answer_keywords) < 0.3:
-                is_hallucination = True
-                reason = f"Answer chứa quá nhiều từ không có trong tài liệu ({matches}/{len(answer_keywords)} keywords)"
-        
-        if choices and isinstance(choices, list):
-            for choice in choices:
-                choice_str = str(choice).lower()
-
-                choice_numbers = set(re.findall(r'\d+(?:\.\d+)?', choice_str))
-                if choice_numbers and not choice_numbers.issubset(source_numbers):
-                    suspicious = choice_numbers - source_numbers
-                    if suspicious:
-                        is_hallucination = True
-                        reason = f"Lựa chọn có số không có trong tài liệu: {suspicious}"
-                        break
-        
-        if is_hallucination:
-            hallucination_count += 1
-            logger.warning(f" Loại bỏ câu {idx+1} (nghi ngờ hallucination): {question_text[:60]}...")
-            logger.warning(f"   Lý do: {reason}")
-        else:
-            filtered_questions.append(q)
-    
-    if hallucination_count > 0:
-        logger.info(f"Đã lọc bỏ {hallucination_count}/{len(questions)} câu hỏi nghi ngờ hallucination")
-    
-    return filtered_questions
+def check_hallucination(
+    questions: List[Dict], source_text: str, chunk_texts: Optional[Mapping[int, str]] = None
+) -> List[Dict]:
+    """
+    Loại câu hỏi có số liệu/từ khóa không có trong nguồn (xem QuestionValidator).
+    `chunk_texts` ({chunk_id: text}): nguồn của mỗi câu là chunk sinh ra nó thay vì cả tài liệu.
+    """
+    return QuestionValidator(source_text, chunk_texts, repair=False).filter(questions)
@@ -0,0 +1,288 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from openai import OpenAI
+from config.settings import settings
+from services.pdf_utils import extract_pages_from_bytes, join_pages, chunk_text
+from services.ai_utils import build_question_messages, parse_ai_response
+from services.question_validator import QuestionValidator
+from services.question_dedup import dedupe_questions
+from services.question_planner import (
+    parse_requested_total, chunk_relevance, select_top_chunks, allocate_question_budget
+)
+from services.rate_limiter import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Giới hạn của Batch API: tối đa 50.000 request mỗi file
+BATCH_MAX_REQUESTS = 50000
+
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_batch_requests(pdf_dir: str, prompt: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Trích xuất + chia chunk mọi PDF trong thư mục, tạo request Batch API với đúng
+    prompt của generate_questions_from_text. Trả về (requests, manifest) -
+    manifest giữ văn bản nguồn để kiểm tra hallucination khi có kết quả.
+    """
+    total = parse_requested_total(prompt)
+    requests = []
+    manifest = {"prompt": prompt, "documents": {}}
+
+    for name in sorted(os.listdir(pdf_dir)):
+        if not name.lower().endswith(".pdf"):
+            continue
+        path = os.path.join(pdf_dir, name)
+        try:
+            with open(path, "rb") as f:
+                text = join_pages(extract_pages_from_bytes(f.read()))
+        except Exception as e:
+            logger.warning(f"⚠️ Bỏ qua {name}: {str(e)}")
+            continue
+
+        doc_id = hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+        chunks = chunk_text(text)
+        quotas = allocate_question_budget(chunks, total, select_top_chunks(chunk_relevance(chunks, prompt), total))
+
+        for idx, quota in enumerate(quotas):
+            if quota <= 0:
+                continue
+            requests.append({
+                "custom_id": f"{doc_id}:{idx}",
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": settings.openai_model,
+                    "messages": build_question_messages(chunks[idx], prompt, quota),
+                    "temperature": settings.ai_temperature,
+                    "max_tokens": settings.ai_max_tokens
+                }
+            })
+
+        manifest["documents"][doc_id] = {"filename": name, "text": text, "chunks": len(chunks)}
+        logger.info(f"📄 {name}: {len(chunks)} chunks, {sum(1 for q in quotas if q)} request")
+
+    return requests, manifest
+
+
+def write_batch_files(requests: List[Dict[str, Any]], work_dir: str) -> List[str]:
+    """Ghi request ra các file JSONL (mỗi file tối đa BATCH_MAX_REQUESTS dòng)"""
+    os.makedirs(work_dir, exist_ok=True)
+    paths = []
+    for part, start in enumerate(range(0, len(requests), BATCH_MAX_REQUESTS)):
+        path = os.path.join(work_dir, f"batch_input_{part:03d}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for request in requests[start:start + BATCH_MAX_REQUESTS]:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        paths.append(path)
+    return paths
+
+
+class OpenAIBatchBackend:
+    """Gửi file JSONL lên OpenAI Batch API (giá rẻ hơn ~50%, hoàn thành trong 24h)"""
+
+    def __init__(self, api_key: str):
+        self.client = OpenAI(api_key=api_key, max_retries=0)
+
+    def submit(self, input_path: str) -> str:
+        def create_file():
+            # Mở lại file mỗi lần thử: lần trước lỗi giữa chừng đã đọc dở file
+            with open(input_path, "rb") as f:
+                return self.client.files.create(file=f, purpose="batch")
+
+        batch_file = rate_limiter.call_sync(create_file)
+        # Timeout khi tạo batch không retry: batch có thể đã được tạo và sẽ chạy (tính tiền) hai lần
+        batch = rate_limiter.call_sync(lambda: self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        ), idempotent=False)
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return rate_limiter.call_sync(lambda: self.client.batches.retrieve(batch_id)).status
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        batch = rate_limiter.call_sync(lambda: self.client.batches.retrieve(batch_id))
+        if not batch.output_file_id:
+            return
+        content = rate_limiter.call_sync(lambda: self.client.files.content(batch.output_file_id))
+        for line in content.text.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def extractive_responder(body: Dict[str, Any]) -> str:
+    """
+    Responder mặc định của LocalBatchBackend: tạo câu hỏi điền khuyết từ chính các câu
+    trong tài liệu (không cần mạng), đủ để chạy thử toàn bộ pipeline.
+    """
+    content = body["messages"][-1]["content"]
+    match = re.search(r"={80}\n(.*?)\n={80}", content, re.S)
+    text = match.group(1) if match else content
+    count_match = re.search(r"CHỈ tạo đúng (\d+) câu", content)
+    count = int(count_match.group(1)) if count_match else 5
+
+    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', text) if len(s.split()) >= 6]
+    questions = []
+    for sentence in sentences[:count]:
+        words = sentence.rstrip(".!?").split()
+        target = max(words, key=len)
+        distractors = [w for w in words if w != target][:3]
+        while len(distractors) < 3:
+            distractors.append(f"{target}{len(distractors)}")
+        questions.append({
+            "question": f"Điền vào chỗ trống: {sentence.replace(target, '____', 1)}",
+            "type": "mcq",
+            "choices": [f"A. {target}", f"B. {distractors[0]}", f"C. {distractors[1]}", f"D. {distractors[2]}"],
+            "answer": f"A. {target}"
+        })
+    return json.dumps(questions, ensure_ascii=False)
+
+
+class LocalBatchBackend:
+    """
+    Batch endpoint giả lập trên đĩa, cùng định dạng input/output với OpenAI Batch API.
+    Dùng để chạy/kiểm thử pipeline bulk mà không cần mạng.
+    """
+
+    def __init__(self, work_dir: str, responder: Optional[Callable[[Dict[str, Any]], str]] = None):
+        self.work_dir = work_dir
+        self.responder = responder or extractive_responder
+        os.makedirs(work_dir, exist_ok=True)
+
+    def _path(self, batch_id: str, kind: str) -> str:
+        return os.path.join(self.work_dir, f"{batch_id}.{kind}.jsonl")
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        shutil.copyfile(input_path, self._path(batch_id, "input"))
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        output_path = self._path(batch_id, "output")
+        if not os.path.exists(output_path):
+            self._process(batch_id)
+        return "completed"
+
+    def _process(self, batch_id: str) -> None:
+        tmp_path = self._path(batch_id, "output") + ".tmp"
+        with open(self._path(batch_id, "input"), encoding="utf-8") as src, \
+                open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                try:
+                    content = self.responder(request["body"])
+                    result = {
+                        "id": f"req_{uuid.uuid4().hex[:12]}",
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+                        },
+                        "error": None
+                    }
+                except Exception as e:
+                    result = {
+                        "id": f"req_{uuid.uuid4().hex[:12]}",
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"code": "local_error", "message": str(e)}
+                    }
+                dst.write(json.dumps(result, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._path(batch_id, "output"))
+
+    def results(self, batch_id: str) -> Iterator[Dict[str, Any]]:
+        with open(self._path(batch_id, "output"), encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def wait_for_batch(backend, batch_id: str, poll_interval: float) -> str:
+    while True:
+        status = backend.status(batch_id)
+        if status in BATCH_FINAL_STATUSES:
+            return status
+        logger.info(f"⏳ Batch {batch_id}: {status}")
+        time.sleep(poll_interval)
+
+
+def collect_results(results: Iterator[Dict[str, Any]], manifest: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """Parse output Batch API → câu hỏi theo từng tài liệu (chưa lọc hallucination)"""
+    by_doc: Dict[str, Dict[int, List[Dict[str, Any]]]] = {}
+    for result in results:
+        doc_id, _, chunk_idx = result["custom_id"].partition(":")
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            logger.warning(f"⚠️ Request {result['custom_id']} lỗi: {result.get('error')}")
+            continue
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            questions = parse_ai_response(content)
+        except Exception as e:
+            logger.warning(f"⚠️ Không parse được kết quả {result['custom_id']}: {str(e)}")
+            continue
+        by_doc.setdefault(doc_id, {})[int(chunk_idx)] = questions
+
+    collected = {}
+    for doc_id, chunks in by_doc.items():
+        if doc_id not in manifest["documents"]:
+            continue
+        collected[doc_id] = [q for idx in sorted(chunks) for q in chunks[idx]]
+    return collected
+
+
+def run_bulk(
+    pdf_dir: str,
+    prompt: str,
+    out_dir: str,
+    backend,
+    poll_interval: Optional[float] = None
+) -> Dict[str, int]:
+    """
+    Pipeline bulk: PDF → JSONL → Batch API → parse + lọc hallucination →
+    `<out_dir>/<tên file>.questions.json`. Trả về {tên file: số câu hỏi}.
+    """
+    poll_interval = settings.batch_poll_interval if poll_interval is None else poll_interval
+    work_dir = os.path.join(out_dir, "_batch")
+    requests, manifest = build_batch_requests(pdf_dir, prompt)
+    if not requests:
+        logger.warning("Không có request nào để gửi")
+        return {}
+
+    os.makedirs(work_dir, exist_ok=True)
+    with open(os.path.join(work_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    collected: Dict[str, List[Dict[str, Any]]] = {}
+    for input_path in write_batch_files(requests, work_dir):
+        batch_id = backend.submit(input_path)
+        logger.info(f"📤 Đã gửi {input_path} → batch {batch_id}")
+        status = wait_for_batch(backend, batch_id, poll_interval)
+        if status != "completed":
+            logger.error(f"❌ Batch {batch_id} kết thúc với trạng thái {status}")
+            continue
+        for doc_id, questions in collect_results(backend.results(batch_id), manifest).items():
+            collected.setdefault(doc_id, []).extend(questions)
+
+    summary = {}
+    for doc_id, questions in collected.items():
+        doc = manifest["documents"][doc_id]
+        questions = dedupe_questions(QuestionValidator(doc["text"]).filter(questions))
+        out_path = os.path.join(out_dir, os.path.splitext(doc["filename"])[0] + ".questions.json")
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump({"source": doc["filename"], "prompt": prompt, "questions": questions}, f, ensure_ascii=False, indent=2)
+        summary[doc["filename"]] = len(questions)
+        logger.info(f"✅ {doc['filename']}: {len(questions)} câu hỏi → {out_path}")
+    return summary
@@ -0,0 +1,46 @@
+import logging
+import os
+import uuid
+from typing import Tuple
+from fastapi import UploadFile
+from config.settings import settings
+from services.pdf_utils import save_upload
+
+logger = logging.getLogger(__name__)
+
+
+def blob_path(content_hash: str) -> str:
+    """uploads/blobs/ab/cd/abcd....pdf - chia thư mục theo 2 cấp để mỗi thư mục không quá nhiều file"""
+    return os.path.join(settings.upload_dir, "blobs", content_hash[:2], content_hash[2:4], f"{content_hash}.pdf")
+
+
+def commit_blob(tmp_path: str, content_hash: str) -> str:
+    """
+    Đưa file tạm vào blob store (bỏ file tạm nếu blob đã có). Gọi trong lúc giữ khóa
+    FileBlob (create_file_record) để không xen giữa lúc blob cũ vừa hết tham chiếu và bị xóa
+    """
+    path = blob_path(content_hash)
+    if os.path.exists(path):
+        # Đã có cùng nội dung: bỏ bản vừa ghi
+        os.remove(tmp_path)
+        logger.info(f"♻️ Blob {content_hash[:12]} đã tồn tại, không lưu thêm bản sao")
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return path
+
+
+async def receive_upload(file: UploadFile) -> Tuple[str, int, str]:
+    """Ghi upload ra file tạm, tính SHA-256. Trả về (file tạm, số byte, SHA-256); đưa vào store bằng commit_blob"""
+    tmp_dir = os.path.join(settings.upload_dir, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{uuid.uuid4()}.part")
+    size, content_hash = await save_upload(file, tmp_path)
+    return tmp_path, size, content_hash
+
+
+def remove_blob_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from config.settings import settings
+from crud.file_crud import get_extracted_text, save_extracted_text, get_passage_index, save_passage_index
+from services.evidence import PassageIndex, EVIDENCE_INDEX_VERSION
+from services.pdf_utils import (
+    ChunkPacker, iter_extracted_pages, parse_page_spec, section_page_ranges, merge_page_ranges
+)
+from services.pdf_worker import engine_candidates, count_pages, read_outline
+
+logger = logging.getLogger(__name__)
+
+# Tăng khi đổi cách làm sạch/ghép trang để text đã lưu bị trích xuất lại
+TEXT_FORMAT_VERSION = 1
+
+PAGE_SEPARATOR = "\n\n"
+
+
+def extraction_version() -> str:
+    """Phiên bản text đã trích xuất: định dạng + các engine PDF_ENGINE sẽ dùng"""
+    engines = "+".join(engine.name for engine in engine_candidates(settings.pdf_engine))
+    return f"v{TEXT_FORMAT_VERSION}:{engines}"
+
+
+def passage_index_version() -> str:
+    """Phiên bản chỉ mục đoạn: phiên bản text + cách cắt đoạn"""
+    return f"{extraction_version()}|p{EVIDENCE_INDEX_VERSION}:{settings.evidence_passage_words}"
+
+
+def hash_file(path: str, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DocumentText:
+    """Text đã làm sạch của cả tài liệu + vị trí từng trang trong đó"""
+
+    def __init__(self, text: str, page_offsets: List[Tuple[int, int, int]]):
+        self.text = text
+        self.page_offsets = page_offsets  # [(số trang, start, end)]
+
+    @classmethod
+    def from_pages(cls, pages: List[Tuple[int, str]]) -> "DocumentText":
+        """Ghép trang giống join_pages, ghi lại vị trí từng trang"""
+        parts, offsets, position = [], [], 0
+        for page_no, page_text in pages:
+            if parts:
+                parts.append(PAGE_SEPARATOR)
+                position += len(PAGE_SEPARATOR)
+            parts.append(page_text)
+            offsets.append((page_no, position, position + len(page_text)))
+            position += len(page_text)
+        return cls("".join(parts), offsets)
+
+    def select(self, selection: List[Tuple[int, int]]) -> "DocumentText":
+        """Chỉ giữ các trang trong `selection` ([start, end) từ 0)"""
+        return DocumentText.from_pages([
+            (page_no, self.text[start:end])
+            for page_no, start, end in self.page_offsets
+            if any(sel_start < page_no <= sel_end for sel_start, sel_end in selection)
+        ])
+
+    @property
+    def pages(self) -> List[str]:
+        return [self.text[start:end] for _, start, end in self.page_offsets]
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_offsets)
+
+
+async def load_outline(file_path: str) -> List[Tuple[int, str, int]]:
+    """Mục lục (bookmark) của PDF: [(cấp, tiêu đề, số trang)]"""
+    return await asyncio.to_thread(read_outline, file_path, settings.pdf_engine)
+
+
+async def resolve_page_selection(
+    file_path: str, pages: Optional[str] = None, section: Optional[str] = None
+) -> Optional[List[Tuple[int, int]]]:
+    """
+    Gộp khoảng trang ("40-55, 60") và các mục trong mục lục ("Chương 3"; nhiều
+    mục cách nhau bởi ';') thành các đoạn [start, end). Không chọn gì → None (cả tài liệu).
+    """
+    selection = parse_page_spec(pages) if pages else []
+    if section and section.strip():
+        outline = await load_outline(file_path)
+        if not outline:
+            raise HTTPException(status_code=400, detail="PDF không có mục lục (bookmark) để chọn theo mục")
+        page_count = await asyncio.to_thread(count_pages, file_path, settings.pdf_engine)
+        for query in section.split(";"):
+            if query.strip():
+                selection.extend(section_page_ranges(outline, query, page_count))
+    return merge_page_ranges(selection) or None
+
+
+# Chỉ mục đoạn của các tài liệu dùng gần đây: lần tạo câu hỏi sau không đọc lại từ DB
+_PASSAGE_CACHE_SIZE = 8
+_passage_cache: "OrderedDict[Tuple[str, str], PassageIndex]" = OrderedDict()
+
+
+def _remember_passage_index(key: Tuple[str, str], index: PassageIndex) -> None:
+    _passage_cache[key] = index
+    _passage_cache.move_to_end(key)
+    while len(_passage_cache) > _PASSAGE_CACHE_SIZE:
+        _passage_cache.popitem(last=False)
+
+
+def cached_passage_index(db: Session, content_hash: Optional[str]) -> Optional[PassageIndex]:
+    """Chỉ mục đoạn đã dựng của cả tài liệu (trong process hoặc DB, đúng phiên bản), không dựng mới"""
+    if not content_hash:
+        return None
+    key = (content_hash, passage_index_version())
+    if key in _passage_cache:
+        _passage_cache.move_to_end(key)
+        return _passage_cache[key]
+
+    record = get_passage_index(db, content_hash)
+    if record is None or record.version != key[1]:
+        return None
+    text_record = get_extracted_text(db, content_hash)
+    if text_record is None or text_record.version != extraction_version():
+        return None
+    index = PassageIndex.from_json(text_record.text, record.passages, record.term_freqs)
+    _remember_passage_index(key, index)
+    return index
+
+
+async def load_passage_index(
+    db: Session, content_hash: Optional[str], document: DocumentText, whole_document: bool = True
+) -> PassageIndex:
+    """
+    Chỉ mục đoạn của `document`. Cả tài liệu: dùng lại chỉ mục đã lưu theo
+    content hash, chưa có thì dựng và lưu. Chỉ một số trang: dựng tạm, không lưu.
+    """
+    if whole_document:
+        index = cached_passage_index(db, content_hash)
+        if index is not None:
+            return index
+    index = await asyncio.to_thread(PassageIndex.build, document.text, document.page_offsets)
+    if whole_document and content_hash:
+        version = passage_index_version()
+        save_passage_index(db, content_hash, version, *index.to_json())
+        _remember_passage_index((content_hash, version), index)
+        logger.info(f"🔎 Đã dựng chỉ mục {len(index)} đoạn cho {content_hash[:12]}")
+    return index
+
+
+class DocumentStream:
+    """
+    Đọc tài liệu dần theo trang. Text đã lưu (bảng extracted_texts, khóa theo
+    SHA-256 nội dung, đúng phiên bản engine) thì đọc lại từ đó; chưa có thì
+    trích xuất và lưu lại khi xong cả tài liệu. `selection` ([start, end) từ 0):
+    chỉ các trang đó - cắt từ text đã lưu nếu có, nếu không thì chỉ trích xuất
+    các trang đó (không lưu bản một phần).
+    `text` / `page_count` là của các trang đã đọc tới thời điểm hiện tại.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        file_path: str,
+        content_hash: Optional[str] = None,
+        selection: Optional[List[Tuple[int, int]]] = None
+    ):
+        self.db = db
+        self.file_path = file_path
+        self.content_hash = content_hash
+        self.selection = selection
+        self._pages: List[Tuple[int, str]] = []
+        self._document: Optional[DocumentText] = None
+
+    @property
+    def document(self) -> DocumentText:
+        if self._document is None or self._document.page_count != len(self._pages):
+            self._document = DocumentText.from_pages(self._pages)
+        return self._document
+
+    @property
+    def text(self) -> str:
+        return self.document.text
+
+    @property
+    def page_count(self) -> int:
+        return len(self._pages)
+
+    def _load_cached(self, version: str) -> Optional[DocumentText]:
+        cached = get_extracted_text(self.db, self.content_hash)
+        if cached is None or cached.version != version:
+            return None
+        logger.info(f"♻️ Dùng text đã trích xuất của {self.content_hash[:12]} ({cached.page_count} trang)")
+        document = DocumentText(cached.text, [tuple(o) for o in json.loads(cached.page_offsets)])
+        return document.select(self.selection) if self.selection else document
+
+    async def pages(self) -> AsyncIterator[Tuple[float, int, str]]:
+        """Yield (tiến độ 0..1, số trang, text) theo thứ tự trang, ngay khi trang được đọc xong"""
+        self.content_hash = self.content_hash or await asyncio.to_thread(hash_file, self.file_path)
+        version = extraction_version()
+
+        cached = self._load_cached(version)
+        if cached is not None:
+            for i, (page_no, start, end) in enumerate(cached.page_offsets):
+                self._pages.append((page_no, cached.text[start:end]))
+                yield (i + 1) / cached.page_count, page_no, self._pages[-1][1]
+        else:
+            try:
+                async for progress, page_no, text in iter_extracted_pages(self.file_path, self.selection):
+                    self._pages.append((page_no, text))
+                    yield progress, page_no, text
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.error(f"Lỗi khi đọc PDF: {str(e)}")
+                raise HTTPException(status_code=500, detail=f"Lỗi xử lý PDF: {str(e)}")
+
+        if not self._pages:
+            raise HTTPException(
+                status_code=400,
+                detail="Các trang đã chọn không có văn bản" if self.selection else
+                "Không thể trích xuất văn bản từ PDF. File có thể là ảnh scan hoặc bị mã hóa."
+            )
+
+        if cached is None:
+            document = self.document
+            if not self.selection:
+                save_extracted_text(
+                    self.db, self.content_hash, version, document.text,
+                    json.dumps(document.page_offsets), document.page_count
+                )
+                # Dựng chỉ mục đoạn ngay khi trích xuất: các lần tạo câu hỏi sau dùng lại
+                await load_passage_index(self.db, self.content_hash, document)
+            logger.info(f"✅ Đã trích xuất {document.page_count} trang, tổng {len(document.text)} ký tự")
+
+    def cached_passage_index(self) -> Optional[PassageIndex]:
+        """Chỉ mục đoạn đã có sẵn (file đã trích xuất trước đó) - dùng được trước khi đọc xong tài liệu"""
+        return None if self.selection else cached_passage_index(self.db, self.content_hash)
+
+    async def passage_index(self) -> PassageIndex:
+        """Chỉ mục đoạn của các trang đã đọc (gọi sau khi đọc xong tài liệu)"""
+        return await load_passage_index(self.db, self.content_hash, self.document, whole_document=not self.selection)
+
+    async def chunks(self, min_chars: int = 0) -> AsyncIterator[Tuple[str, float, Tuple[int, int]]]:
+        """
+        Yield (chunk, tiến độ 0..1, (trang đầu, trang cuối)) ngay khi đủ text cho
+        một chunk - các chunk đầu có thể được gửi đi tạo câu hỏi trong lúc các
+        trang sau vẫn đang trích xuất. Cùng các chunk như chunk_text(text của cả
+        tài liệu). Cả tài liệu ít hơn `min_chars` ký tự → HTTP 400 (tài liệu
+        ngắn chỉ ra chunk ở bước cuối).
+        """
+        packer = ChunkPacker()
+        async for progress, page_no, text in self.pages():
+            new_chunks = packer.add(text, page_no)
+            first = len(packer.spans) - len(new_chunks)
+            for i, chunk in enumerate(new_chunks):
+                yield chunk, progress, packer.spans[first + i]
+        if len(self.text.strip()) < min_chars:
+            raise HTTPException(
+                status_code=400,
+                detail="Văn bản quá ngắn hoặc không đủ nội dung để tạo câu hỏi"
+            )
+        for chunk in packer.finish():
+            yield chunk, 1.0, packer.spans[-1]
+
+
+async def load_document_text(
+    db: Session,
+    file_path: str,
+    content_hash: Optional[str] = None,
+    selection: Optional[List[Tuple[int, int]]] = None
+) -> DocumentText:
+    """Text của cả PDF đã lưu (hoặc các trang trong `selection`), xem DocumentStream"""
+    stream = DocumentStream(db, file_path, content_hash, selection)
+    async for _ in stream.pages():
+        pass
+    return stream.document
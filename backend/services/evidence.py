@@ -0,0 +1,102 @@
+import json
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from config.settings import settings
+from services.lexical import BM25Index, tokenize
+
+# Tăng khi đổi cách cắt đoạn / tokenize để chỉ mục đã lưu được dựng lại
+EVIDENCE_INDEX_VERSION = 1
+
+_WORD_SPAN_RE = re.compile(r'\S+')
+_CHOICE_PREFIX_RE = re.compile(r'^\s*[A-Da-d][.):]\s*')
+# Từ để hỏi (đã bỏ dấu như tokenize): không có trong tài liệu nhưng không phải dấu hiệu bịa
+_QUESTION_WORDS = frozenset({
+    'nao', 'gi', 'dau', 'bao', 'nhieu', 'sau', 'day', 'dung', 'sai', 'khong', 'phai',
+    'nhat', 'cau', 'hoi', 'which', 'what', 'who', 'when', 'where', 'why', 'how',
+    'following', 'true', 'false', 'correct', 'not'
+})
+
+
+def split_passages(
+    text: str, page_offsets: Sequence[Tuple[int, int, int]], words_per_passage: int
+) -> List[Tuple[int, int, int]]:
+    """Cắt từng trang thành các đoạn ~`words_per_passage` từ: [(số trang, start, end)] trong text"""
+    passages = []
+    for page_no, page_start, page_end in page_offsets:
+        spans = [m.span() for m in _WORD_SPAN_RE.finditer(text, page_start, page_end)]
+        for i in range(0, len(spans), words_per_passage):
+            window = spans[i:i + words_per_passage]
+            passages.append((page_no, window[0][0], window[-1][1]))
+    return passages
+
+
+def _query_terms(q: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """(term của câu hỏi trừ từ để hỏi, term của đáp án)"""
+    question_terms = [
+        t for t in tokenize(str(q.get("question", "")))
+        if not all(part in _QUESTION_WORDS for part in t.split("_"))
+    ]
+    answer_terms = tokenize(_CHOICE_PREFIX_RE.sub("", str(q.get("answer", ""))))
+    return question_terms, answer_terms
+
+
+class PassageIndex:
+    """
+    Chỉ mục BM25 trên các đoạn (~EVIDENCE_PASSAGE_WORDS từ, không vượt qua ranh
+    giới trang) của một tài liệu: tìm đoạn làm bằng chứng cho câu hỏi và chấm
+    mức bám nguồn. Dựng một lần cho mỗi nội dung file, lưu kèm text đã trích xuất.
+    """
+
+    def __init__(self, text: str, passages: List[Tuple[int, int, int]], term_freqs: Sequence[Dict[str, int]]):
+        self.text = text
+        self.passages = passages
+        self.bm25 = BM25Index(term_freqs)
+        self.bm25.postings  # dựng chỉ mục ngược cùng lúc, không để câu hỏi đầu tiên chịu
+
+    @classmethod
+    def build(
+        cls, text: str, page_offsets: Sequence[Tuple[int, int, int]], words_per_passage: Optional[int] = None
+    ) -> "PassageIndex":
+        passages = split_passages(text, page_offsets, words_per_passage or settings.evidence_passage_words)
+        return cls(text, passages, [Counter(tokenize(text[start:end])) for _, start, end in passages])
+
+    @classmethod
+    def from_json(cls, text: str, passages_json: str, term_freqs_json: str) -> "PassageIndex":
+        return cls(text, [tuple(p) for p in json.loads(passages_json)], json.loads(term_freqs_json))
+
+    def to_json(self) -> Tuple[str, str]:
+        """(passages, term_freqs) dạng JSON để lưu"""
+        return (
+            json.dumps(self.passages),
+            json.dumps([dict(tf) for tf in self.bm25.term_freqs], ensure_ascii=False)
+        )
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def evidence(self, q: Dict[str, Any], k: int = 3, snippet_chars: int = 300) -> Tuple[float, List[Dict[str, Any]]]:
+        """
+        (mức bám nguồn 0..1, k đoạn bằng chứng [{page, score, text}]) của câu hỏi.
+        Mức bám nguồn = điểm BM25 của đoạn tốt nhất / điểm của một đoạn "lý tưởng"
+        chứa mỗi term một lần; term của đáp án không có trong tài liệu tính đủ vào
+        mẫu số (đáp án bịa → điểm thấp), term của câu hỏi không có thì bỏ qua.
+        """
+        question_terms, answer_terms = _query_terms(q)
+        terms = set(question_terms) | set(answer_terms)
+        idf = self.bm25.idf
+        ideal = sum(idf[t] for t in terms if t in idf)
+        ideal += sum(self.bm25.unseen_idf for t in set(answer_terms) if t not in idf)
+        if not terms or ideal <= 0:
+            return 0.0, []
+
+        top = self.bm25.top(terms, k)
+        evidence = []
+        for i, score in top:
+            page_no, start, end = self.passages[i]
+            snippet = self.text[start:end]
+            if len(snippet) > snippet_chars:
+                snippet = snippet[:snippet_chars].rsplit(" ", 1)[0] + "…"
+            evidence.append({"page": page_no, "score": round(score, 3), "text": snippet})
+        grounding = min(1.0, top[0][1] / ideal) if top else 0.0
+        return grounding, evidence
@@ -0,0 +1,318 @@
+import asyncio
+import logging
+from typing import List, Dict, Any, AsyncIterator, Callable, Optional, Sequence, Tuple
+from fastapi import HTTPException
+from config.settings import settings
+from services.ai_utils import generate_questions_from_text, ensure_content_relevance
+from services.llm_client import as_completed_bounded
+from services.question_planner import (
+    parse_requested_total,
+    prompt_terms,
+    chunk_relevance,
+    provisional_match,
+    select_top_chunks,
+    needs_llm_relevance_check,
+    chunk_weights,
+    allocate_question_budget,
+    allocate_top_up
+)
+
+logger = logging.getLogger(__name__)
+
+# (câu hỏi của chunk, text của chunk) → các câu được giữ lại (kiểm tra + loại trùng)
+QuestionFilter = Callable[[List[Dict[str, Any]], str], List[Dict[str, Any]]]
+
+
+async def _run_round(
+    chunks: List[str], prompt: str, plan: Dict[int, int], use_cache: bool
+) -> AsyncIterator[tuple]:
+    """
+    Gọi LLM song song cho các chunk trong `plan` ({chunk_index: quota}),
+    yield (chunk_index, questions) theo thứ tự chunk hoàn thành.
+    """
+    tasks = {
+        idx: generate_questions_from_text(chunks[idx], prompt, idx, num_questions=quota, use_cache=use_cache)
+        for idx, quota in plan.items()
+    }
+    async for idx, result in as_completed_bounded(tasks, settings.llm_request_fanout):
+        if isinstance(result, Exception):
+            if isinstance(result, HTTPException) and result.status_code in [401, 429]:
+                raise result
+            logger.warning(f"⚠️ Chunk {idx} lỗi: {result}")
+            yield idx, []
+            continue
+        # LLM đôi khi trả nhiều hơn quota → cắt bớt
+        yield idx, result[:plan[idx]] if isinstance(result, list) else []
+
+
+def tag_source(
+    questions: List[Dict[str, Any]], chunk_index: int, span: Optional[Sequence[Optional[int]]] = None
+) -> List[Dict[str, Any]]:
+    """Gắn nguồn cho câu hỏi: chunk sinh ra nó và khoảng trang của chunk đó"""
+    page_start, page_end = span if span else (None, None)
+    for q in questions:
+        q["chunk_id"] = chunk_index
+        q["page_start"] = page_start
+        q["page_end"] = page_end
+    return questions
+
+
+async def iter_generation(
+    chunks: List[str],
+    prompt: str,
+    use_cache: bool = True,
+    completed: Optional[Dict[int, List[Dict[str, Any]]]] = None,
+    spans: Optional[List[Tuple[int, int]]] = None,
+    accept: Optional[QuestionFilter] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Planner + fan-out: xếp hạng chunk theo BM25 với prompt, chia tổng số câu yêu
+    cầu cho các chunk đứng đầu, chỉ gọi LLM cho chunk có quota > 0, rồi bù phần
+    thiếu từ các chunk dự phòng (theo thứ hạng).
+    Yield một event cho mỗi chunk vừa xong:
+    {"chunk": idx, "questions": [...], "text": chunk, "chunks_done": n, "chunks_total": m}
+    - câu hỏi đã gắn chunk_id và page_start/page_end (từ `spans`, nếu có) để
+    kiểm tra hallucination theo đúng chunk nguồn.
+    `use_cache=False` bỏ qua cache LLM cho toàn bộ request.
+    `completed` = {chunk_index: questions} của các chunk đã xong từ lần chạy
+    trước (job chạy lại sau restart) - không gọi lại LLM và không yield lại.
+    `accept`: lọc câu hỏi của mỗi chunk trước khi đếm vào tổng (event chỉ chứa câu
+    được giữ) - số câu của `completed` (đã lọc) và của lần chạy này được đếm như nhau.
+    """
+    if not chunks:
+        return
+
+    completed = completed or {}
+    total = parse_requested_total(prompt)
+
+    # Chấm điểm lexical tại chỗ; LLM chỉ làm trọng tài khi lexical không kết luận được
+    relevance = chunk_relevance(chunks, prompt)
+    if not completed and needs_llm_relevance_check(relevance):
+        best = max(range(len(chunks)), key=lambda i: relevance[i])
+        await ensure_content_relevance(chunks[best], prompt, use_cache=use_cache)
+
+    # Top-up lấy chunk dự phòng theo điểm đầy đủ, lượt đầu chỉ dùng các chunk đứng đầu
+    weights = chunk_weights(chunks, relevance)
+    quotas = allocate_question_budget(chunks, total, select_top_chunks(relevance, total))
+
+    plan = {idx: q for idx, q in enumerate(quotas) if q > 0}
+    async for event in _generate_rounds(chunks, spans, prompt, use_cache, total, weights, plan, completed, accept):
+        yield event
+
+
+async def _generate_rounds(
+    chunks: List[str],
+    spans: Optional[List[Tuple[int, int]]],
+    prompt: str,
+    use_cache: bool,
+    total: int,
+    weights: List[float],
+    plan: Dict[int, int],
+    completed: Dict[int, List[Dict[str, Any]]],
+    accept: Optional[QuestionFilter] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Chạy lượt đầu theo `plan`, rồi bù phần thiếu từ các chunk chưa dùng (PLANNER_TOP_UP_ROUNDS lượt)"""
+    used = set(plan) | set(completed)
+    produced = sum(len(qs) for qs in completed.values())
+    chunks_done = len(completed)
+
+    for round_no in range(settings.planner_top_up_rounds + 1):
+        if round_no > 0:
+            deficit = total - produced
+            spare = [idx for idx in range(len(chunks)) if idx not in used]
+            if deficit <= 0 or not spare:
+                break
+            plan = allocate_top_up(deficit, spare, weights, settings.llm_request_fanout)
+            used.update(plan)
+            logger.info(f"➕ Bù {deficit} câu còn thiếu (lượt {round_no}) từ chunks {sorted(plan)}")
+
+        plan = {idx: q for idx, q in plan.items() if idx not in completed}
+        async for idx, questions in _run_round(chunks, prompt, plan, use_cache):
+            questions = tag_source(questions, idx, spans[idx] if spans else None)
+            if accept:
+                questions = accept(questions, chunks[idx])
+            questions = questions[:max(total - produced, 0)]
+            produced += len(questions)
+            chunks_done += 1
+            yield {
+                "chunk": idx,
+                "questions": questions,
+                "text": chunks[idx],
+                "chunks_done": chunks_done,
+                "chunks_total": len(used)
+            }
+
+
+def can_plan_progressively(prompt: str) -> bool:
+    """
+    Có thể chia quota cho chunk ngay khi chunk đến (trước khi đọc xong tài liệu)
+    không: được, trừ khi bắt buộc LLM kiểm tra độ liên quan trước khi tạo câu hỏi.
+    """
+    return settings.llm_relevance_check != "always"
+
+
+async def iter_generation_stream(
+    chunk_source: AsyncIterator[Tuple[str, float, Tuple[int, int]]],
+    prompt: str,
+    use_cache: bool = True
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Như iter_generation nhưng nhận chunk dần từ `chunk_source` ((chunk, tiến độ
+    0..1, khoảng trang), vd. DocumentStream.chunks()): LLM bắt đầu chạy trên chunk đầu trong
+    lúc các trang sau vẫn đang được trích xuất.
+    - Prompt không có từ nội dung: quota chia theo tiến độ trong tài liệu (chunk
+    nhận phần tổng số câu ứng với đoạn tài liệu nó kết thúc).
+    - Prompt theo chủ đề: BM25 cần cả tài liệu, nên chunk chứa mọi từ nội dung
+    của prompt (provisional_match) được gọi LLM ngay với tối đa QUESTIONS_PER_CHUNK
+    câu; đọc xong tài liệu thì phần còn lại chia cho các chunk chưa dùng theo
+    BM25 đầy đủ như iter_generation. Chunk khớp đến trước được ưu tiên hơn chunk
+    khớp tốt hơn ở cuối tài liệu. Không chunk nào khớp tạm → chạy iter_generation
+    (kể cả LLM làm trọng tài).
+    Ngoài các event của iter_generation, yield {"stage": "chunked", "chunks": n}
+    khi đã có đủ chunk.
+    """
+    chunks: List[str] = []
+    spans: List[Tuple[int, int]] = []
+
+    if not can_plan_progressively(prompt):
+        async for chunk, _, span in chunk_source:
+            chunks.append(chunk)
+            spans.append(span)
+        yield {"stage": "chunked", "chunks": len(chunks)}
+        async for event in iter_generation(chunks, prompt, use_cache=use_cache, spans=spans):
+            yield event
+        return
+
+    total = parse_requested_total(prompt)
+    terms = set(prompt_terms(prompt))
+    plan: Dict[int, int] = {}
+    results: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(1, settings.llm_request_fanout))
+    tasks = []
+
+    async def run(idx: int, quota: int) -> None:
+        async with semaphore:
+            try:
+                result = await generate_questions_from_text(chunks[idx], prompt, idx, num_questions=quota, use_cache=use_cache)
+            except Exception as e:
+                result = e
+        await results.put((idx, result))
+
+    async def produce() -> None:
+        assigned = 0
+        async for chunk, progress, span in chunk_source:
+            chunks.append(chunk)
+            spans.append(span)
+            idx = len(chunks) - 1
+            if terms:
+                matched = provisional_match(chunk, terms)
+                quota = min(max(1, settings.questions_per_chunk), total - assigned) if matched else 0
+            else:
+                # Làm tròn theo tổng tích lũy để tổng quota đúng bằng `total` khi tới cuối tài liệu
+                quota = round(total * progress) - assigned
+            if quota > 0:
+                plan[idx] = quota
+                assigned += quota
+                tasks.append(asyncio.create_task(run(idx, quota)))
+
+    producer = asyncio.create_task(produce())
+    completed: Dict[int, List[Dict[str, Any]]] = {}
+    produced = 0
+    chunked_sent = False
+    getter = None
+    try:
+        while True:
+            if producer.done():
+                producer.result()
+                if not chunked_sent:
+                    chunked_sent = True
+                    yield {"stage": "chunked", "chunks": len(chunks)}
+                if len(completed) == len(plan):
+                    break
+
+            getter = asyncio.ensure_future(results.get())
+            waiting = {getter} if producer.done() else {getter, producer}
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if getter not in done:
+                getter.cancel()
+                continue
+
+            idx, result = getter.result()
+            if isinstance(result, Exception):
+                if isinstance(result, HTTPException) and result.status_code in [401, 429]:
+                    raise result
+                logger.warning(f"⚠️ Chunk {idx} lỗi: {result}")
+                result = []
+            questions = (result[:plan[idx]] if isinstance(result, list) else [])[:max(total - produced, 0)]
+            completed[idx] = tag_source(questions, idx, spans[idx])
+            produced += len(questions)
+            yield {
+                "chunk": idx,
+                "questions": questions,
+                "text": chunks[idx],
+                "chunks_done": len(completed),
+                "chunks_total": len(plan)
+            }
+    finally:
+        producer.cancel()
+        if getter is not None:
+            getter.cancel()
+        for task in tasks:
+            task.cancel()
+
+    logger.info(f"📐 Phân bổ {total} câu theo tiến độ cho {len(plan)}/{len(chunks)} chunks: {plan}")
+    if not terms:
+        # Bù phần thiếu (chunk lỗi, LLM trả ít hơn quota) từ các chunk chưa dùng
+        async for event in _generate_rounds(chunks, spans, prompt, use_cache, total, chunk_weights(chunks), {}, completed):
+            yield event
+        return
+
+    if not plan:
+        async for event in iter_generation(chunks, prompt, use_cache=use_cache, spans=spans):
+            yield event
+        return
+
+    # Đã đủ tài liệu: phần chưa có chia cho các chunk chưa dùng theo BM25, rồi bù như thường
+    relevance = chunk_relevance(chunks, prompt)
+    remaining = total - produced
+    unused = [0.0 if idx in plan else r for idx, r in enumerate(relevance)]
+    final_plan: Dict[int, int] = {}
+    if remaining > 0 and max(unused) > 0:
+        quotas = allocate_question_budget(chunks, remaining, select_top_chunks(unused, remaining))
+        final_plan = {idx: q for idx, q in enumerate(quotas) if q > 0}
+    weights = chunk_weights(chunks, relevance)
+    async for event in _generate_rounds(chunks, spans, prompt, use_cache, total, weights, final_plan, completed):
+        yield event
+
+
+async def generate_for_stream(
+    chunk_source: AsyncIterator[Tuple[str, float, Tuple[int, int]]], prompt: str, use_cache: bool = True
+) -> Tuple[List[Dict[str, Any]], Dict[int, str]]:
+    """
+    Chạy toàn bộ iter_generation_stream, trả về (câu hỏi theo thứ tự chunk,
+    {chunk_id: text} của các chunk đã sinh câu hỏi - để kiểm tra theo chunk nguồn)
+    """
+    questions_by_chunk: Dict[int, List[Dict[str, Any]]] = {}
+    chunk_texts: Dict[int, str] = {}
+    async for event in iter_generation_stream(chunk_source, prompt, use_cache=use_cache):
+        if "stage" in event:
+            continue
+        questions_by_chunk.setdefault(event["chunk"], []).extend(event["questions"])
+        chunk_texts[event["chunk"]] = event["text"]
+
+    all_questions = []
+    for idx in sorted(questions_by_chunk):
+        all_questions.extend(questions_by_chunk[idx])
+    return all_questions, chunk_texts
+
+
+async def generate_for_chunks(chunks: List[str], prompt: str, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """Chạy toàn bộ iter_generation và trả về câu hỏi theo thứ tự chunk"""
+    questions_by_chunk: Dict[int, List[Dict[str, Any]]] = {}
+    async for event in iter_generation(chunks, prompt, use_cache=use_cache):
+        questions_by_chunk.setdefault(event["chunk"], []).extend(event["questions"])
+
+    all_questions = []
+    for idx in sorted(questions_by_chunk):
+        all_questions.extend(questions_by_chunk[idx])
+    return all_questions
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Dict, Optional
+from fastapi import HTTPException
+from config.settings import settings
+from config.database import SessionLocal
+from crud.file_crud import get_file_by_id
+from crud import job_crud, question_crud
+from models.job_model import (
+    JOB_QUEUED, JOB_RUNNING, JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED, JOB_FINISHED_STATUSES
+)
+from services.pdf_utils import chunk_pages
+from services.document_text import load_document_text, load_passage_index, resolve_page_selection
+from services.generation_pipeline import iter_generation
+from services.question_validator import QuestionValidator
+from services.question_dedup import QuestionDeduplicator
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelRequested(Exception):
+    """Job đã được yêu cầu hủy (trạng thái cancelling trong database)"""
+
+
+class JobManager:
+    """
+    Hàng đợi job tạo câu hỏi chạy nền trong process, trạng thái lưu trong database.
+    `workers` job chạy song song; job dở dang khi restart được chạy tiếp từ chunk còn thiếu.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._cancel_requested = set()
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        self._worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+        db = SessionLocal()
+        try:
+            unfinished = job_crud.get_unfinished_jobs(db)
+            for job in unfinished:
+                self._queue.put_nowait(job.id)
+            if unfinished:
+                logger.info(f"🔁 Chạy tiếp {len(unfinished)} job dở dang sau khi khởi động")
+        finally:
+            db.close()
+
+    async def stop(self) -> None:
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    def submit(self, job_id: str) -> None:
+        self._queue.put_nowait(job_id)
+        logger.info(f"📥 Đã xếp hàng job {job_id} (đang chờ: {self._queue.qsize()})")
+
+    def cancel(self, job_id: str) -> None:
+        """
+        Dừng ngay job đang chạy trong process này. Yêu cầu hủy nằm ở trạng thái job
+        trong database (endpoint đặt cancelling): job đang chờ hoặc chạy ở process
+        khác dừng khi thấy trạng thái đó
+        """
+        task = self._running.get(job_id)
+        if task:
+            self._cancel_requested.add(job_id)
+            task.cancel()
+
+    async def cancel_and_wait(self, job_id: str) -> None:
+        """Hủy job đang chạy và chờ nó dừng hẳn (vd. trước khi xóa file của job)"""
+        task = self._running.get(job_id)
+        if task:
+            self.cancel(job_id)
+            await asyncio.gather(task, return_exceptions=True)
+
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self, worker_no: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            task = asyncio.create_task(self._run_job(job_id))
+            self._running[job_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # Người dùng hủy job → worker chạy tiếp; server tắt → worker thoát
+                if job_id not in self._cancel_requested:
+                    raise
+            except Exception as e:
+                logger.error(f"Worker {worker_no}: job {job_id} lỗi không mong đợi: {str(e)}")
+            finally:
+                self._running.pop(job_id, None)
+                self._cancel_requested.discard(job_id)
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str) -> None:
+        db = SessionLocal()
+        try:
+            job = job_crud.get_job(db, job_id)
+            if not job or job.status in JOB_FINISHED_STATUSES:
+                return
+
+            try:
+                started_at = job.started_at or datetime.utcnow()
+                if not job_crud.set_job_status(db, job, [JOB_QUEUED, JOB_RUNNING], JOB_RUNNING, started_at=started_at):
+                    raise JobCancelRequested()
+
+                file_record = get_file_by_id(db, job.file_id)
+                if not file_record or not os.path.exists(file_record.file_path):
+                    raise HTTPException(status_code=404, detail="File không tồn tại trên hệ thống")
+
+                selection = await resolve_page_selection(file_record.file_path, job.page_spec, job.section)
+                document = await load_document_text(db, file_record.file_path, file_record.content_hash, selection)
+                text = document.text
+                if len(text.strip()) < 50:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Văn bản quá ngắn hoặc không đủ nội dung để tạo câu hỏi"
+                    )
+
+                chunks, spans = chunk_pages(
+                    (page_no, text[start:end]) for page_no, start, end in document.page_offsets
+                )
+                job_crud.update_job(db, job, pages=document.page_count)
+
+                completed = job_crud.get_completed_chunks(db, job)
+                if completed:
+                    logger.info(f"🔁 Job {job_id}: bỏ qua {len(completed)} chunk đã xong")
+
+                passages = await load_passage_index(
+                    db, file_record.content_hash, document, whole_document=selection is None
+                )
+                validator = QuestionValidator(passages=passages)
+                # Câu của các chunk đã xong (lần chạy trước) cũng tính khi loại câu trùng
+                dedup = QuestionDeduplicator()
+                for idx in sorted(completed):
+                    dedup.filter(completed[idx])
+                # Lọc ngay trong pipeline: số câu còn thiếu tính theo câu hợp lệ, như
+                # câu của các chunk đã xong được lưu lại
+                events = iter_generation(
+                    chunks, job.prompt, use_cache=job.use_cache, completed=completed, spans=spans,
+                    accept=lambda questions, text: dedup.filter(validator.filter(questions, text))
+                )
+                try:
+                    async for event in events:
+                        job_crud.add_job_chunk(
+                            db, job, event["chunk"], event["questions"],
+                            chunks_done=event["chunks_done"],
+                            chunks_total=event["chunks_total"]
+                        )
+                        if job_crud.is_cancel_requested(db, job):
+                            raise JobCancelRequested()
+                finally:
+                    await events.aclose()
+
+                questions = job_crud.get_job_questions(db, job)
+                if not questions:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Không tạo được câu hỏi nào. Vui lòng thử lại hoặc nhập prompt khác."
+                    )
+
+                # Lưu vào ngân hàng câu hỏi cùng commit với trạng thái completed: job chạy
+                # lại sau restart không lưu trùng; bị hủy trong lúc đó thì không lưu
+                question_crud.create_run(
+                    db, job.user_id, questions, file_id=job.file_id, prompt=job.prompt, job_id=job.id, commit=False
+                )
+                if not job_crud.set_job_status(
+                    db, job, [JOB_RUNNING], JOB_COMPLETED, commit=False, error=None, finished_at=datetime.utcnow()
+                ):
+                    db.rollback()
+                    raise JobCancelRequested()
+                db.commit()
+                logger.info(f"✅ Job {job_id} xong: {len(questions)} câu hỏi")
+
+            except JobCancelRequested:
+                job_crud.finish_job(db, job, JOB_CANCELLED)
+                logger.info(f"🛑 Đã hủy job {job_id}")
+            except asyncio.CancelledError:
+                # Bị ngắt do server tắt: giữ trạng thái running để chạy tiếp khi khởi động lại
+                if job_id in self._cancel_requested or job_crud.is_cancel_requested(db, job):
+                    job_crud.finish_job(db, job, JOB_CANCELLED)
+                    logger.info(f"🛑 Đã hủy job {job_id}")
+                raise
+            except HTTPException as e:
+                error = e.detail if isinstance(e.detail, str) else json.dumps(e.detail, ensure_ascii=False)
+                job_crud.finish_job(db, job, JOB_FAILED, error=error)
+            except Exception as e:
+                logger.error(f"Job {job_id} lỗi: {str(e)}")
+                job_crud.finish_job(db, job, JOB_FAILED, error=f"Lỗi xử lý: {str(e)}")
+        finally:
+            db.close()
+
+
+job_manager = JobManager(workers=settings.job_workers)
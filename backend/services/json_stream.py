@@ -0,0 +1,75 @@
+import json
+import logging
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalQuestionParser:
+    """
+    Parse từng object JSON ngay khi dấu `}` đóng của nó tới, không chờ hết response.
+    Dùng cho streaming completion: feed() từng đoạn text, nhận về các object đã
+    hoàn chỉnh. Response bị cắt ngang (chạm AI_MAX_TOKENS) vẫn giữ được mọi object
+    đã đóng - chỉ object dở dang cuối cùng bị bỏ.
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.objects = 0
+        self.errors = 0
+
+    @property
+    def pending(self) -> bool:
+        """Còn object đang dở (chưa có dấu đóng)"""
+        return self._depth > 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        completed = []
+        for ch in text:
+            if self._depth == 0:
+                # Ngoài object: bỏ qua '[', ',', khoảng trắng, ```json...
+                if ch == '{':
+                    self._buffer = [ch]
+                    self._depth = 1
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    obj = self._decode(''.join(self._buffer))
+                    self._buffer = []
+                    if obj is not None:
+                        completed.append(obj)
+        return completed
+
+    def _decode(self, raw: str):
+        try:
+            obj = json.loads(raw)
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            logger.warning(f"⚠️ Bỏ qua object JSON lỗi: {str(e)} | {raw[:100]}")
+            return None
+        if not isinstance(obj, dict):
+            return None
+        self.objects += 1
+        return obj
+
+
+def extract_complete_objects(content: str) -> List[Dict[str, Any]]:
+    """Lấy mọi object hoàn chỉnh từ một response (kể cả khi bị cắt ngang)"""
+    return IncrementalQuestionParser().feed(content)
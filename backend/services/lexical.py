@@ -0,0 +1,181 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+
+
+def strip_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "Lũy thừa" → "Luy thua", "đạo hàm" → "dao ham" """
+    text = text.replace('đ', 'd').replace('Đ', 'D')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(ch for ch in decomposed if unicodedata.category(ch) != 'Mn')
+
+
+def normalize(text: str) -> str:
+    """Chuẩn hóa để so khớp: NFC, chữ thường, bỏ dấu (người dùng hay gõ không dấu)"""
+    return strip_diacritics(unicodedata.normalize('NFC', text).lower())
+
+
+def words(text: str) -> List[str]:
+    """Các từ (âm tiết) đã chuẩn hóa của text"""
+    return _WORD_RE.findall(normalize(text))
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Token cho chấm điểm lexical. Tiếng Việt viết theo âm tiết ("lũy thừa", "đạo hàm")
+    nên ngoài từng âm tiết còn thêm bigram của hai âm tiết liền nhau ("luy_thua")
+    để từ ghép khớp chính xác hơn từng tiếng rời.
+    """
+    unigrams = words(text)
+    return unigrams + [f"{a}_{b}" for a, b in zip(unigrams, unigrams[1:])]
+
+
+def find_numbers(text: str) -> Set[str]:
+    """Các số (nguyên hoặc thập phân) xuất hiện trong text"""
+    return set(_NUMBER_RE.findall(text))
+
+
+class SourceIndex:
+    """
+    Chỉ mục một văn bản nguồn để kiểm tra câu hỏi có bám nguồn không: tập token
+    (đã chuẩn hóa như tokenize), tập bigram âm tiết và tập số liệu. Dựng một lần,
+    mỗi lần tra từ khóa là tra hash thay vì quét chuỗi cả tài liệu.
+    """
+
+    def __init__(self, text: str):
+        # Bỏ dấu theo từng từ khác nhau thay vì cả văn bản (sách dài lặp lại từ rất nhiều)
+        words = _WORD_RE.findall(unicodedata.normalize('NFC', text).lower())
+        folded = {w: strip_diacritics(w) for w in set(words)}
+        words = [folded[w] for w in words]
+        self.tokens: Set[str] = set(words)
+        self.bigrams: Set[str] = {f"{a}_{b}" for a, b in zip(words, words[1:])}
+        self.numbers: Set[str] = find_numbers(text)
+
+    def contains(self, keyword: str) -> bool:
+        """
+        Từ khóa có trong nguồn không: một từ → tra tập token; từ có dấu nối / ký
+        tự đặc biệt ("k-means", "CO2/H2O") → mọi cặp từ liền nhau phải có trong tập bigram
+        """
+        words = _WORD_RE.findall(normalize(keyword))
+        if not words:
+            return False
+        if len(words) == 1:
+            return words[0] in self.tokens
+        return all(f"{a}_{b}" in self.bigrams for a, b in zip(words, words[1:]))
+
+
+@lru_cache(maxsize=64)
+def source_index(text: str) -> SourceIndex:
+    """SourceIndex dùng chung: hai bộ kiểm tra chạy liền nhau trên cùng tài liệu/chunk chỉ dựng một lần"""
+    return SourceIndex(text)
+
+
+class BM25Index:
+    """Chỉ mục BM25 trong bộ nhớ trên một tập văn bản ngắn (các chunk của một tài liệu)"""
+
+    def __init__(self, documents: Sequence[Iterable[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_freqs: List[Counter] = [Counter(doc) for doc in documents]
+        self.doc_lengths = [sum(tf.values()) for tf in self.term_freqs]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+        doc_freqs: Counter = Counter()
+        for tf in self.term_freqs:
+            doc_freqs.update(tf.keys())
+        n = len(self.term_freqs)
+        # IDF kiểu Lucene (luôn dương)
+        self.idf: Dict[str, float] = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freqs.items()
+        }
+        # IDF của term không có trong văn bản nào (df = 0)
+        self.unseen_idf = math.log(1 + (n + 0.5) / 0.5)
+        self._postings: Optional[Dict[str, List[Tuple[int, float]]]] = None
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str], **kwargs) -> "BM25Index":
+        return cls([tokenize(t) for t in texts], **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.term_freqs)
+
+    def score(self, query_terms: Iterable[str]) -> List[float]:
+        """Điểm BM25 của mọi văn bản với truy vấn (đã tokenize)"""
+        terms = [t for t in set(query_terms) if t in self.idf]
+        scores = [0.0] * len(self.term_freqs)
+        if not terms or not self.avg_length:
+            return scores
+
+        for i, tf in enumerate(self.term_freqs):
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_length)
+            total = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    total += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+            scores[i] = total
+        return scores
+
+    def _norm(self, i: int) -> float:
+        return self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_length)
+
+    @property
+    def postings(self) -> Dict[str, List[Tuple[int, float]]]:
+        """
+        Chỉ mục ngược term → [(văn bản, điểm BM25 của term trong văn bản đó)], dựng
+        khi cần. Điểm tính sẵn nên top() chỉ còn cộng dồn.
+        """
+        if self._postings is None:
+            postings: Dict[str, List[Tuple[int, float]]] = {}
+            if self.avg_length:
+                for i, tf in enumerate(self.term_freqs):
+                    norm = self._norm(i)
+                    for term, freq in tf.items():
+                        impact = self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+                        postings.setdefault(term, []).append((i, impact))
+            self._postings = postings
+        return self._postings
+
+    def top(self, query_terms: Iterable[str], k: int = 3, common_ratio: float = 0.2) -> List[Tuple[int, float]]:
+        """
+        k văn bản điểm cao nhất [(chỉ số, điểm)] qua chỉ mục ngược, không chấm cả
+        tập như score(). Term có trong hơn `common_ratio` số văn bản (hư từ...) có
+        danh sách dài nhưng điểm nhỏ: chỉ dùng term hiếm (không có thì 3 term hiếm
+        nhất) để chọn ứng viên, rồi chấm lại chính xác các ứng viên với mọi term.
+        """
+        postings = self.postings
+        terms = {t for t in query_terms if t in postings}
+        if not terms:
+            return []
+        limit = max(k, len(self.term_freqs) * common_ratio)
+        rare = {t for t in terms if len(postings[t]) <= limit}
+        if not rare:
+            rare = set(sorted(terms, key=lambda t: len(postings[t]))[:3])
+
+        totals = [0.0] * len(self.term_freqs)
+        for term in rare:
+            for i, impact in postings[term]:
+                totals[i] += impact
+        candidates = heapq.nlargest(
+            max(4 * k, 10), ((i, score) for i, score in enumerate(totals) if score > 0), key=lambda item: item[1]
+        )
+
+        common = terms - rare
+        if common:
+            rescored = []
+            for i, score in candidates:
+                tf, norm = self.term_freqs[i], self._norm(i)
+                for term in common:
+                    freq = tf.get(term)
+                    if freq:
+                        score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+                rescored.append((i, score))
+            candidates = rescored
+        return heapq.nlargest(k, candidates, key=lambda item: item[1])
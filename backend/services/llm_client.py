@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Dict, Hashable, Iterable, List, Optional, Tuple
+from openai import AsyncOpenAI
+from config.settings import settings
+from services.rate_limiter import rate_limiter
+from services.token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Retry do rate_limiter đảm nhiệm (backoff chung cho mọi lời gọi)
+async_client = AsyncOpenAI(api_key=settings.openai_api_key, max_retries=0)
+
+# Giới hạn số lời gọi OpenAI chạy đồng thời trên toàn process
+_llm_semaphore = asyncio.Semaphore(settings.llm_max_concurrency)
+
+
+def estimate_request_tokens(messages: List[Dict[str, Any]], max_tokens: Optional[int] = None, model: Optional[str] = None) -> int:
+    """Số token một lời gọi có thể tiêu tốn (prompt + output tối đa) - dùng cho bucket TPM"""
+    prompt_tokens = sum(count_tokens(str(m.get("content", "")), model) + 4 for m in messages)
+    return prompt_tokens + (max_tokens or 0)
+
+
+async def chat_completion(**kwargs) -> Any:
+    """
+    Gọi Chat Completions bất đồng bộ, không chặn event loop.
+    Số lời gọi đồng thời bị giới hạn bởi LLM_MAX_CONCURRENCY; quota RPM/TPM,
+    xếp hàng và retry do rate_limiter xử lý.
+    """
+    estimated = estimate_request_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"), kwargs.get("model"))
+
+    async def _create():
+        async with _llm_semaphore:
+            return await async_client.chat.completions.with_raw_response.create(**kwargs)
+
+    raw = await rate_limiter.call(_create, estimated_tokens=estimated)
+    response = raw.parse()
+
+    usage = getattr(response, "usage", None)
+    rate_limiter.record_usage(estimated, getattr(usage, "total_tokens", None))
+    return response
+
+
+async def stream_chat_completion(**kwargs) -> AsyncIterator[str]:
+    """
+    Như chat_completion nhưng stream: yield từng đoạn text ngay khi model sinh ra.
+    Bên gọi dừng sớm (đã đủ câu hỏi) → stream bị đóng, model ngừng sinh token.
+    Giữ slot LLM_MAX_CONCURRENCY từ khi gửi request tới khi đóng stream.
+    """
+    estimated = estimate_request_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"), kwargs.get("model"))
+    kwargs = {**kwargs, "stream": True, "stream_options": {"include_usage": True}}
+
+    async def _create():
+        # Slot LLM_MAX_CONCURRENCY lấy sau khi đã qua hàng đợi RPM/TPM (như chat_completion)
+        # và giữ tới khi đóng stream; lần thử lỗi trả slot ngay, không giữ trong lúc backoff
+        await _llm_semaphore.acquire()
+        try:
+            return await async_client.chat.completions.with_raw_response.create(**kwargs)
+        except BaseException:
+            _llm_semaphore.release()
+            raise
+
+    raw = await rate_limiter.call(_create, estimated_tokens=estimated)
+    received = []
+    total_tokens = None
+    try:
+        stream = raw.parse()
+        try:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    total_tokens = usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    received.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.close()
+            if total_tokens is None:
+                # Đóng sớm nên không có usage → ước lượng theo phần đã nhận
+                prompt_tokens = estimated - (kwargs.get("max_tokens") or 0)
+                total_tokens = prompt_tokens + count_tokens("".join(received), kwargs.get("model"))
+            rate_limiter.record_usage(estimated, total_tokens)
+    finally:
+        _llm_semaphore.release()
+
+
+async def gather_bounded(
+    coros: Iterable[Awaitable[Any]],
+    limit: Optional[int] = None,
+    return_exceptions: bool = False
+) -> List[Any]:
+    """
+    Giống asyncio.gather nhưng chỉ chạy tối đa `limit` coroutine cùng lúc
+    (fan-out tối đa cho một request). Kết quả giữ đúng thứ tự đầu vào.
+    """
+    limit = limit or settings.llm_request_fanout
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(coro: Awaitable[Any]) -> Any:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(
+        *[_run(c) for c in coros],
+        return_exceptions=return_exceptions
+    )
+
+
+async def as_completed_bounded(
+    coros: Dict[Hashable, Awaitable[Any]],
+    limit: Optional[int] = None
+) -> AsyncIterator[Tuple[Hashable, Any]]:
+    """
+    Chạy các coroutine (tối đa `limit` cùng lúc) và yield (key, kết quả) theo
+    thứ tự hoàn thành. Exception được trả về như kết quả, không raise.
+    Nếu bên gọi dừng giữa chừng (client ngắt kết nối), các task còn lại bị hủy.
+    """
+    limit = limit or settings.llm_request_fanout
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _run(key: Hashable, coro: Awaitable[Any]) -> Tuple[Hashable, Any]:
+        async with semaphore:
+            try:
+                return key, await coro
+            except Exception as e:
+                return key, e
+
+    tasks = [asyncio.ensure_future(_run(k, c)) for k, c in coros.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
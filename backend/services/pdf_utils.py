@@ -1,67 +1,490 @@
-import PyPDF2
-import io
+import asyncio
+import hashlib
+import json
+import math
+import multiprocessing
+import os
 import re
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
 from fastapi import UploadFile, HTTPException
+from config.settings import settings
+from services.token_utils import count_tokens, split_by_tokens, chunk_token_budget
+from services.pdf_worker import count_pages, engine_candidates, extract_page_range, warm_up
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-async def extract_text_from_pdf(file: UploadFile) -> str:
+# Tài liệu ngắn không đáng chia nhỏ: mỗi tác vụ phải mở lại và parse toàn bộ file PDF
+MIN_PAGES_PER_TASK = 10
 
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    global _extract_pool
+    if _extract_pool is None:
+        # spawn: an toàn với event loop/thread của process chính và chạy được trên Windows
+        _extract_pool = ProcessPoolExecutor(
+            max_workers=settings.pdf_extract_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _extract_pool
+
+
+async def warm_extract_pool() -> None:
+    """Khởi động sẵn các worker (spawn tốn vài trăm ms/process) để upload đầu tiên không phải chờ"""
+    if settings.pdf_extract_workers <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    pool = _get_extract_pool()
+    await asyncio.gather(*[loop.run_in_executor(pool, warm_up) for _ in range(settings.pdf_extract_workers)])
+
+
+def shutdown_extract_pool() -> None:
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+def _recycle_extract_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Bỏ pool và kill các worker của nó (tác vụ đang chạy không hủy được bằng cancel);
+    lần gọi sau tạo pool mới. Tác vụ của request khác trên pool cũ nhận BrokenProcessPool
+    và được chạy lại trên pool mới (iter_extracted_pages)
+    """
+    global _extract_pool
+    if _extract_pool is pool:
+        _extract_pool = None
+    # Python < 3.14 chưa có ProcessPoolExecutor.kill_workers(). Không hủy future của pool:
+    # pool tự báo BrokenProcessPool cho mọi tác vụ còn lại (hủy trước đó làm nó lỗi)
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.kill()
+    pool.shutdown(wait=False)
+
+
+def _submit_ranges(pool: ProcessPoolExecutor, file_path: str, tasks: List[Tuple[int, int]], engine: str) -> list:
+    return [pool.submit(extract_page_range, file_path, start, end, engine) for start, end in tasks]
+
+
+def page_ranges(page_count: int, workers: int, max_pages_per_task: int) -> List[Tuple[int, int]]:
+    """
+    Chia [0, page_count) thành các đoạn liên tiếp cho worker: chia đều cho `workers`,
+    mỗi đoạn tối đa `max_pages_per_task` và tối thiểu MIN_PAGES_PER_TASK trang
+    """
+    per_worker = max(MIN_PAGES_PER_TASK, math.ceil(page_count / max(1, workers)))
+    size = max(1, min(max_pages_per_task, per_worker))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def parse_page_spec(spec: str) -> List[Tuple[int, int]]:
+    """
+    "40-55, 60" → [(39, 55), (59, 60)]: các đoạn [start, end) đánh số từ 0,
+    đã sắp xếp và gộp đoạn chồng nhau. Sai cú pháp → HTTP 400.
+    """
+    ranges = []
+    for part in re.split(r'[,;]', spec or ""):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d+)\s*(?:[-–]\s*(\d+))?', part)
+        if not match:
+            raise HTTPException(status_code=400, detail=f"Khoảng trang không hợp lệ: '{part}' (ví dụ: 40-55, 60)")
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first:
+            raise HTTPException(status_code=400, detail=f"Khoảng trang không hợp lệ: '{part}'")
+        ranges.append((first - 1, last))
+    return merge_page_ranges(ranges)
+
+
+def merge_page_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def section_page_ranges(outline: List[Tuple[int, str, int]], query: str, page_count: int) -> List[Tuple[int, int]]:
+    """
+    Các trang của mục trong mục lục khớp `query` (trùng tiêu đề, hoặc tiêu đề
+    chứa query; không phân biệt hoa thường): từ trang của mục tới trước mục kế
+    tiếp cùng cấp hoặc cấp cao hơn. Không khớp → HTTP 404.
+    """
+    needle = re.sub(r'\s+', ' ', query).strip().lower()
+    titles = [re.sub(r'\s+', ' ', title).strip().lower() for _, title, _ in outline]
+    matches = [i for i, title in enumerate(titles) if title == needle] or \
+              [i for i, title in enumerate(titles) if needle in title]
+    if not needle or not matches:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy mục '{query}' trong mục lục của PDF")
+
+    ranges = []
+    for i in matches:
+        level, _, page = outline[i]
+        end = page_count
+        for next_level, _, next_page in outline[i + 1:]:
+            if next_level <= level:
+                # Mục kế tiếp có thể bắt đầu giữa trang → giữ cả trang đó
+                end = max(page, next_page)
+                break
+        ranges.append((page - 1, min(end, page_count)))
+    return merge_page_ranges(ranges)
+
+
+def _require_pages(pages: List[Tuple[int, str]]) -> List[str]:
+    if not pages:
+        raise HTTPException(
+            status_code=400,
+            detail="Không thể trích xuất văn bản từ PDF. File có thể là ảnh scan hoặc bị mã hóa."
+        )
+    return [text for _, text in pages]
+
+
+def extract_pages_from_bytes(pdf_bytes: bytes) -> List[str]:
+    """Trích xuất text đã làm sạch của từng trang (bỏ trang rỗng) - đồng bộ, trong process hiện tại"""
+    return _require_pages(extract_page_range(pdf_bytes, 0, None, settings.pdf_engine))
+
+
+def _extraction_tasks(page_count: int, selection: Optional[List[Tuple[int, int]]]) -> List[Tuple[int, int]]:
+    """Các đoạn [start, end) giao cho từng tác vụ trích xuất, theo thứ tự trang"""
+    tasks = []
+    for start, end in selection or [(0, page_count)]:
+        end = min(end, page_count)
+        if end <= start:
+            continue
+        if settings.pdf_extract_workers <= 0:
+            tasks.append((start, end))
+            continue
+        tasks.extend(
+            (start + sub_start, start + sub_end)
+            for sub_start, sub_end in page_ranges(end - start, settings.pdf_extract_workers, settings.pdf_max_pages_per_task)
+        )
+    return tasks
+
+
+async def iter_extracted_pages(
+    file_path: str, selection: Optional[List[Tuple[int, int]]] = None
+) -> AsyncIterator[Tuple[float, int, str]]:
+    """
+    Trích xuất ngoài event loop: chia trang thành các đoạn chạy song song trên
+    process pool (PDF_EXTRACT_WORKERS; 0 = lần lượt trong thread). Yield
+    (tiến độ 0..1, số trang, text đã làm sạch) theo đúng thứ tự trang, ngay khi
+    đoạn chứa trang đó xong - không đợi cả tài liệu. `selection` ([start, end)
+    từ 0) giới hạn các trang cần đọc; None = cả tài liệu. Quá
+    PDF_EXTRACT_TIMEOUT giây cho cả tài liệu → HTTP 504; đoạn còn đang chạy
+    thì pool bị thu hồi để không chiếm worker của các request sau.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.pdf_extract_timeout if settings.pdf_extract_timeout else None
+
+    def remaining() -> Optional[float]:
+        return None if deadline is None else max(0.0, deadline - loop.time())
+
+    # Một engine cho cả tài liệu (text của mọi chunk cùng cách tách dòng / khoảng trắng):
+    # PDF_ENGINE=auto chỉ đổi engine khi engine trước lỗi hoặc không lấy được chữ nào
+    # trước khi có trang nào được yield
+    engines = [candidate.name for candidate in engine_candidates(settings.pdf_engine)]
+    pool = None
+    futures = []
     try:
-        pdf_bytes = await file.read()
-        
-        # Mở PDF từ bytes
-        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-        
-        # Trích xuất text từ tất cả các trang
-        text_parts = []
-        for page_num, page in enumerate(pdf_reader.pages, start=1):
-            page_text = page.extract_text()
-            if page_text.strip():
-                text_parts.append(page_text)
-                logger.info(f"Đã trích xuất trang {page_num}: {len(page_text)} ký tự")
-        
-        if not text_parts:
-            raise HTTPException(
-                status_code=400,
-                detail="Không thể trích xuất văn bản từ PDF. File có thể là ảnh scan hoặc bị mã hóa."
-            )
-        
-        # Ghép text và làm sạch
-        full_text = "\n\n".join(text_parts)
-        cleaned_text = clean_text(full_text)
-        
-        logger.info(f"✅ Đã trích xuất {len(text_parts)} trang, tổng {len(cleaned_text)} ký tự")
-        return cleaned_text
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Lỗi khi đọc PDF: {str(e)}")
+        for attempt, engine in enumerate(engines):
+            last = attempt == len(engines) - 1
+            yielded = 0
+            try:
+                page_count = await asyncio.wait_for(
+                    asyncio.to_thread(count_pages, file_path, engine), remaining()
+                )
+                tasks = _extraction_tasks(page_count, selection)
+                total = sum(end - start for start, end in tasks) or 1
+
+                if settings.pdf_extract_workers > 0:
+                    pool = _get_extract_pool()
+                    futures = _submit_ranges(pool, file_path, tasks, engine)
+
+                done = 0
+                resubmitted = False
+                for i, (start, end) in enumerate(tasks):
+                    if pool is not None:
+                        while True:
+                            try:
+                                pages = await asyncio.wait_for(asyncio.wrap_future(futures[i]), remaining())
+                                break
+                            except BrokenProcessPool:
+                                if resubmitted or pool is _extract_pool:
+                                    # Worker chết (thiếu RAM, PDF lỗi nặng...) → tạo pool mới cho lần sau
+                                    _recycle_extract_pool(pool)
+                                    raise
+                                # Pool bị thu hồi do tác vụ quá giờ của request khác → chạy lại trên pool mới
+                                resubmitted = True
+                                pool = _get_extract_pool()
+                                futures[i:] = _submit_ranges(pool, file_path, tasks[i:], engine)
+                    else:
+                        pages = await asyncio.wait_for(
+                            asyncio.to_thread(extract_page_range, file_path, start, end, engine), remaining()
+                        )
+                    for page_no, text in pages:
+                        yielded += 1
+                        yield (done + page_no - start) / total, page_no, text
+                    done += end - start
+            except (asyncio.TimeoutError, BrokenProcessPool):
+                raise
+            except Exception as e:
+                if yielded or last:
+                    raise
+                logger.warning(f"⚠️ Engine {engine} lỗi ({str(e)}), đọc lại cả tài liệu bằng engine khác")
+                for future in futures:
+                    future.cancel()
+                continue
+
+            if yielded or last:
+                logger.info(f"⚙️ Trích xuất {done}/{page_count} trang bằng {len(tasks)} tác vụ ({engine})")
+                break
+            logger.warning(f"⚠️ Engine {engine} không lấy được chữ nào, đọc lại cả tài liệu bằng engine khác")
+    except asyncio.TimeoutError:
+        # cancel() chỉ bỏ được đoạn chưa chạy; đoạn đang chạy giữ worker tới khi xong
+        running = sum(1 for future in futures if future.running())
+        if running:
+            logger.warning(f"⏱️ Trích xuất quá giờ, thu hồi pool ({running} tác vụ đang chạy)")
+            _recycle_extract_pool(pool)
+            futures = []
         raise HTTPException(
-            status_code=500,
-            detail=f"Lỗi xử lý PDF: {str(e)}"
+            status_code=504,
+            detail=f"Trích xuất PDF quá {settings.pdf_extract_timeout:.0f} giây. File có thể quá lớn hoặc bị lỗi."
         )
+    finally:
+        # Người dùng ngắt giữa chừng hoặc lỗi → bỏ các đoạn chưa chạy
+        for future in futures:
+            future.cancel()
 
 
-def clean_text(text: str) -> str:
+def _copy_upload(source, dest_path: str, max_bytes: int, block_size: int) -> Tuple[int, str]:
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with open(dest_path, "wb") as out:
+            for block in iter(lambda: source.read(block_size), b""):
+                size += len(block)
+                if max_bytes and size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File vượt quá giới hạn {settings.max_upload_mb} MB"
+                    )
+                digest.update(block)
+                out.write(block)
+    except BaseException:
+        os.remove(dest_path)
+        raise
+    if size == 0:
+        # File rỗng không phải PDF (và mmap của PyPDF2Engine lỗi với file 0 byte)
+        os.remove(dest_path)
+        raise HTTPException(status_code=400, detail="File rỗng")
+    return size, digest.hexdigest()
 
-    text = re.sub(r'[\r\t\f\v]', ' ', text)
-    
-    text = re.sub(r' +', ' ', text)
 
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    
-    lines = [line.strip() for line in text.split('\n')]
-    text = '\n'.join(lines)
-    
-    return text.strip()
+async def save_upload(file: UploadFile, dest_path: str) -> Tuple[int, str]:
+    """
+    Ghi file upload xuống đĩa theo từng khối UPLOAD_BLOCK_KB, vừa ghi vừa tính
+    SHA-256 - không giữ cả file trong RAM. Vượt MAX_UPLOAD_MB → HTTP 413, file
+    rỗng → HTTP 400; xóa phần đã ghi. Trả về (số byte, SHA-256).
+    Giới hạn dung lượng ở đây tính trên file; UploadLimitMiddleware chặn body quá
+    lớn từ trước, khi Starlette chưa ghi multipart ra đĩa.
+    """
+    await file.seek(0)
+    return await asyncio.to_thread(
+        _copy_upload, file.file, dest_path,
+        settings.max_upload_mb * 1024 * 1024, settings.upload_block_kb * 1024
+    )
+
+
+# Phần body multipart ngoài nội dung file (boundary, header từng phần, các field khác)
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware giới hạn body multipart/form-data ở MAX_UPLOAD_MB trước khi
+    Starlette đọc và spool cả body ra đĩa: Content-Length quá lớn → 413 ngay, không
+    có Content-Length (chunked) → đếm byte khi nhận và dừng khi vượt.
+    """
+
+    def __init__(self, app, max_bytes: Optional[int] = None):
+        self.app = app
+        self.max_bytes = max_bytes if max_bytes is not None else settings.max_upload_mb * 1024 * 1024
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or []) if scope["type"] == "http" else {}
+        if not self.max_bytes or not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_bytes + _MULTIPART_OVERHEAD
+        detail = f"File vượt quá giới hạn {settings.max_upload_mb} MB"
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            body = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+            await send({
+                "type": "http.response.start",
+                "status": 413,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI giữ nguyên HTTPException khi đọc body → trả 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def join_pages(pages: List[str]) -> str:
+    """Ghép text các trang đã làm sạch thành một văn bản"""
+    return "\n\n".join(pages).strip()
+
+
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?。])\s+')
+
 
+def _split_units(text: str, max_tokens: int, model: Optional[str]) -> List[Tuple[str, int, str]]:
+    """
+    Tách văn bản thành các đơn vị (đoạn; câu nếu đoạn quá dài; cắt cứng nếu câu
+    quá dài). Mỗi đơn vị: (text, số token, ký tự nối với đơn vị trước).
+    """
+    units = []
+    for paragraph in re.split(r'\n{2,}', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
 
-def chunk_text(text: str, max_chars: int = 4000, overlap: int = 200) -> List[str]:
+        tokens = count_tokens(paragraph, model)
+        if tokens <= max_tokens:
+            units.append((paragraph, tokens, "\n\n"))
+            continue
+
+        sep = "\n\n"
+        for sentence in _SENTENCE_SPLIT_RE.split(paragraph):
+            sentence_tokens = count_tokens(sentence, model)
+            pieces = [sentence] if sentence_tokens <= max_tokens else split_by_tokens(sentence, max_tokens, model)
+            for piece in pieces:
+                units.append((piece, sentence_tokens if len(pieces) == 1 else count_tokens(piece, model), sep))
+                sep = " "
+    return units
+
+
+class ChunkPacker:
+    """
+    Chia văn bản theo token thật của model, nhận văn bản dần (từng trang): gom
+    các đoạn vào chunk tới khi đầy ngân sách token (chừa chỗ cho template prompt
+    và AI_MAX_TOKENS), chunk đầy được trả ra ngay. Phần gối đầu giữa 2 chunk
+    cũng tính bằng token. Đưa vào từng trang hay cả văn bản đã ghép bằng
+    join_pages đều ra cùng các chunk.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = None,
+        overlap_tokens: Optional[int] = None,
+        model: Optional[str] = None
+    ):
+        self.max_tokens = max_tokens or chunk_token_budget(model)
+        self.overlap_tokens = settings.chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+        self.model = model
+        self.chunk_count = 0
+        # Chỉ mục nguồn: (trang đầu, trang cuối) của chunk thứ i, kể cả phần gối đầu
+        self.spans: List[Tuple[Optional[int], Optional[int]]] = []
+        self._current: List[Tuple[str, int, str, Optional[int]]] = []
+        self._current_tokens = 0
+        self._new_units = 0
+
+    def add(self, text: str, page_no: Optional[int] = None) -> List[str]:
+        """Thêm văn bản (của trang `page_no`), trả về các chunk vừa đầy"""
+        chunks = []
+        for unit in _split_units(text, self.max_tokens, self.model):
+            unit = (*unit, page_no)
+            if self._current and self._current_tokens + unit[1] > self.max_tokens:
+                chunks.append(self._emit())
+
+                # Gối đầu: giữ lại các đơn vị cuối có tổng <= overlap_tokens
+                tail, tail_tokens = [], 0
+                for prev in reversed(self._current):
+                    if tail_tokens + prev[1] > self.overlap_tokens or tail_tokens + prev[1] + unit[1] > self.max_tokens:
+                        break
+                    tail.insert(0, prev)
+                    tail_tokens += prev[1]
+                self._current, self._current_tokens, self._new_units = tail, tail_tokens, 0
+
+            self._current.append(unit)
+            self._current_tokens += unit[1]
+            self._new_units += 1
+        return chunks
+
+    def finish(self) -> List[str]:
+        """Chunk cuối (nếu còn đơn vị chưa nằm trong chunk nào)"""
+        if self._current and self._new_units:
+            self._new_units = 0
+            return [self._emit()]
+        return []
+
+    def _emit(self) -> str:
+        self.chunk_count += 1
+        self.spans.append((self._current[0][3], self._current[-1][3]))
+        logger.debug(f"Chunk {self.chunk_count}: {self._current_tokens} tokens")
+        return _join_units(self._current)
+
+
+def chunk_pages(
+    pages: Iterable[Tuple[int, str]],
+    max_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+    model: Optional[str] = None
+) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """Chia các trang [(số trang, text)] thành chunk, kèm (trang đầu, trang cuối) của từng chunk"""
+    packer = ChunkPacker(max_tokens, overlap_tokens, model)
+    chunks = []
+    for page_no, text in pages:
+        chunks.extend(packer.add(text, page_no))
+    chunks.extend(packer.finish())
+    logger.info(f"Đã chia thành {len(chunks)} chunks (tối đa {packer.max_tokens} tokens/chunk)")
+    return chunks, packer.spans
+
+
+def chunk_text(
+    text: str,
+    max_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+    model: Optional[str] = None
+) -> List[str]:
+    """Chia cả văn bản thành chunk theo token (xem ChunkPacker)"""
+    packer = ChunkPacker(max_tokens, overlap_tokens, model)
+    chunks = packer.add(text) + packer.finish()
+    logger.info(f"Đã chia thành {len(chunks)} chunks (tối đa {packer.max_tokens} tokens/chunk)")
+    return chunks
+
+
+def _join_units(units: List[tuple]) -> str:
+    parts = [units[0][0]]
+    for unit in units[1:]:
+        parts.append(unit[2])
+        parts.append(unit[0])
+    return "".join(parts).strip()
+
+
+def chunk_text_by_chars(text: str, max_chars: int = 4000, overlap: int = 200) -> List[str]:
+    """Cách chia cũ theo số ký tự (giữ lại để so sánh trong benchmark)"""
 
     if len(text) <= max_chars:
         return [text]
@@ -88,7 +511,3 @@ def chunk_text(text: str, max_chars: int = 4000, overlap: int = 200) -> List[str
     
     logger.info(f"Đã chia thành {len(chunks)} chunks")
     return chunks
-
-
-def estimate_tokens(text: str) -> int:
-    return len(text) // 4
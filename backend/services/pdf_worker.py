@@ -0,0 +1,184 @@
+"""
+Code chạy trong process trích xuất PDF (spawn). Chỉ import engine PDF và thư viện
+chuẩn để worker khởi động nhanh - không import fastapi/settings/openai ở đây.
+"""
+import io
+import logging
+import mmap
+import re
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Union
+
+import PyPDF2
+
+try:
+    import pymupdf
+except ImportError:  # PyMuPDF < 1.24 chỉ có tên fitz
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf = None
+
+logger = logging.getLogger(__name__)
+
+PdfSource = Union[str, bytes]
+
+
+class PdfEngine:
+    """Engine trích xuất text PDF: đếm trang và lấy text thô của một đoạn trang"""
+
+    name = ""
+
+    def page_count(self, source: PdfSource) -> int:
+        raise NotImplementedError
+
+    def extract_range(self, source: PdfSource, start: int, end: Optional[int]) -> List[Tuple[int, str]]:
+        """[(số trang, text thô)] của các trang [start, end)"""
+        raise NotImplementedError
+
+    def outline(self, source: PdfSource) -> List[Tuple[int, str, int]]:
+        """Mục lục (bookmark) theo thứ tự: [(cấp, tiêu đề, số trang)]"""
+        raise NotImplementedError
+
+
+class PyPDF2Engine(PdfEngine):
+    name = "pypdf2"
+
+    @contextmanager
+    def _open(self, source: PdfSource):
+        if isinstance(source, bytes):
+            yield PyPDF2.PdfReader(io.BytesIO(source))
+            return
+        # PdfReader(path) đọc cả file vào RAM; mmap để OS chỉ nạp phần được đọc
+        with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield PyPDF2.PdfReader(mapped)
+
+    def page_count(self, source: PdfSource) -> int:
+        with self._open(source) as reader:
+            return len(reader.pages)
+
+    def extract_range(self, source: PdfSource, start: int, end: Optional[int]) -> List[Tuple[int, str]]:
+        with self._open(source) as reader:
+            end = len(reader.pages) if end is None else min(end, len(reader.pages))
+            return [(idx + 1, reader.pages[idx].extract_text() or "") for idx in range(start, end)]
+
+    def outline(self, source: PdfSource) -> List[Tuple[int, str, int]]:
+        with self._open(source) as reader:
+            entries = []
+
+            def walk(items, level):
+                for item in items:
+                    if isinstance(item, list):
+                        walk(item, level + 1)
+                        continue
+                    page_idx = reader.get_destination_page_number(item)
+                    if page_idx is not None and page_idx >= 0:
+                        entries.append((level, str(item.title), page_idx + 1))
+
+            walk(reader.outline, 1)
+            return entries
+
+
+class PyMuPDFEngine(PdfEngine):
+    """Nhanh hơn PyPDF2 nhiều lần, giữ thứ tự đọc theo block (bố cục nhiều cột)"""
+
+    name = "pymupdf"
+
+    def _open(self, source: PdfSource):
+        if isinstance(source, bytes):
+            return pymupdf.open(stream=source, filetype="pdf")
+        return pymupdf.open(source)
+
+    def page_count(self, source: PdfSource) -> int:
+        with self._open(source) as doc:
+            return doc.page_count
+
+    def extract_range(self, source: PdfSource, start: int, end: Optional[int]) -> List[Tuple[int, str]]:
+        with self._open(source) as doc:
+            end = doc.page_count if end is None else min(end, doc.page_count)
+            return [(idx + 1, doc[idx].get_text("text")) for idx in range(start, end)]
+
+    def outline(self, source: PdfSource) -> List[Tuple[int, str, int]]:
+        with self._open(source) as doc:
+            # get_toc: trang bắt đầu từ 1, -1 nếu bookmark không trỏ tới trang nào
+            return [(level, title, page) for level, title, page in doc.get_toc(simple=True) if page > 0]
+
+
+PDF_ENGINES: Dict[str, PdfEngine] = {"pypdf2": PyPDF2Engine()}
+if pymupdf is not None:
+    PDF_ENGINES["pymupdf"] = PyMuPDFEngine()
+
+# Thứ tự ưu tiên của PDF_ENGINE=auto: nhanh nhất trước, PyPDF2 làm dự phòng
+_AUTO_ORDER = ("pymupdf", "pypdf2")
+
+
+def engine_candidates(engine: str) -> List[PdfEngine]:
+    """Các engine sẽ thử theo thứ tự cho setting PDF_ENGINE (auto | pymupdf | pypdf2)"""
+    if engine == "auto":
+        return [PDF_ENGINES[name] for name in _AUTO_ORDER if name in PDF_ENGINES]
+    if engine not in PDF_ENGINES:
+        raise ValueError(f"PDF engine không hỗ trợ hoặc chưa cài: {engine}")
+    return [PDF_ENGINES[engine]]
+
+
+def count_pages(source: PdfSource, engine: str = "auto") -> int:
+    last_error = None
+    for candidate in engine_candidates(engine):
+        try:
+            return candidate.page_count(source)
+        except Exception as e:
+            last_error = e
+    raise last_error
+
+
+def read_outline(source: PdfSource, engine: str = "auto") -> List[Tuple[int, str, int]]:
+    last_error = None
+    for candidate in engine_candidates(engine):
+        try:
+            return candidate.outline(source)
+        except Exception as e:
+            last_error = e
+    raise last_error
+
+
+def extract_page_range(
+    source: PdfSource, start: int, end: Optional[int], engine: str = "auto"
+) -> List[Tuple[int, str]]:
+    """
+    [(số trang, text đã làm sạch)] của các trang [start, end) không rỗng.
+    auto: engine đầu tiên lỗi hoặc không lấy được chữ nào → thử engine tiếp theo
+    (chọn theo từng lần gọi - chỉ dùng cho cả tài liệu; khi chia tài liệu thành nhiều
+    đoạn, iter_extracted_pages chọn engine một lần rồi truyền tên engine cụ thể).
+    """
+    candidates = engine_candidates(engine)
+    for i, candidate in enumerate(candidates):
+        try:
+            raw_pages = candidate.extract_range(source, start, end)
+        except Exception as e:
+            if i == len(candidates) - 1:
+                raise
+            logger.warning(f"⚠️ Engine {candidate.name} lỗi ({str(e)}), thử engine khác")
+            continue
+        pages = [(page_no, clean_text(text)) for page_no, text in raw_pages if text and text.strip()]
+        if pages or i == len(candidates) - 1:
+            return pages
+    return []
+
+
+def warm_up() -> bool:
+    """No-op để process pool khởi động sẵn worker"""
+    return True
+
+
+def clean_text(text: str) -> str:
+
+    text = re.sub(r'[\r\t\f\v]', ' ', text)
+    
+    text = re.sub(r' +', ' ', text)
+
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    
+    lines = [line.strip() for line in text.split('\n')]
+    text = '\n'.join(lines)
+    
+    return text.strip()
@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+from config.settings import settings
+from services.lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+_MASK = (1 << 64) - 1
+# Khóa cố định: chữ ký giống nhau giữa các process / lần khởi động (hash() của str đổi theo PYTHONHASHSEED)
+_HASH_KEY = b"question-dedup-v1"
+_CHOICE_PREFIX_RE = re.compile(r'^\s*[A-Da-d][.):]\s*')
+
+
+@lru_cache(maxsize=65536)
+def _shingle_hash(shingle: str) -> int:
+    """Hash 64 bit ổn định của token (cache: cùng một âm tiết lặp lại ở rất nhiều câu)"""
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8, key=_HASH_KEY).digest(), "big")
+
+
+def question_key(q: Dict[str, Any]) -> str:
+    """Phần dùng để so trùng: câu hỏi + đáp án (bỏ nhãn "A." - các chunk xếp lựa chọn khác nhau)"""
+    answer = _CHOICE_PREFIX_RE.sub("", str(q.get("answer", "")))
+    return f"{q.get('question', '')} {answer}"
+
+
+def question_shingles(q: Dict[str, Any]) -> FrozenSet[str]:
+    """Tập token (âm tiết + bigram, đã bỏ dấu) của câu hỏi + đáp án"""
+    return frozenset(tokenize(question_key(q)))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class QuestionDeduplicator:
+    """
+    Loại câu hỏi gần trùng (các chunk gối đầu nhau hay sinh cùng một câu với lời
+    khác đôi chút). Chữ ký MinHash một hoán vị (mỗi token băm một lần rồi rơi vào
+    một ô, ô rỗng mượn giá trị ô kế tiếp) + LSH theo band: mỗi câu chỉ so Jaccard
+    thật với các câu cùng bucket ở ít nhất một band → gần tuyến tính theo số câu.
+    Câu đến trước được giữ. `threshold` = Jaccard tối thiểu để coi là trùng
+    (mặc định QUESTION_DEDUP_THRESHOLD); bands x rows = số ô của chữ ký.
+    """
+
+    def __init__(self, threshold: Optional[float] = None, bands: int = 16, rows: int = 4):
+        self.threshold = settings.question_dedup_threshold if threshold is None else threshold
+        self.bands = bands
+        self.rows = rows
+        self.num_bins = bands * rows
+        self._buckets: List[Dict[tuple, List[int]]] = [{} for _ in range(bands)]
+        self._shingles: List[FrozenSet[str]] = []
+        self.dropped = 0
+
+    def _signature(self, shingles: Iterable[str]) -> List[int]:
+        n = self.num_bins
+        bins: List[Optional[int]] = [None] * n
+        for shingle in shingles:
+            h = _shingle_hash(shingle)
+            slot, value = h % n, h // n
+            if bins[slot] is None or value < bins[slot]:
+                bins[slot] = value
+
+        # Densification: ô rỗng lấy giá trị ô có dữ liệu kế tiếp (vòng tròn) + khoảng cách,
+        # để hai tập giống nhau vẫn ra cùng chữ ký ở các ô đó
+        filled = [i for i, v in enumerate(bins) if v is not None]
+        if len(filled) < n:
+            nxt = filled[0] + n
+            for i in range(n - 1, -1, -1):
+                if bins[i] is None:
+                    source = nxt % n
+                    bins[i] = bins[source] + (nxt - i) * (_MASK // n)
+                else:
+                    nxt = i
+        return bins
+
+    def add(self, q: Dict[str, Any]) -> bool:
+        """Thêm câu hỏi; False nếu gần trùng một câu đã có (và không thêm)"""
+        shingles = question_shingles(q)
+        if not shingles:
+            return True
+
+        signature = self._signature(shingles)
+        # Band lấy các ô cách nhau `bands` ô: các ô rỗng liền nhau mượn cùng một ô nên
+        # nếu nằm chung band thì band đó chỉ còn giá trị bằng một ô
+        keys = [tuple(signature[band::self.bands]) for band in range(self.bands)]
+        candidates = set()
+        for band, key in enumerate(keys):
+            candidates.update(self._buckets[band].get(key, ()))
+        for idx in candidates:
+            if jaccard(shingles, self._shingles[idx]) >= self.threshold:
+                self.dropped += 1
+                logger.debug(f"♊ Bỏ câu gần trùng: {str(q.get('question', ''))[:60]}...")
+                return False
+
+        idx = len(self._shingles)
+        self._shingles.append(shingles)
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, []).append(idx)
+        return True
+
+    def filter(self, questions: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Chỉ giữ các câu không trùng với câu đã thấy (kể cả các lần gọi trước)"""
+        before = self.dropped
+        kept = [q for q in questions if self.add(q)]
+        if self.dropped > before:
+            logger.info(f"♊ Đã loại {self.dropped - before} câu hỏi gần trùng")
+        return kept
+
+
+def dedupe_questions(questions: List[Dict[str, Any]], threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+    return QuestionDeduplicator(threshold).filter(questions)
@@ -0,0 +1,171 @@
+import re
+import math
+import logging
+from typing import Iterable, List, Optional, Sequence
+from config.settings import settings
+from services.lexical import BM25Index, normalize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUESTION_COUNT = 5
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_NUMBER_RE = re.compile(r'\d+')
+
+# Các từ mô tả yêu cầu chung, không nói gì về nội dung cần hỏi
+_PROMPT_STOPWORDS = {
+    'tạo', 'câu', 'hỏi', 'trắc', 'nghiệm', 'về', 'cho', 'các', 'những', 'một',
+    'và', 'của', 'trong', 'với', 'đáp', 'án', 'bài', 'phần', 'nội', 'dung',
+    'kiến', 'thức', 'văn', 'bản', 'này', 'tài', 'liệu', 'quan', 'trọng',
+    'create', 'make', 'generate', 'questions', 'question', 'about', 'the',
+    'and', 'for', 'with', 'from', 'this', 'that', 'mcq', 'quiz'
+}
+_FOLDED_STOPWORDS = {normalize(w) for w in _PROMPT_STOPWORDS}
+
+
+def parse_requested_total(user_prompt: str, default: int = DEFAULT_QUESTION_COUNT) -> int:
+    """Tổng số câu hỏi người dùng yêu cầu (cộng tất cả các số trong prompt)"""
+    numbers = _NUMBER_RE.findall(user_prompt)
+    total = sum(int(n) for n in numbers) if numbers else default
+    return total if total > 0 else default
+
+
+def prompt_terms(user_prompt: str) -> List[str]:
+    """Các từ nội dung trong prompt (bỏ số và từ mô tả yêu cầu), đã chuẩn hóa bỏ dấu"""
+    words = _WORD_RE.findall(normalize(user_prompt))
+    return [w for w in words if not w.isdigit() and len(w) >= 2 and w not in _FOLDED_STOPWORDS]
+
+
+def prompt_query(user_prompt: str) -> List[str]:
+    """Truy vấn BM25 từ prompt: từ nội dung + bigram của hai từ nội dung liền nhau"""
+    words = _WORD_RE.findall(normalize(user_prompt))
+    keep = [not w.isdigit() and len(w) >= 2 and w not in _FOLDED_STOPWORDS for w in words]
+    query = [w for w, k in zip(words, keep) if k]
+    query += [
+        f"{words[i]}_{words[i + 1]}" for i in range(len(words) - 1) if keep[i] and keep[i + 1]
+    ]
+    return query
+
+
+def chunk_relevance(chunks: Sequence[str], user_prompt: str) -> List[float]:
+    """
+    Điểm liên quan của từng chunk với prompt: BM25 (không dấu, có bigram âm tiết),
+    chuẩn hóa về [0, 1] theo chunk tốt nhất. Prompt không có từ nội dung → mọi
+    chunk = 1.0; không chunk nào khớp → mọi chunk = 0.0
+    """
+    query = prompt_query(user_prompt)
+    if not query:
+        return [1.0] * len(chunks)
+
+    scores = BM25Index.from_texts(chunks).score(query)
+    best = max(scores, default=0.0)
+    if best <= 0:
+        return [0.0] * len(chunks)
+    return [score / best for score in scores]
+
+
+def provisional_match(chunk: str, terms: Iterable[str]) -> bool:
+    """
+    Đánh giá tạm một chunk khi chưa đọc hết tài liệu (chưa có IDF để chấm BM25):
+    khớp khi chunk chứa mọi từ nội dung của prompt (`terms` = prompt_terms)
+    """
+    tokens = set(_WORD_RE.findall(normalize(chunk)))
+    return all(term in tokens for term in terms)
+
+
+def select_top_chunks(relevance: Sequence[float], total: int) -> List[float]:
+    """
+    Chỉ giữ các chunk đứng đầu bảng điểm để gửi đi tạo câu hỏi: tối đa
+    ceil(total / QUESTIONS_PER_CHUNK) chunk, điểm >= LEXICAL_MIN_SCORE.
+    Chunk bị loại có relevance = 0 (planner không gọi LLM cho chúng).
+    Không có tín hiệu lexical (mọi điểm bằng nhau) → giữ nguyên.
+    """
+    if not relevance or max(relevance) == min(relevance):
+        return list(relevance)
+
+    limit = max(1, math.ceil(total / max(1, settings.questions_per_chunk)))
+    ranked = sorted(range(len(relevance)), key=lambda i: relevance[i], reverse=True)
+    keep = {i for i in ranked[:limit] if relevance[i] >= settings.lexical_min_score}
+    selected = [r if i in keep else 0.0 for i, r in enumerate(relevance)]
+    logger.info(f"🔎 Lọc lexical: giữ {len(keep)}/{len(relevance)} chunks {sorted(keep)}")
+    return selected
+
+
+def needs_llm_relevance_check(relevance: Sequence[float]) -> bool:
+    """
+    LLM_RELEVANCE_CHECK: "always" | "never" | "auto" - auto chỉ gọi LLM làm trọng tài
+    khi tín hiệu lexical không kết luận được (prompt có từ nội dung nhưng không
+    chunk nào khớp, vd. prompt tiếng Anh cho tài liệu tiếng Việt).
+    """
+    mode = settings.llm_relevance_check
+    if mode == "always":
+        return True
+    if mode == "never":
+        return False
+    return bool(relevance) and max(relevance) <= 0
+
+
+def chunk_weights(chunks: Sequence[str], relevance: Optional[Sequence[float]] = None) -> List[float]:
+    """Trọng số của chunk = độ dài × độ liên quan"""
+    if relevance is None:
+        relevance = [1.0] * len(chunks)
+    weights = [len(c) * max(r, 0.0) for c, r in zip(chunks, relevance)]
+
+    # Không chunk nào khớp prompt → chia đều theo độ dài
+    if sum(weights) <= 0:
+        weights = [float(len(c)) for c in chunks]
+    return weights
+
+
+def allocate_question_budget(
+    chunks: Sequence[str],
+    total: int,
+    relevance: Optional[Sequence[float]] = None
+) -> List[int]:
+    """
+    Chia `total` câu hỏi cho các chunk theo trọng số = độ dài × độ liên quan
+    (phương pháp phần dư lớn nhất). Chunk có quota 0 sẽ không được gọi LLM.
+    """
+    if not chunks or total <= 0:
+        return [0] * len(chunks)
+
+    weights = chunk_weights(chunks, relevance)
+    weight_sum = sum(weights) or 1.0
+    exact = [total * w / weight_sum for w in weights]
+    quotas = [int(x) for x in exact]
+
+    remaining = total - sum(quotas)
+    by_remainder = sorted(
+        range(len(chunks)),
+        key=lambda i: (exact[i] - quotas[i], weights[i]),
+        reverse=True
+    )
+    for i in by_remainder[:remaining]:
+        quotas[i] += 1
+
+    logger.info(
+        f"📐 Phân bổ {total} câu cho {sum(1 for q in quotas if q)}/{len(chunks)} chunks: {quotas}"
+    )
+    return quotas
+
+
+def allocate_top_up(
+    deficit: int,
+    candidates: Sequence[int],
+    weights: Sequence[float],
+    max_chunks: int
+) -> dict:
+    """
+    Chia số câu còn thiếu cho các chunk dự phòng (chưa được dùng),
+    ưu tiên chunk có trọng số cao. Trả về {chunk_index: quota}.
+    """
+    if deficit <= 0 or not candidates:
+        return {}
+
+    ranked = sorted(candidates, key=lambda i: weights[i], reverse=True)
+    selected = ranked[:max(1, min(max_chunks, deficit))]
+
+    plan = {i: deficit // len(selected) for i in selected}
+    for i in selected[:deficit % len(selected)]:
+        plan[i] += 1
+    return {i: q for i, q in plan.items() if q > 0}
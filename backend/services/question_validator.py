@@ -0,0 +1,244 @@
+import logging
+from typing import Any, Dict, List, Mapping, Optional
+from config.settings import settings
+from services.evidence import PassageIndex
+from services.lexical import SourceIndex, source_index, find_numbers
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset({
+    'của', 'và', 'cho', 'với', 'trong', 'trên', 'dưới', 'được', 'là', 'có',
+    'the', 'and', 'for', 'with', 'from', 'this', 'that', 'are', 'was'
+})
+_PUNCTUATION = '.,?!:;"()[]{}'
+_CHOICE_PREFIXES = ("A. ", "B. ", "C. ", "D. ")
+# Mức bám nguồn (theo đoạn bằng chứng) từ đó câu hỏi được coi là liên quan tới tài liệu
+RELEVANT_GROUNDING = 0.5
+
+
+def repair_mcq(q: Dict[str, Any], position: int = 0) -> List[str]:
+    """
+    🔧 AUTO-FIX: BẮT BUỘC TRẮC NGHIỆM (sửa tại chỗ). `position` = thứ tự câu (để log).
+    Trả về danh sách các sửa đổi đã làm.
+    """
+    repairs = []
+
+    # Fix 1: BẮT BUỘC type = mcq
+    actual_type = q.get("type", "")
+    if actual_type != "mcq":
+        logger.warning(f"⚠️ CÂU {position + 1}: type='{actual_type}' → SỬA thành 'mcq'")
+        q["type"] = "mcq"
+        repairs.append("type")
+
+    # Fix 2: BẮT BUỘC có 4 choices A,B,C,D
+    choices = q.get("choices", [])
+    if not choices or len(choices) < 4:
+        logger.warning(f"⚠️ CÂU {position + 1}: Thiếu choices → Thêm 4 đáp án A,B,C,D")
+        ans_text = str(q.get("answer", "Đáp án đúng"))
+        # Xóa prefix A. B. C. D. nếu có
+        for prefix in _CHOICE_PREFIXES:
+            ans_text = ans_text.replace(prefix, "")
+        ans_text = ans_text.strip()
+
+        q["choices"] = [
+            f"A. {ans_text}",
+            "B. Đáp án khác 1",
+            "C. Đáp án khác 2",
+            "D. Đáp án khác 3"
+        ]
+        q["answer"] = f"A. {ans_text}"
+        repairs.append("choices")
+
+    return repairs
+
+
+class QuestionVerdict:
+    """Kết quả kiểm tra một câu hỏi: đã sửa gì, điểm bám nguồn / liên quan, lý do bị loại"""
+
+    def __init__(self, question: Dict[str, Any], position: int):
+        self.question = question
+        self.position = position
+        self.repairs: List[str] = []
+        self.reasons: List[str] = []
+        self.grounding = 1.0   # mức bám nguồn: BM25 của đoạn bằng chứng tốt nhất (hoặc tỉ lệ từ khóa đáp án)
+        self.relevance = 0.0   # = grounding khi có chỉ mục đoạn, nếu không: tỉ lệ từ khóa có trong nguồn
+        self.relevant = False
+        self.evidence: List[Dict[str, Any]] = []
+
+    @property
+    def valid(self) -> bool:
+        return not self.reasons
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "valid": self.valid,
+            "repairs": self.repairs,
+            "reasons": self.reasons,
+            "grounding": round(self.grounding, 3),
+            "relevance": round(self.relevance, 3),
+            "relevant": self.relevant,
+            "evidence": self.evidence
+        }
+
+
+class QuestionValidator:
+    """
+    Hậu kiểm câu hỏi cho một tài liệu, mỗi câu một lượt: auto-fix MCQ, kiểm tra
+    schema, hallucination (số liệu / từ khóa đáp án không có trong nguồn) và độ
+    liên quan. Nguồn của mỗi câu là chunk sinh ra nó (q["chunk_id"] trong
+    `chunk_texts`) hoặc cả tài liệu; chỉ mục nguồn dựng một lần và dùng chung.
+    Có `passages` (chỉ mục đoạn của tài liệu): mỗi câu được gắn các đoạn bằng
+    chứng (q["evidence"]) và mức bám nguồn BM25 (q["grounding"]), thay cho tỉ lệ
+    từ khóa khi quyết định loại câu và độ liên quan.
+    Có thể gọi validate() nhiều lần khi từng chunk xong; điểm liên quan (trên các
+    câu được giữ) cộng dồn.
+    """
+
+    def __init__(
+        self,
+        source_text: str = "",
+        chunk_texts: Optional[Mapping[int, str]] = None,
+        repair: bool = True,
+        passages: Optional[PassageIndex] = None
+    ):
+        self.source_text = source_text
+        self.passages = passages
+        self.chunk_texts: Dict[int, str] = dict(chunk_texts or {})
+        self.repair = repair
+        self.checked = 0
+        self.kept = 0
+        self.relevant_count = 0
+
+    def add_chunk(self, chunk_id: int, text: str) -> None:
+        self.chunk_texts[chunk_id] = text
+
+    def _index(self, q: Dict[str, Any], source_text: Optional[str]) -> SourceIndex:
+        if source_text is not None:
+            return source_index(source_text)
+        key = q.get("chunk_id")
+        if key in self.chunk_texts:
+            return source_index(self.chunk_texts[key])
+        return source_index(self.source_text)
+
+    def check(self, q: Dict[str, Any], position: int = 0, source_text: Optional[str] = None) -> QuestionVerdict:
+        """Kiểm tra một câu (sửa tại chỗ nếu `repair`). `source_text` thay cho nguồn mặc định của câu"""
+        verdict = QuestionVerdict(q, position)
+        if self.repair:
+            verdict.repairs = repair_mcq(q, position)
+
+        question_text = q.get("question")
+        if not isinstance(question_text, str) or not question_text.strip():
+            verdict.reasons.append("Thiếu nội dung câu hỏi")
+            return verdict
+        answer_text = str(q.get("answer", ""))
+        choices = q.get("choices", [])
+        if not isinstance(choices, list):
+            verdict.reasons.append("choices không phải danh sách")
+            return verdict
+        if not answer_text.strip():
+            verdict.reasons.append("Thiếu đáp án")
+            return verdict
+
+        index = self._index(q, source_text)
+
+        # Hallucination: số liệu trong câu hỏi / đáp án
+        suspicious = find_numbers(question_text + " " + answer_text) - index.numbers
+        if suspicious:
+            verdict.reasons.append(f"Số liệu không có trong tài liệu: {suspicious}")
+
+        # Hallucination: số liệu trong các lựa chọn. Lựa chọn giữ chỗ do auto-fix thêm
+        # ("B. Đáp án khác 1") không phải nội dung của AI → chỉ xét đáp án
+        if "choices" in verdict.repairs:
+            choices = choices[:1]
+        choice_texts = [str(c).lower() for c in choices]
+        for choice in choice_texts:
+            suspicious = find_numbers(choice) - index.numbers
+            if suspicious:
+                verdict.reasons.append(f"Lựa chọn có số không có trong tài liệu: {suspicious}")
+                break
+
+        if self.passages is not None:
+            self._check_evidence(verdict)
+        else:
+            self._check_keywords(verdict, index, question_text, answer_text, choice_texts)
+        return verdict
+
+    def _check_evidence(self, verdict: QuestionVerdict) -> None:
+        """Bám nguồn theo đoạn bằng chứng BM25 trong cả tài liệu"""
+        q = verdict.question
+        grounding, evidence = self.passages.evidence(q, settings.evidence_top_k)
+        q["grounding"] = round(grounding, 3)
+        q["evidence"] = evidence
+        verdict.evidence = evidence
+        verdict.grounding = verdict.relevance = grounding
+        verdict.relevant = grounding >= RELEVANT_GROUNDING
+        if grounding < settings.evidence_min_grounding:
+            verdict.reasons.append(f"Không có đoạn nào trong tài liệu làm bằng chứng (bám nguồn {grounding:.2f})")
+
+    def _check_keywords(
+        self, verdict: QuestionVerdict, index: SourceIndex,
+        question_text: str, answer_text: str, choice_texts: List[str]
+    ) -> None:
+        """Khi không có chỉ mục đoạn: tỉ lệ từ khóa có trong nguồn"""
+        hits: Dict[str, bool] = {}
+
+        def found(word: str) -> bool:
+            if word not in hits:
+                hits[word] = index.contains(word)
+            return hits[word]
+
+        # Hallucination: từ khóa dài của đáp án
+        answer_keywords = [w.strip(_PUNCTUATION).lower() for w in answer_text.split() if len(w) > 5]
+        if answer_keywords:
+            matches = sum(1 for kw in answer_keywords if found(kw))
+            verdict.grounding = matches / len(answer_keywords)
+            if len(answer_keywords) >= 3 and verdict.grounding < 0.3:
+                verdict.reasons.append(
+                    f"Answer chứa quá nhiều từ không có trong tài liệu ({matches}/{len(answer_keywords)} keywords)"
+                )
+
+        # Độ liên quan: từ khóa của câu hỏi + đáp án + lựa chọn
+        combined = f"{question_text.lower()} {answer_text.lower()} {' '.join(choice_texts)}"
+        words = [w.strip(_PUNCTUATION) for w in combined.split()]
+        keywords = [w for w in words if len(w) >= 4 and w not in STOPWORDS]
+        if keywords:
+            matches = sum(1 for kw in keywords if found(kw))
+            verdict.relevance = matches / len(keywords)
+            verdict.relevant = verdict.relevance >= 0.4 or matches >= 5
+            if not verdict.relevant:
+                logger.warning(f"⚠️ Câu hỏi ít liên quan: {question_text[:50]}... ({matches}/{len(keywords)} keywords)")
+
+    def validate(self, questions: List[Dict[str, Any]], source_text: Optional[str] = None) -> List[QuestionVerdict]:
+        """Kiểm tra một loạt câu (vd. câu của một chunk vừa xong), cộng dồn thống kê"""
+        verdicts = []
+        for q in questions:
+            verdict = self.check(q, self.checked, source_text)
+            self.checked += 1
+            if verdict.valid:
+                self.kept += 1
+                self.relevant_count += verdict.relevant
+            else:
+                logger.warning(f" Loại bỏ câu {verdict.position + 1} (nghi ngờ hallucination): {str(q.get('question', ''))[:60]}...")
+                logger.warning(f"   Lý do: {'; '.join(verdict.reasons)}")
+            verdicts.append(verdict)
+
+        repaired = sum(len(v.repairs) for v in verdicts)
+        if repaired:
+            logger.warning(f"🔧 Đã tự động sửa {repaired} vấn đề về type/choices")
+        return verdicts
+
+    def filter(self, questions: List[Dict[str, Any]], source_text: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Chỉ giữ các câu hợp lệ"""
+        return [v.question for v in self.validate(questions, source_text) if v.valid]
+
+    @property
+    def relevance_score(self) -> float:
+        return self.relevant_count / self.kept if self.kept else 0.0
+
+    def is_relevant(self, threshold: float = 0.3) -> bool:
+        score = self.relevance_score
+        logger.info(
+            f"📊 Độ liên quan: {score:.2f} ({self.relevant_count}/{self.kept}), "
+            f"đã loại {self.checked - self.kept}/{self.checked} câu nghi ngờ hallucination"
+        )
+        return self.kept > 0 and score >= threshold
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+_DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Đổi giá trị header x-ratelimit-reset-* ("1s", "6m0s", "20ms") sang giây"""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def request_not_accepted(error: Exception) -> bool:
+    """
+    Lỗi cho biết chắc server chưa nhận xử lý request: 429, hoặc không mở được kết nối
+    (từ chối kết nối / hết giờ khi kết nối). Timeout hay đứt kết nối giữa chừng thì
+    request có thể đã được thực hiện.
+    """
+    if isinstance(error, RateLimitError):
+        return True
+    cause = error
+    while cause is not None:
+        if isinstance(cause, ConnectionRefusedError) or type(cause).__name__ in ("ConnectError", "ConnectTimeout"):
+            return True
+        cause = cause.__cause__ or cause.__context__
+    return False
+
+
+class TokenBucket:
+    """Bucket nạp lại đều `capacity` đơn vị mỗi phút"""
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_consume(self, amount: float) -> float:
+        """Lấy `amount` nếu đủ (trả 0), nếu không trả số giây cần chờ"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.available >= amount:
+                self.available -= amount
+                return 0.0
+            return (amount - self.available) / self.rate
+
+    def refund(self, amount: float) -> None:
+        with self._lock:
+            self.available = min(self.capacity, self.available + amount)
+
+    def sync_remaining(self, remaining: float, reset_seconds: Optional[float]) -> None:
+        """Server báo còn ít hơn ta tính → hạ xuống theo server"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if remaining < self.available:
+                self.available = remaining
+            if reset_seconds and remaining <= 0:
+                self.available = -reset_seconds * self.rate
+
+
+class RateLimiter:
+    """
+    Giới hạn phía client cho mọi lời gọi OpenAI: bucket requests/phút và tokens/phút,
+    đồng bộ theo header x-ratelimit-*, xếp hàng thay vì lỗi, retry backoff có jitter.
+    """
+
+    def __init__(self, rpm: int, tpm: int, max_retries: int, backoff_base: float, backoff_max: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._async_lock = asyncio.Lock()
+        self._sync_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.waits = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.last_headers: Dict[str, Any] = {}
+
+    def _enter_queue(self) -> float:
+        with self._stats_lock:
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        return time.monotonic()
+
+    def _leave_queue(self, started: float) -> None:
+        waited = time.monotonic() - started
+        with self._stats_lock:
+            self.queue_depth -= 1
+            self.calls += 1
+            if waited > 0.001:
+                self.waits += 1
+                self.total_wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def _next_wait(self, estimated_tokens: int) -> float:
+        wait = self.requests.try_consume(1)
+        if wait > 0:
+            return wait
+        wait = self.tokens.try_consume(estimated_tokens)
+        if wait > 0:
+            self.requests.refund(1)
+        return wait
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """Chờ (không chặn event loop) tới khi đủ quota; các lời gọi xếp hàng FIFO"""
+        started = self._enter_queue()
+        try:
+            async with self._async_lock:
+                while True:
+                    wait = self._next_wait(estimated_tokens)
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+        finally:
+            self._leave_queue(started)
+
+    def acquire_sync(self, estimated_tokens: int) -> None:
+        started = self._enter_queue()
+        try:
+            with self._sync_lock:
+                while True:
+                    wait = self._next_wait(estimated_tokens)
+                    if wait <= 0:
+                        break
+                    time.sleep(wait)
+        finally:
+            self._leave_queue(started)
+
+    def update_from_headers(self, headers: Any) -> None:
+        if not headers:
+            return
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_requests is not None:
+            self.requests.sync_remaining(
+                float(remaining_requests),
+                parse_reset_duration(headers.get("x-ratelimit-reset-requests"))
+            )
+        if remaining_tokens is not None:
+            self.tokens.sync_remaining(
+                float(remaining_tokens),
+                parse_reset_duration(headers.get("x-ratelimit-reset-tokens"))
+            )
+        self.last_headers = {
+            key: headers.get(key) for key in (
+                "x-ratelimit-limit-requests", "x-ratelimit-remaining-requests",
+                "x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens"
+            ) if headers.get(key) is not None
+        }
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """Trả lại phần token ước lượng dư sau khi biết usage thật"""
+        if actual_tokens is not None and actual_tokens < estimated_tokens:
+            self.tokens.refund(estimated_tokens - actual_tokens)
+
+    def _backoff(self, attempt: int, error: Exception, idempotent: bool = True) -> Optional[float]:
+        """Số giây chờ trước lần thử lại, None nếu không nên thử lại"""
+        if attempt >= self.max_retries or not isinstance(error, RETRYABLE_ERRORS):
+            return None
+        # Lời gọi tạo mới (assistant, thread, run...) chỉ thử lại khi chắc chắn chưa được thực hiện
+        if not idempotent and not request_not_accepted(error):
+            return None
+        # Hết quota (billing) thì thử lại cũng vô ích
+        if isinstance(error, RateLimitError) and getattr(error, "code", None) == "insufficient_quota":
+            return None
+
+        response = getattr(error, "response", None)
+        if response is not None:
+            self.update_from_headers(response.headers)
+            retry_after = parse_reset_duration(response.headers.get("retry-after"))
+            if retry_after:
+                return min(retry_after, self.backoff_max)
+
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _on_error(self, attempt: int, error: Exception, estimated_tokens: int, idempotent: bool) -> Optional[float]:
+        if isinstance(error, RateLimitError):
+            with self._stats_lock:
+                self.rate_limited += 1
+        delay = self._backoff(attempt, error, idempotent)
+        if delay is not None:
+            # Lần thử lại sẽ lấy token ước lượng lần nữa → trả lại phần của lần lỗi,
+            # trừ khi header của lỗi đã đồng bộ bucket theo số server còn lại
+            response = getattr(error, "response", None)
+            headers = getattr(response, "headers", None) or {}
+            if headers.get("x-ratelimit-remaining-tokens") is None:
+                self.tokens.refund(estimated_tokens)
+            with self._stats_lock:
+                self.retries += 1
+            logger.warning(f"⏳ OpenAI lỗi tạm thời ({type(error).__name__}), thử lại sau {delay:.1f}s (lần {attempt + 1})")
+        return delay
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], estimated_tokens: int = 0, idempotent: bool = True) -> Any:
+        """
+        Chạy `fn` (trả về raw response có .headers) trong giới hạn rate, tự retry.
+        idempotent=False: chỉ retry khi request chắc chắn chưa được server nhận (request_not_accepted)
+        """
+        attempt = 0
+        while True:
+            await self.acquire(estimated_tokens)
+            try:
+                result = await fn()
+                self.update_from_headers(getattr(result, "headers", None))
+                return result
+            except Exception as e:
+                delay = self._on_error(attempt, e, estimated_tokens, idempotent)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def call_sync(self, fn: Callable[[], Any], estimated_tokens: int = 0, idempotent: bool = True) -> Any:
+        attempt = 0
+        while True:
+            self.acquire_sync(estimated_tokens)
+            try:
+                result = fn()
+                self.update_from_headers(getattr(result, "headers", None))
+                return result
+            except Exception as e:
+                delay = self._on_error(attempt, e, estimated_tokens, idempotent)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "calls": self.calls,
+                "waits": self.waits,
+                "total_wait_seconds": round(self.total_wait_seconds, 3),
+                "avg_wait_seconds": round(self.total_wait_seconds / self.waits, 3) if self.waits else 0.0,
+                "max_wait_seconds": round(self.max_wait_seconds, 3),
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "requests_available": round(self.requests.available, 1),
+                "tokens_available": round(self.tokens.available),
+                "server_limits": self.last_headers
+            }
+
+
+rate_limiter = RateLimiter(
+    rpm=settings.openai_rpm_limit,
+    tpm=settings.openai_tpm_limit,
+    max_retries=settings.llm_max_retries,
+    backoff_base=settings.llm_backoff_base,
+    backoff_max=settings.llm_backoff_max
+)
@@ -0,0 +1,123 @@
+import logging
+import math
+import re
+from functools import lru_cache
+from typing import List, Optional
+from config.settings import settings
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken là tùy chọn, thiếu thì dùng ước lượng
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Context window (tokens) theo tiền tố tên model - tiền tố dài hơn được ưu tiên
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4.1": 1047576,
+    "gpt-4": 8192,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Số token của template prompt tạo câu hỏi (system + phần cố định của user message)
+PROMPT_TEMPLATE_TOKENS = 700
+
+_WORD_RE = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning(f"⚠️ Không tải được tokenizer cho {model}: {str(e)}, dùng ước lượng")
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base" if model.startswith(("gpt-4o", "o1", "o3", "o4")) else "cl100k_base")
+    except Exception as e:
+        logger.warning(f"⚠️ Không tải được tokenizer mặc định: {str(e)}, dùng ước lượng")
+        return None
+
+
+def _approximate_tokens(text: str) -> int:
+    """
+    Ước lượng khi không có tiktoken. Từ ASCII ~4 ký tự/token; âm tiết tiếng Việt
+    có dấu bị BPE cắt nhỏ hơn nhiều (~2 byte UTF-8/token), dấu câu = 1 token.
+    """
+    tokens = 0
+    for word in _WORD_RE.findall(text):
+        if word.isascii():
+            tokens += max(1, math.ceil(len(word) / 4))
+        else:
+            tokens += max(1, math.ceil(len(word.encode("utf-8")) / 2.5))
+    return tokens
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Số token thật của `text` theo tokenizer của model (mặc định OPENAI_MODEL)"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model or settings.openai_model or "gpt-3.5-turbo")
+    if encoding is None:
+        return _approximate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_by_tokens(text: str, max_tokens: int, model: Optional[str] = None) -> List[str]:
+    """Cắt cứng một đoạn quá dài thành các phần tối đa `max_tokens` token"""
+    encoding = _get_encoding(model or settings.openai_model or "gpt-3.5-turbo")
+    if encoding is not None:
+        ids = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+
+    # Không có tokenizer: cắt theo từ, cộng dồn số token ước lượng
+    parts, current, current_tokens = [], [], 0
+    for word in text.split(' '):
+        word_tokens = _approximate_tokens(word)
+        if word_tokens > max_tokens:
+            # Một "từ" dài bất thường (bảng, URL...) → cắt theo ký tự
+            step = max(1, len(word) * max_tokens // word_tokens)
+            pieces = [word[i:i + step] for i in range(0, len(word), step)]
+        else:
+            pieces = [word]
+        for piece in pieces:
+            piece_tokens = word_tokens if len(pieces) == 1 else _approximate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                parts.append(' '.join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        parts.append(' '.join(current))
+    return parts
+
+
+def context_window(model: Optional[str] = None) -> int:
+    model = model or settings.openai_model or ""
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def chunk_token_budget(model: Optional[str] = None) -> int:
+    """
+    Số token tối đa cho nội dung một chunk: CHUNK_TARGET_TOKENS, nhưng không vượt
+    context window trừ template prompt và AI_MAX_TOKENS dành cho output.
+    """
+    available = context_window(model) - PROMPT_TEMPLATE_TOKENS - settings.ai_max_tokens
+    return max(256, min(settings.chunk_target_tokens, available))
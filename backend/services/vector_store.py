@@ -1,5 +1,7 @@
 from openai import OpenAI
 from typing import List, Dict, Any
+from services.rate_limiter import rate_limiter
+from services.token_utils import count_tokens
 import logging
 import json
 import time
@@ -9,23 +11,36 @@ logger = logging.getLogger(__name__)
 class VectorStoreManager:
     
     def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+        # Retry do rate_limiter đảm nhiệm
+        self.client = OpenAI(api_key=api_key, max_retries=0)
         self.vector_store_id = None
         self.assistant_id = None
     
+    def _call(self, fn, *args, estimated_tokens: int = 0, idempotent: bool = True, **kwargs):
+        """
+        Mọi lời gọi OpenAI đi qua rate limiter dùng chung. Lời gọi tạo mới truyền
+        idempotent=False: timeout giữa chừng không retry (tránh assistant / store trùng, run chạy hai lần)
+        """
+        return rate_limiter.call_sync(lambda: fn(*args, **kwargs), estimated_tokens=estimated_tokens, idempotent=idempotent)
+    
     def create_vector_store(self, name: str = "PDF Documents") -> str:
 
-        vector_store = self.client.beta.vector_stores.create(name=name)
+        vector_store = self._call(self.client.beta.vector_stores.create, name=name, idempotent=False)
         self.vector_store_id = vector_store.id
         logger.info(f"✅ Đã tạo Vector Store: {vector_store.id}")
         return vector_store.id
     
     def upload_file_to_vector_store(self, file_path: str) -> str:
 
-        with open(file_path, "rb") as f:
-            file = self.client.files.create(file=f, purpose="assistants")
+        def create_file():
+            # Mở lại file mỗi lần thử: lần trước lỗi giữa chừng đã đọc dở file
+            with open(file_path, "rb") as f:
+                return self.client.files.create(file=f, purpose="assistants")
+
+        file = self._call(create_file)
         
-        self.client.beta.vector_stores.files.create(
+        self._call(
+            self.client.beta.vector_stores.files.create,
             vector_store_id=self.vector_store_id,
             file_id=file.id
         )
@@ -63,7 +78,9 @@ class VectorStoreManager:
                 '[{"question":"...", "type":"mcq", "choices":["A","B","C","D"], "answer":"..."}]'
             )
         
-        assistant = self.client.beta.assistants.create(
+        assistant = self._call(
+            self.client.beta.assistants.create,
+            idempotent=False,
             name="Trợ lý tạo câu hỏi",
             instructions=instructions,
             model=model,
@@ -86,23 +103,28 @@ class VectorStoreManager:
         for attempt in range(max_retries):
             try:
 
-                thread = self.client.beta.threads.create()
+                thread = self._call(self.client.beta.threads.create, idempotent=False)
                 
-                self.client.beta.threads.messages.create(
+                self._call(
+                    self.client.beta.threads.messages.create,
+                    idempotent=False,
                     thread_id=thread.id,
                     role="user",
                     content=prompt
                 )
                 
                 logger.info(f" Đang chạy Assistant (attempt {attempt + 1})...")
-                run = self.client.beta.threads.runs.create_and_poll(
+                run = self._call(
+                    self.client.beta.threads.runs.create_and_poll,
+                    estimated_tokens=count_tokens(prompt),
+                    idempotent=False,
                     thread_id=thread.id,
                     assistant_id=self.assistant_id,
                     timeout=120  
                 )
                 
                 if run.status == "completed":
-                    messages = self.client.beta.threads.messages.list(thread_id=thread.id)
+                    messages = self._call(self.client.beta.threads.messages.list, thread_id=thread.id)
                     response = messages.data[0].content[0].text.value
                     
                     logger.info(f" Received response: {response[:200]}...")
@@ -157,7 +179,8 @@ class VectorStoreManager:
         if not self.vector_store_id:
             return []
         
-        files = self.client.beta.vector_stores.files.list(
+        files = self._call(
+            self.client.beta.vector_stores.files.list,
             vector_store_id=self.vector_store_id
         )
         
@@ -173,13 +196,13 @@ class VectorStoreManager:
     def delete_vector_store(self):
         """Xóa Vector Store"""
         if self.vector_store_id:
-            self.client.beta.vector_stores.delete(self.vector_store_id)
+            self._call(self.client.beta.vector_stores.delete, self.vector_store_id)
             logger.info(f" Đã xóa Vector Store: {self.vector_store_id}")
             self.vector_store_id = None
     
     def delete_assistant(self):
         """Xóa Assistant"""
         if self.assistant_id:
-            self.client.beta.assistants.delete(self.assistant_id)
+            self._call(self.client.beta.assistants.delete, self.assistant_id)
             logger.info(f" Đã xóa Assistant: {self.assistant_id}")
             self.assistant_id = None
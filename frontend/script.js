@@ -198,6 +198,11 @@ function selectFile(fileId, fileName) {
     loadMyFiles(); // Refresh để hiện badge "Đã chọn"
 }
 
+async function sha256Hex(file) {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
 async function handleUpload() {
     const auth = checkAuth();
     if (!auth) return;
@@ -228,8 +233,9 @@ async function handleUpload() {
         
         // Trường hợp 1: Có file mới - kiểm tra trùng và upload
         if (file) {
-            // Kiểm tra file trùng tên
-            const checkResponse = await fetch(`${API_BASE}/check-duplicate-file?filename=${encodeURIComponent(file.name)}`, {
+            // Kiểm tra file trùng tên hoặc trùng nội dung
+            const contentHash = await sha256Hex(file);
+            const checkResponse = await fetch(`${API_BASE}/check-duplicate-file?filename=${encodeURIComponent(file.name)}&content_hash=${contentHash}`, {
                 headers: {
                     'Authorization': `Bearer ${auth.token}`
                 }
@@ -237,13 +243,37 @@ async function handleUpload() {
             
             const checkData = await checkResponse.json();
             
-            if (checkData.duplicate) {
-                // File trùng tên - BẮT BUỘC dùng file cũ, không cho upload
-                alert(`⚠️ File "${file.name}" đã tồn tại!\n\n✓ Hệ thống sẽ tự động sử dụng file đã có trong danh sách để tạo câu hỏi.`);
+            let reusedFileId = checkData.duplicate ? checkData.file_id : null;
+            
+            if (!reusedFileId && checkData.blob_exists) {
+                // Bạn đã upload nội dung này (tên khác): tạo file từ hash, không cần upload lại
+                const fromHashResponse = await fetch(`${API_BASE}/files/from-hash`, {
+                    method: 'POST',
+                    headers: {
+                        'Authorization': `Bearer ${auth.token}`,
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({
+                        content_hash: contentHash,
+                        filename: file.name
+                    })
+                });
+                
+                if (fromHashResponse.ok) {
+                    reusedFileId = (await fromHashResponse.json()).file_id;
+                    setTimeout(() => loadMyFiles(), 1000);
+                }
+            }
+            
+            if (reusedFileId) {
+                if (checkData.duplicate) {
+                    // File trùng tên/nội dung - BẮT BUỘC dùng file cũ, không cho upload
+                    alert(`⚠️ File "${file.name}" đã tồn tại!\n\n✓ Hệ thống sẽ tự động sử dụng file đã có trong danh sách để tạo câu hỏi.`);
+                }
                 
-                selectedFileId = checkData.file_id;
+                selectedFileId = reusedFileId;
                 
-                response = await fetch(`${API_BASE}/generate-from-file`, {
+                response = await fetch(`${API_BASE}/generate-from-file/stream`, {
                     method: 'POST',
                     headers: {
                         'Authorization': `Bearer ${auth.token}`,
@@ -260,7 +290,7 @@ async function handleUpload() {
                 formData.append('file', file);
                 formData.append('prompt', prompt);
 
-                response = await fetch(`${API_BASE}/upload-pdf`, {
+                response = await fetch(`${API_BASE}/upload-pdf/stream`, {
                     method: 'POST',
                     headers: {
                         'Authorization': `Bearer ${auth.token}`
@@ -274,7 +304,7 @@ async function handleUpload() {
         } 
         // Trường hợp 2: Dùng file từ danh sách
         else {
-            response = await fetch(`${API_BASE}/generate-from-file`, {
+            response = await fetch(`${API_BASE}/generate-from-file/stream`, {
                 method: 'POST',
                 headers: {
                     'Authorization': `Bearer ${auth.token}`,
@@ -287,8 +317,6 @@ async function handleUpload() {
             });
         }
 
-        const result = await response.json();
-
         // Nếu 401 Unauthorized -> redirect về login
         if (response.status === 401) {
             alert('⏰ Phiên đăng nhập đã hết hạn. Vui lòng đăng nhập lại!');
@@ -297,42 +325,32 @@ async function handleUpload() {
             return;
         }
 
-        if (response.ok && result.success) {
-            questions = result.questions;
-            displayQuestions();
-            questionsSection.style.display = 'block';
-            // Bỏ alert - hiển thị câu hỏi trực tiếp
-            console.log(`✅ Đã tạo ${questions.length} câu hỏi thành công!`);
-        } else {
-            // Xử lý lỗi chi tiết từ backend
-            let errorMsg = '❌ ';
-            
-            if (result.detail) {
-                // Nếu detail là object (lỗi kiểm tra nội dung)
-                if (typeof result.detail === 'object') {
-                    errorMsg += result.detail.error || 'Lỗi không xác định';
-                    errorMsg += '\n\n📝 ' + (result.detail.reason || '');
-                    
-                    if (result.detail.topics_found && result.detail.topics_found.length > 0) {
-                        errorMsg += '\n\n✅ Chủ đề có trong file: ' + result.detail.topics_found.join(', ');
-                    }
-                    
-                    if (result.detail.topics_missing && result.detail.topics_missing.length > 0) {
-                        errorMsg += '\n\n❌ Chủ đề thiếu: ' + result.detail.topics_missing.join(', ');
-                    }
-                    
-                    if (result.detail.suggestion) {
-                        errorMsg += '\n\n💡 ' + result.detail.suggestion;
-                    }
-                } else {
-                    errorMsg += result.detail;
+        if (!response.ok) {
+            const result = await response.json();
+            alert(formatErrorMessage(result.detail || result.error));
+            return;
+        }
+
+        // Nhận câu hỏi dần theo từng chunk (NDJSON)
+        questions = [];
+        displayQuestions();
+        await readQuestionStream(response, (event) => {
+            if (event.event === 'progress') {
+                if (event.stage === 'extracted') {
+                    setLoadingText(`Đã trích xuất ${event.pages} trang, đang chia văn bản...`);
+                } else if (event.stage === 'chunked') {
+                    setLoadingText(`Đang tạo câu hỏi từ ${event.chunks} phần văn bản...`);
                 }
-            } else {
-                errorMsg += result.error || 'Lỗi không xác định';
+            } else if (event.event === 'questions') {
+                appendQuestions(event.questions);
+                questionsSection.style.display = 'block';
+                setLoadingText(`Đã xử lý ${event.chunks_done}/${event.chunks_total} phần • ${questions.length} câu hỏi`);
+            } else if (event.event === 'done') {
+                console.log(`✅ ${event.message}`);
+            } else if (event.event === 'error') {
+                alert(formatErrorMessage(event.detail));
             }
-            
-            alert(errorMsg);
-        }
+        });
     } catch (error) {
         console.error('Error:', error);
         if (error.message && error.message.includes('Failed to fetch')) {
@@ -342,10 +360,71 @@ async function handleUpload() {
         }
     } finally {
         loading.style.display = 'none';
+        setLoadingText('Đang xử lý PDF và tạo câu hỏi...');
         uploadBtn.disabled = false;
     }
 }
 
+// Đọc response NDJSON, gọi onEvent cho mỗi dòng JSON ngay khi nhận được
+async function readQuestionStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+
+        for (const line of lines) {
+            if (line.trim()) {
+                onEvent(JSON.parse(line));
+            }
+        }
+    }
+
+    if (buffer.trim()) {
+        onEvent(JSON.parse(buffer));
+    }
+}
+
+function setLoadingText(text) {
+    const loadingText = document.getElementById('loadingText');
+    if (loadingText) {
+        loadingText.textContent = text;
+    }
+}
+
+// Xử lý lỗi chi tiết từ backend
+function formatErrorMessage(detail) {
+    let errorMsg = '❌ ';
+
+    // Nếu detail là object (lỗi kiểm tra nội dung)
+    if (detail && typeof detail === 'object') {
+        errorMsg += detail.error || 'Lỗi không xác định';
+        errorMsg += '\n\n📝 ' + (detail.reason || '');
+
+        if (detail.topics_found && detail.topics_found.length > 0) {
+            errorMsg += '\n\n✅ Chủ đề có trong file: ' + detail.topics_found.join(', ');
+        }
+
+        if (detail.topics_missing && detail.topics_missing.length > 0) {
+            errorMsg += '\n\n❌ Chủ đề thiếu: ' + detail.topics_missing.join(', ');
+        }
+
+        if (detail.suggestion) {
+            errorMsg += '\n\n💡 ' + detail.suggestion;
+        }
+    } else {
+        errorMsg += detail || 'Lỗi không xác định';
+    }
+
+    return errorMsg;
+}
+
 function displayQuestions() {
     const questionsContainer = document.getElementById('questionsContainer');
     const questionCount = document.getElementById('questionCount');
@@ -357,6 +436,16 @@ function displayQuestions() {
     });
 }
 
+// Thêm câu hỏi mới vào cuối danh sách mà không render lại toàn bộ
+function appendQuestions(newQuestions) {
+    const questionsContainer = document.getElementById('questionsContainer');
+    newQuestions.forEach(question => {
+        questions.push(question);
+        questionsContainer.appendChild(createQuestionElement(question, questions.length - 1));
+    });
+    document.getElementById('questionCount').textContent = `${questions.length} câu hỏi`;
+}
+
 function createQuestionElement(question, index) {
     const div = document.createElement('div');
     div.className = 'question-item';
@@ -415,12 +504,34 @@ function renderQuestionContent(question, index) {
         <div class="answer" id="answer-${index}" style="display: none;">
             <div class="answer-label">Đáp án:</div>
             ${question.answer}
+            ${renderEvidence(question)}
         </div>
     `;
 
     return html;
 }
 
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = String(text);
+    return div.innerHTML;
+}
+
+// Đoạn trong tài liệu làm bằng chứng cho câu hỏi (do backend tìm bằng BM25)
+function renderEvidence(question) {
+    if (!question.evidence || question.evidence.length === 0) {
+        return '';
+    }
+    const best = question.evidence[0];
+    const pages = [...new Set(question.evidence.map(e => e.page))].join(', ');
+    return `
+        <div class="evidence">
+            <div class="evidence-label">Nguồn: trang ${escapeHtml(pages)}</div>
+            <div class="evidence-text">“${escapeHtml(best.text)}”</div>
+        </div>
+    `;
+}
+
 function toggleAnswer(index) {
     const answerDiv = document.getElementById(`answer-${index}`);
     const btn = document.getElementById(`toggle-answer-${index}`);